@@ -1,39 +1,30 @@
 """Defines the API endpoint for taking admin actions."""
 
-
 from fastapi import APIRouter, Depends, HTTPException, status
 from pydantic.main import BaseModel
 
-from bot.api.app.users import SessionTokenData, get_session_token
+from bot.api.app.users import SessionTokenData, get_session_principal
+from bot.api.db import get_route_counts
+from bot.api.executor import get_executor_stats
 from bot.api.model import Audio, Generation, User
-from bot.settings import settings
+from bot.api.pipeline import get_upload_pipeline
+from bot.api.principal import Principal, get_principal_stats, invalidate_user
+from bot.api.storage import get_storage
 
 admin_router = APIRouter()
 
 
-async def is_admin(user_obj: User) -> bool:
-    email = user_obj.email
-    return email in settings.user.admin_emails
-
-
-async def assert_is_admin(token_data: SessionTokenData = Depends(get_session_token)) -> SessionTokenData:
-    admin_user_obj = await User.get_or_none(id=token_data.user_id)
-
+async def assert_is_admin(principal: Principal = Depends(get_session_principal)) -> SessionTokenData:
     # Validates that the logged in user can take admin actions.
-    if not admin_user_obj:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Admin user not found")
-    if not await is_admin(admin_user_obj):
+    if not principal.is_admin:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authorized")
 
-    return token_data
+    return SessionTokenData(user_id=principal.user_id)
 
 
 @admin_router.get("/check")
-async def admin_check(token_data: SessionTokenData = Depends(get_session_token)) -> bool:
-    user_obj = await User.get_or_none(id=token_data.user_id)
-    if user_obj is None:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="User not found")
-    return await is_admin(user_obj)
+async def admin_check(principal: Principal = Depends(get_session_principal)) -> bool:
+    return principal.is_admin
 
 
 class AdminUserRequest(BaseModel):
@@ -64,6 +55,7 @@ async def admin_act_user(
         changed = True
     if changed:
         await user_obj.save()
+        invalidate_user(user_obj.id)
     return AdminUserResponse(banned=user_obj.banned, deleted=user_obj.deleted)
 
 
@@ -122,3 +114,22 @@ async def admin_act_generation(
     if changed:
         await generation_obj.save()
     return AdminGenerationResponse(public=generation_obj.public)
+
+
+class AdminMetricsResponse(BaseModel):
+    executor: dict[str, float | int]
+    storage: dict[str, float | int]
+    uploads: dict[str, int]
+    principals: dict[str, float | int]
+    database_routes: dict[str, int]
+
+
+@admin_router.get("/metrics")
+async def admin_metrics(token_data: SessionTokenData = Depends(assert_is_admin)) -> AdminMetricsResponse:
+    return AdminMetricsResponse(
+        executor=get_executor_stats(),
+        storage=get_storage().get_metrics(),
+        uploads=get_upload_pipeline().get_stats(),
+        principals=get_principal_stats(),
+        database_routes=get_route_counts(),
+    )
@@ -2,6 +2,7 @@
 
 import asyncio
 import datetime
+import os
 import re
 from typing import Any, cast
 from uuid import UUID
@@ -12,18 +13,32 @@ from fastapi import (
     Depends,
     Form,
     HTTPException,
+    Request,
     UploadFile,
     status,
 )
-from fastapi.responses import FileResponse, RedirectResponse
+from fastapi.responses import FileResponse, RedirectResponse, Response
 from pydantic.main import BaseModel
-from tortoise.contrib.postgres.functions import Random
 from tortoise.expressions import Q
 from tortoise.transactions import in_transaction
 
-from bot.api.app.users import SessionTokenData, get_session_token
-from bot.api.audio import delete_audio as delete_audio_impl, get_audio_url, save_audio_file
-from bot.api.model import Audio, AudioDeleteTask, AudioSource, cast_audio_source
+from bot.api.app.users import SessionTokenData, check_principal, get_session_token
+from bot.api.audio import (
+    PEAK_RESOLUTIONS,
+    delete_audio as delete_audio_impl,
+    get_object_name,
+    save_audio_file,
+    save_audio_file_pending,
+)
+from bot.api.counters import get_audio_count
+from bot.api.cursor import after_cursor, next_cursor
+from bot.api.db import DEFAULT_CONNECTION, use_read_replica
+from bot.api.executor import run_in_executor
+from bot.api.model import Audio, AudioDeleteTask, AudioPeaks, AudioSource, AudioStatus, cast_audio_source
+from bot.api.pipeline import get_upload_pipeline
+from bot.api.sampling import sample_values
+from bot.api.search import search_audio
+from bot.api.storage import get_storage
 from bot.settings import settings
 
 MAX_UUIDS_PER_QUERY = 100
@@ -33,29 +48,49 @@ audio_router = APIRouter()
 
 class QueryMeResponse(BaseModel):
     ids: list[int]
-    total: int
+    total: int | None
+    next_cursor: str | None
 
 
-@audio_router.get("/query/me", response_model=QueryMeResponse)
+@audio_router.get("/query/me", response_model=QueryMeResponse, dependencies=[Depends(use_read_replica)])
 async def query_me(
-    start: int,
     limit: int,
+    start: int = 0,
+    cursor: str | None = None,
     q: str = "",
     source: AudioSource | None = None,
     user_data: SessionTokenData = Depends(get_session_token),
 ) -> QueryMeResponse:
-    start = max(start, 0)
     limit = min(limit, MAX_UUIDS_PER_QUERY)
-    query = Audio.filter(user_id=user_data.user_id)
+
+    # Search results are ranked by how well they match, so they are paged
+    # by offset rather than by cursor.
     if len(q) > 0:
-        query = query.filter(name__icontains=q)
+        ids, total = await search_audio(user_data.user_id, q, source, max(start, 0), limit)
+        return QueryMeResponse(ids=ids, total=total, next_cursor=None)
+
+    query = Audio.filter(user_id=user_data.user_id)
     if source is not None:
         query = query.filter(source=source)
-    ids, total = await asyncio.gather(
-        query.order_by("-created").offset(start).limit(limit).values_list("id", flat=True),
-        query.count(),
+
+    # Pages after the first one are fetched with the cursor from the previous
+    # page, and skip counting the total, which doesn't change between pages.
+    # Offsets are still supported for older clients. The total comes from
+    # the user's counters.
+    page_query = query.order_by("-created", "-id")
+    if cursor is not None:
+        rows = await after_cursor(page_query, "created", cursor).limit(limit + 1).values("id", "created")
+        total = None
+    else:
+        rows, total = await asyncio.gather(
+            page_query.offset(max(start, 0)).limit(limit + 1).values("id", "created"),
+            get_audio_count(user_data.user_id, source),
+        )
+    return QueryMeResponse(
+        ids=[row["id"] for row in rows[:limit]],
+        total=total,
+        next_cursor=next_cursor(rows, "created", limit),
     )
-    return QueryMeResponse(ids=cast(list[int], ids), total=total)
 
 
 class SingleIdResponse(BaseModel):
@@ -67,10 +102,11 @@ class SingleIdResponse(BaseModel):
     num_channels: int
     sample_rate: int
     duration: float
+    status: AudioStatus
 
     @staticmethod
     def keys() -> tuple[str, ...]:
-        return ("id", "name", "source", "created", "num_frames", "num_channels", "sample_rate", "duration")
+        return ("id", "name", "source", "created", "num_frames", "num_channels", "sample_rate", "duration", "status")
 
 
 class QueryIdsRequest(BaseModel):
@@ -93,6 +129,38 @@ async def query_ids(
     return QueryIdsResponse(infos=infos)
 
 
+class QueryPeaksRequest(BaseModel):
+    ids: list[int]
+    num_bins: int = PEAK_RESOLUTIONS[0]
+
+
+class SinglePeaksResponse(BaseModel):
+    id: int
+    min: list[int]
+    max: list[int]
+
+
+class QueryPeaksResponse(BaseModel):
+    infos: list[SinglePeaksResponse]
+
+
+@audio_router.post("/query/peaks", response_model=QueryPeaksResponse)
+async def query_peaks(
+    data: QueryPeaksRequest,
+    user_data: SessionTokenData = Depends(get_session_token),
+) -> QueryPeaksResponse:
+    if data.num_bins not in PEAK_RESOLUTIONS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Number of bins must be one of {', '.join(map(str, PEAK_RESOLUTIONS))}",
+        )
+    ids = data.ids[:MAX_UUIDS_PER_QUERY]
+    query = Q(audio_id__in=ids) & (Q(audio__user_id=user_data.user_id) | Q(audio__public=True))
+    rows = await AudioPeaks.filter(query).values_list("audio_id", "peaks")
+    infos = [SinglePeaksResponse(id=audio_id, **peaks[str(data.num_bins)]) for audio_id, peaks in rows]
+    return QueryPeaksResponse(infos=infos)
+
+
 async def delete_audio_in_background(key: UUID) -> None:
     await delete_audio_impl(key)
     await AudioDeleteTask.filter(key=key).delete()
@@ -104,7 +172,7 @@ async def delete_audio(
     background_tasks: BackgroundTasks,
     user_data: SessionTokenData = Depends(get_session_token),
 ) -> bool:
-    async with in_transaction():
+    async with in_transaction(DEFAULT_CONNECTION):
         audio = await Audio.get(id=id, user_id=user_data.user_id)
         await asyncio.gather(AudioDeleteTask.create(key=audio.key), audio.delete())
     background_tasks.add_task(delete_audio_in_background, audio.key)
@@ -134,21 +202,103 @@ def get_media_filename(name: str) -> str:
     return name
 
 
+def parse_range(range_header: str, size: int) -> tuple[int, int] | None:
+    """Parses a single byte range from a Range header.
+
+    Args:
+        range_header: The value of the Range header.
+        size: The size of the file, in bytes.
+
+    Returns:
+        The first and last byte of the range, inclusive, or None if the
+        header should be ignored and the whole file served.
+
+    Raises:
+        HTTPException: If the range can't be satisfied.
+    """
+    unit, _, ranges = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in ranges:
+        return None
+    start_str, sep, end_str = ranges.strip().partition("-")
+    if not sep:
+        return None
+    try:
+        if start_str:
+            start = int(start_str)
+            end = min(int(end_str), size - 1) if end_str else size - 1
+        else:
+            start, end = max(size - int(end_str), 0), size - 1
+    except ValueError:
+        return None
+    if start > end or start >= size:
+        raise HTTPException(
+            status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+            headers={"Content-Range": f"bytes */{size}"},
+        )
+    return start, end
+
+
+def _read_range(fs_path: str, start: int, end: int) -> bytes:
+    with open(fs_path, "rb") as f:
+        f.seek(start)
+        return f.read(end - start + 1)
+
+
 @audio_router.get(f"/media/{{media_id}}.{settings.file.audio.file_ext}")
-async def get_media(media_id: int, access_token: str | None = None) -> FileResponse:
+async def get_media(request: Request, media_id: int, access_token: str | None = None) -> Response:
     if access_token is None:
-        audio = await Audio.get_or_none(Q(id=media_id) & Q(public=True))
+        audio = await Audio.get_or_none(Q(id=media_id) & Q(public=True), status=AudioStatus.ready)
     else:
         user_id = SessionTokenData.decode(access_token).user_id
-        audio = await Audio.get_or_none(Q(id=media_id) & (Q(user_id=user_id) | Q(public=True)))
+        await check_principal(user_id)
+        audio = await Audio.get_or_none(
+            Q(id=media_id) & (Q(user_id=user_id) | Q(public=True)), status=AudioStatus.ready
+        )
     if audio is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Audio not found")
     name = get_media_filename(audio.name)
-    audio_url, is_url = await get_audio_url(audio)
-    headers = {"Content-Disposition": f"attachment; filename={name}"}
-    if is_url:
-        return RedirectResponse(audio_url, headers=headers)  # type: ignore[return-value]
-    return FileResponse(audio_url, headers=headers)
+    storage, object_name = get_storage(), get_object_name(audio.key)
+    if (audio_url := await storage.get_url(object_name)) is not None:
+        return RedirectResponse(audio_url, headers={"Content-Disposition": f"attachment; filename={name}"})
+
+    # The contents of an audio file never change for a given key, so the key
+    # can be used as a strong ETag, and public files can be cached forever.
+    etag = f'"{audio.key}"'
+    headers = {
+        "Content-Disposition": f"attachment; filename={name}",
+        "ETag": etag,
+        "Cache-Control": "public, max-age=31536000, immutable" if audio.public else "private, no-cache",
+        "Accept-Ranges": "bytes",
+    }
+    if_none_match = request.headers.get("If-None-Match")
+    if if_none_match is not None:
+        etags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        if etag in etags or "*" in etags:
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    media_type = f"audio/{settings.file.audio.file_ext}"
+    audio_path = storage.get_path(object_name)
+    range_header = request.headers.get("Range")
+    if range_header is None:
+        if audio_path is not None:
+            return FileResponse(audio_path, media_type=media_type, headers=headers)
+        return Response(await storage.get(object_name), media_type=media_type, headers=headers)
+
+    if audio_path is not None:
+        size = os.path.getsize(audio_path)
+        if (byte_range := parse_range(range_header, size)) is None:
+            return FileResponse(audio_path, media_type=media_type, headers=headers)
+        start, end = byte_range
+        content = await run_in_executor(_read_range, audio_path, start, end)
+    else:
+        data = await storage.get(object_name)
+        size = len(data)
+        if (byte_range := parse_range(range_header, size)) is None:
+            return Response(data, media_type=media_type, headers=headers)
+        start, end = byte_range
+        content = data[start : end + 1]
+    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    return Response(content, status_code=status.HTTP_206_PARTIAL_CONTENT, media_type=media_type, headers=headers)
 
 
 class UploadResponse(BaseModel):
@@ -171,6 +321,46 @@ async def upload(
     return UploadResponse(id=audio_entry.id)
 
 
+@audio_router.post("/upload/async", response_model=UploadResponse)
+async def upload_async(
+    file: UploadFile,
+    source: str = Form(...),
+    user_data: SessionTokenData = Depends(get_session_token),
+) -> UploadResponse:
+    source_enum = cast_audio_source(source)
+    if source_enum not in (AudioSource.uploaded, AudioSource.recorded):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Source must be one of {AudioSource.uploaded}, {AudioSource.recorded}",
+        )
+    pipeline = get_upload_pipeline()
+    if pipeline.is_full():
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Too many pending uploads")
+    audio_entry = await save_audio_file_pending(user_data.user_id, source_enum, file, file.filename)
+    if not pipeline.submit(audio_entry.id):
+        # The queue filled up while the upload was being stored. Converting
+        # it here would get around the limit on concurrent conversions, so
+        # the upload is dropped instead.
+        await audio_entry.delete()
+        await delete_audio_impl(audio_entry.key)
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Too many pending uploads")
+    return UploadResponse(id=audio_entry.id)
+
+
+class StatusResponse(BaseModel):
+    id: int
+    status: AudioStatus
+
+
+@audio_router.get("/status/{audio_id}", response_model=StatusResponse)
+async def get_status(audio_id: int, user_data: SessionTokenData = Depends(get_session_token)) -> StatusResponse:
+    query = Q(id=audio_id) & (Q(user_id=user_data.user_id) | Q(public=True))
+    audio_status = await Audio.filter(query).first().values_list("status", flat=True)
+    if audio_status is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Audio not found")
+    return StatusResponse(id=audio_id, status=cast(AudioStatus, audio_status))
+
+
 class PublicIdsRequest(BaseModel):
     count: int
     source: AudioSource | None = None
@@ -180,15 +370,12 @@ class PublicIdsResponse(BaseModel):
     infos: list[SingleIdResponse]
 
 
-@audio_router.post("/public", response_model=PublicIdsResponse)
+@audio_router.post("/public", response_model=PublicIdsResponse, dependencies=[Depends(use_read_replica)])
 async def public_ids(data: PublicIdsRequest) -> PublicIdsResponse:
     count = min(data.count, MAX_UUIDS_PER_QUERY)
     values = SingleIdResponse.keys()
-    query = Audio.filter(public=True)
+    query = Audio.filter(public=True, status=AudioStatus.ready)
     if data.source is not None:
         query = query.filter(source=data.source)
-    # Note that RANDOM is shared between PostgreSQL and SQLite, but not MySQL.
-    query = query.annotate(order=Random()).order_by("order")
-    query = query.limit(count)
-    infos = [SingleIdResponse(**info) for info in await query.values(*values)]
+    infos = [SingleIdResponse(**info) for info in await sample_values(query, count, *values)]
     return PublicIdsResponse(infos=infos)
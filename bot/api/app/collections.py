@@ -7,6 +7,7 @@ from fastapi import APIRouter, Depends
 from pydantic.main import BaseModel
 
 from bot.api.app.users import SessionTokenData, get_session_token
+from bot.api.db import use_read_replica
 from bot.api.model import Collection
 
 collections_router = APIRouter()
@@ -16,7 +17,9 @@ class SingleCollectionResponse(BaseModel):
     audio_ids: list[int]
 
 
-@collections_router.get("/query/collection", response_model=SingleCollectionResponse)
+@collections_router.get(
+    "/query/collection", response_model=SingleCollectionResponse, dependencies=[Depends(use_read_replica)]
+)
 async def query_collection(
     name: str,
     user_data: SessionTokenData = Depends(get_session_token),
@@ -32,7 +35,7 @@ class MyCollectionsResponse(BaseModel):
     names: list[str]
 
 
-@collections_router.get("/query/me")
+@collections_router.get("/query/me", dependencies=[Depends(use_read_replica)])
 async def query_my_collections(user_data: SessionTokenData = Depends(get_session_token)) -> MyCollectionsResponse:
     names = cast(
         list[str],
@@ -84,7 +87,7 @@ class QueryIdsResponse(BaseModel):
     ids: list[QueryIdsSingleResponse]
 
 
-@collections_router.post("/query/ids", response_model=QueryIdsResponse)
+@collections_router.post("/query/ids", response_model=QueryIdsResponse, dependencies=[Depends(use_read_replica)])
 async def query_ids(
     data: QueryIdsRequest,
     user_data: SessionTokenData = Depends(get_session_token),
@@ -5,10 +5,13 @@ from typing import cast
 
 from fastapi import APIRouter, Depends, HTTPException, status
 from pydantic.main import BaseModel
-from tortoise.contrib.postgres.functions import Random
 
 from bot.api.app.users import SessionTokenData, get_session_token
+from bot.api.counters import get_generation_count
+from bot.api.cursor import after_cursor, next_cursor
+from bot.api.db import use_read_replica
 from bot.api.model import Generation
+from bot.api.sampling import sample_values
 
 MAX_GENERATIONS_PER_QUERY = 100
 
@@ -19,13 +22,11 @@ class InfoMeResponse(BaseModel):
     count: int
 
 
-@generation_router.get("/info/me", response_model=InfoMeResponse)
+@generation_router.get("/info/me", response_model=InfoMeResponse, dependencies=[Depends(use_read_replica)])
 async def info_me(
     user_data: SessionTokenData = Depends(get_session_token),
 ) -> InfoMeResponse:
-    query = Generation.filter(user_id=user_data.user_id)
-    count = await query.count()
-    return InfoMeResponse(count=count)
+    return InfoMeResponse(count=await get_generation_count(user_data.user_id))
 
 
 class SingleGenerationResponse(BaseModel):
@@ -42,22 +43,27 @@ class SingleGenerationResponse(BaseModel):
 
 class QueryMeResponse(BaseModel):
     generations: list[SingleGenerationResponse]
+    next_cursor: str | None
 
 
-@generation_router.get("/query/me", response_model=QueryMeResponse)
+@generation_router.get("/query/me", response_model=QueryMeResponse, dependencies=[Depends(use_read_replica)])
 async def query_me(
-    start: int,
     limit: int,
+    start: int = 0,
+    cursor: str | None = None,
     user_data: SessionTokenData = Depends(get_session_token),
 ) -> QueryMeResponse:
-    start = max(start, 0)
     limit = min(limit, MAX_GENERATIONS_PER_QUERY)
-    query = Generation.filter(user_id=user_data.user_id)
-    generations = cast(
-        list[SingleGenerationResponse],
-        await query.order_by("-task_finished").offset(start).limit(limit).values(*SingleGenerationResponse.keys()),
+    query = Generation.filter(user_id=user_data.user_id).order_by("-task_finished", "-id")
+    if cursor is not None:
+        query = after_cursor(query, "task_finished", cursor)
+    else:
+        query = query.offset(max(start, 0))
+    rows = await query.limit(limit + 1).values(*SingleGenerationResponse.keys())
+    return QueryMeResponse(
+        generations=cast(list[SingleGenerationResponse], rows[:limit]),
+        next_cursor=next_cursor(rows, "task_finished", limit),
     )
-    return QueryMeResponse(generations=generations)
 
 
 @generation_router.get("/id", response_model=SingleGenerationResponse)
@@ -82,12 +88,12 @@ class PublicIdsResponse(BaseModel):
     infos: list[SingleGenerationResponse]
 
 
-@generation_router.post("/public", response_model=PublicIdsResponse)
+@generation_router.post("/public", response_model=PublicIdsResponse, dependencies=[Depends(use_read_replica)])
 async def public_ids(data: PublicIdsRequest) -> PublicIdsResponse:
     count = min(data.count, MAX_GENERATIONS_PER_QUERY)
     query = Generation.filter(public=True)
     generations = cast(
         list[SingleGenerationResponse],
-        await query.annotate(order=Random()).order_by("order").limit(count).values(*SingleGenerationResponse.keys()),
+        await sample_values(query, count, *SingleGenerationResponse.keys()),
     )
     return PublicIdsResponse(infos=generations)
@@ -5,11 +5,12 @@ from typing import Any
 
 import aiohttp
 from aiohttp.client import ClientSession
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, status
 from pydantic.main import BaseModel
 from yarl import URL
 
 from bot.api.app.users import SessionTokenData, get_session_token
+from bot.api.model import Audio, AudioStatus
 from bot.settings import settings
 
 logger = logging.getLogger(__name__)
@@ -48,6 +49,9 @@ class RunResponse(BaseModel):
 
 @infer_router.post("/run", response_model=RunResponse)
 async def run(data: RunRequest, user_data: SessionTokenData = Depends(get_session_token)) -> RunResponse:
+    audio_ids = [data.source_id, data.reference_id]
+    if await Audio.filter(id__in=audio_ids).exclude(status=AudioStatus.ready).exists():
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Audio is not ready")
     endpoint = URL.build(path="/", query={"source_id": data.source_id, "reference_id": data.reference_id})
     response_data = await make_request(endpoint)
     return RunResponse(**response_data)
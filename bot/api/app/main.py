@@ -24,6 +24,11 @@ from bot.api.app.generation import generation_router
 from bot.api.app.infer import infer_router
 from bot.api.app.users import users_router
 from bot.api.db import get_config
+from bot.api.executor import shutdown_executor
+from bot.api.pipeline import close_upload_pipeline, get_upload_pipeline
+from bot.api.principal import clear_principal_cache
+from bot.api.search import init_search
+from bot.api.storage import close_storage
 from bot.settings import settings
 
 logger = logging.getLogger(__name__)
@@ -35,10 +40,16 @@ async def lifespan(app: FastAPI) -> AsyncGenerator[None, None]:
     if settings.database.generate_schemas:
         logger.info("Generating schemas...")
         await Tortoise.generate_schemas()
+    await init_search()
+    get_upload_pipeline().start()
     try:
         yield
     finally:
+        await close_upload_pipeline()
+        clear_principal_cache()
         await Tortoise.close_connections()
+        await close_storage()
+        shutdown_executor()
 
 
 app = FastAPI(lifespan=lifespan)
@@ -9,9 +9,13 @@ import aiohttp
 from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
 from fastapi.security.utils import get_authorization_scheme_param
 from pydantic.main import BaseModel
+from tortoise.expressions import Q, Subquery
+from tortoise.transactions import in_transaction
 
+from bot.api.db import DEFAULT_CONNECTION
 from bot.api.email import OneTimePassPayload, send_delete_email, send_otp_email, send_waitlist_email
-from bot.api.model import Token, User
+from bot.api.model import Audio, AudioDeleteTask, Generation, User, subtract_generation_counts
+from bot.api.principal import Principal, get_principal, get_token_info, invalidate_user
 from bot.api.token import create_refresh_token, create_token, load_refresh_token, load_token
 from bot.settings import settings
 
@@ -192,7 +196,21 @@ async def get_refresh_token(request: Request) -> RefreshTokenData:
     raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
 
 
-async def get_session_token(request: Request) -> SessionTokenData:
+async def check_principal(user_id: int) -> Principal:
+    principal = await get_principal(user_id)
+
+    # Validates that the user can still use the API.
+    if principal is None:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="User not found")
+    if principal.banned:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User is not allowed to log in")
+    if principal.deleted:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User is deleted")
+
+    return principal
+
+
+def decode_session_token(request: Request) -> SessionTokenData:
     # Tries Authorization header.
     authorization = request.headers.get("Authorization") or request.headers.get("authorization")
     if authorization:
@@ -211,24 +229,56 @@ async def get_session_token(request: Request) -> SessionTokenData:
     raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
 
 
+async def get_session_token(request: Request) -> SessionTokenData:
+    token_data = decode_session_token(request)
+    await check_principal(token_data.user_id)
+    return token_data
+
+
+async def get_session_principal(request: Request) -> Principal:
+    return await check_principal(decode_session_token(request).user_id)
+
+
+async def get_deletable_session_token(request: Request) -> SessionTokenData:
+    # Banned users can still delete their own account, so this only rejects
+    # users which are already gone.
+    token_data = decode_session_token(request)
+    principal = await get_principal(token_data.user_id)
+    if principal is None:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="User not found")
+    if principal.deleted:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User is deleted")
+    return token_data
+
+
 class UserInfoResponse(BaseModel):
     email: str
 
 
 @users_router.get("/me", response_model=UserInfoResponse)
-async def get_user_info(data: SessionTokenData = Depends(get_session_token)) -> UserInfoResponse:
-    user_obj = await User.get_or_none(id=data.user_id)
-    if user_obj is None:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="User not found")
-    return UserInfoResponse(email=user_obj.email)
+async def get_user_info(principal: Principal = Depends(get_session_principal)) -> UserInfoResponse:
+    return UserInfoResponse(email=principal.email)
 
 
 @users_router.delete("/me")
-async def delete_user(data: SessionTokenData = Depends(get_session_token)) -> bool:
+async def delete_user(data: SessionTokenData = Depends(get_deletable_session_token)) -> bool:
     user_obj = await User.get_or_none(id=data.user_id)
     if user_obj is None:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="User not found")
-    await user_obj.delete()
+    # Deleting the user cascades to their audio rows, so the blobs are queued
+    # up to be removed by the sweeper.
+    async with in_transaction(DEFAULT_CONNECTION) as conn:
+        keys = await Audio.filter(user_id=user_obj.id).values_list("key", flat=True)
+        await AudioDeleteTask.bulk_create([AudioDeleteTask(key=key) for key in keys])
+        # The cascade also removes other users' generations which used this
+        # user's audio, without going through the signals.
+        audio_ids = Subquery(Audio.filter(user_id=user_obj.id).values("id"))
+        cascaded = Generation.filter(
+            Q(source_id__in=audio_ids) | Q(reference_id__in=audio_ids) | Q(output_id__in=audio_ids)
+        ).exclude(user_id=user_obj.id)
+        await subtract_generation_counts(cascaded, conn)
+        await user_obj.delete()
+    invalidate_user(user_obj.id)
     await send_delete_email(user_obj.email)
     return True
 
@@ -247,9 +297,10 @@ class RefreshTokenResponse(BaseModel):
 
 @users_router.post("/refresh", response_model=RefreshTokenResponse)
 async def refresh(response: Response, data: RefreshTokenData = Depends(get_refresh_token)) -> RefreshTokenResponse:
-    token = await Token.get_or_none(id=data.token_id)
-    if not token or token.disabled:
+    token_info = await get_token_info(data.token_id)
+    if token_info is None or token_info.disabled or token_info.user_id != data.user_id:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid token")
+    await check_principal(data.user_id)
     session_token = SessionTokenData(user_id=data.user_id).encode()
     set_token_cookie(response, session_token, SESSION_TOKEN_COOKIE_KEY)
     return RefreshTokenResponse(token=session_token, token_type=TOKEN_TYPE)
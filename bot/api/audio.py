@@ -1,113 +1,227 @@
 """Defines functions for managing audio files."""
 
-import functools
 import logging
 import mimetypes
 import os
 import shutil
 import tempfile
+import datetime
 import uuid
 from hashlib import sha1
 from io import BytesIO
-from pathlib import Path
-from typing import Literal, cast, get_args
+from typing import IO, BinaryIO
 from uuid import UUID
 
-import aioboto3
 import numpy as np
+import resampy
+import soundfile as sf
 from fastapi import UploadFile
 from pydub import AudioSegment
-
-from bot.api.model import Audio, AudioSource
+from pydub.utils import mediainfo
+from tortoise import timezone
+from tortoise.expressions import Q
+from tortoise.transactions import in_transaction
+
+from bot.api.db import DEFAULT_CONNECTION
+from bot.api.executor import run_in_executor
+from bot.api.model import Audio, AudioPeaks, AudioSource, AudioStatus
+from bot.api.storage import get_storage
 from bot.settings import settings
 
 DEFAULT_NAME = "Untitled"
+UPLOAD_CHUNK_SIZE = 1024 * 1024
 
-logger = logging.getLogger(__name__)
+# The number of bins to compute waveform peaks for, from coarse to fine.
+PEAK_RESOLUTIONS = (64, 256, 1024)
 
-FSType = Literal["file", "s3"]
+logger = logging.getLogger(__name__)
 
 AudioSegment.converter = shutil.which("ffmpeg")
 
 
-@functools.lru_cache()
-def get_fs_type() -> FSType:
-    fs_type_str = settings.file.fs_type
-    assert fs_type_str in get_args(FSType), f"Invalid file system type in configuration: {fs_type_str}"
-    return cast(FSType, fs_type_str)
+def get_object_name(key: UUID) -> str:
+    return f"{key}.{settings.file.audio.file_ext}"
 
 
-def _get_file_path(key: UUID) -> str:
-    (dir_path := Path(settings.file.local.root_dir).expanduser().resolve()).mkdir(parents=True, exist_ok=True)
-    return str(dir_path / f"{key}.{settings.file.audio.file_ext}")
+def get_upload_name(key: UUID) -> str:
+    return f"{key}.upload"
 
 
-def _get_s3_path(key: UUID) -> str:
-    return f"{settings.file.s3.subfolder}/{key}.{settings.file.audio.file_ext}"
+def get_sidecar_name(key: UUID) -> str:
+    return f"{key}.npy"
 
 
-async def _save_audio(user_id: int, source: AudioSource, name: str | None, audio: AudioSegment) -> Audio:
-    # Standardizes the audio format.
-    if audio.frame_rate < settings.file.audio.min_sample_rate:
+def _check_sample_rate(sample_rate: int) -> None:
+    if sample_rate < settings.file.audio.min_sample_rate:
         raise ValueError(
             f"Audio sample rate must be at least {settings.file.audio.min_sample_rate} frames per second, "
-            f"got {audio.frame_rate} frames per second"
+            f"got {sample_rate} frames per second"
         )
-    if audio.frame_rate != settings.file.audio.sample_rate:
-        audio = audio.set_frame_rate(settings.file.audio.sample_rate)
-    if audio.sample_width != settings.file.audio.sample_width:
-        audio = audio.set_sample_width(settings.file.audio.sample_width)
-    if audio.channels != settings.file.audio.num_channels:
-        audio = audio.set_channels(settings.file.audio.num_channels)
-    if audio.duration_seconds < settings.file.audio.min_duration:
+
+
+def _check_duration(duration: float) -> None:
+    if duration < settings.file.audio.min_duration:
         raise ValueError(
             f"Audio duration must be greater than {settings.file.audio.min_duration} seconds, "
-            f"got {audio.duration_seconds} seconds"
+            f"got {duration} seconds"
         )
-    if audio.duration_seconds > settings.file.audio.max_duration:
+    if duration > settings.file.audio.max_duration:
         raise ValueError(
-            f"Audio duration must be less than {settings.file.audio.max_duration} seconds, "
-            f"got {audio.duration_seconds} seconds"
+            f"Audio duration must be less than {settings.file.audio.max_duration} seconds, got {duration} seconds"
         )
 
+
+def _encode_audio(audio_array: np.ndarray) -> BytesIO:
+    """Encodes audio samples in the stored format, in memory.
+
+    Args:
+        audio_array: The audio samples, with shape ``(T)`` or ``(T, C)``.
+
+    Returns:
+        A buffer containing the encoded file, positioned at the start.
+    """
+    audio_settings = settings.file.audio
+    buffer = BytesIO()
+    sf.write(
+        buffer,
+        audio_array,
+        audio_settings.sample_rate,
+        subtype=f"PCM_{audio_settings.sample_width * 8}",
+        format=audio_settings.file_ext.upper(),
+    )
+    buffer.seek(0)
+    return buffer
+
+
+def _encode_sidecar(audio_array: np.ndarray) -> bytes:
+    # NumPy pads the header so that the data is aligned, which means the
+    # sidecar can be memory-mapped directly.
+    buffer = BytesIO()
+    np.save(buffer, np.ascontiguousarray(audio_array, dtype=np.int16), allow_pickle=False)
+    return buffer.getvalue()
+
+
+def load_sidecar(file: str | BinaryIO) -> np.ndarray:
+    """Loads the raw samples from a sidecar file.
+
+    Args:
+        file: The path to the sidecar file, or a file-like object.
+
+    Returns:
+        The audio samples. If a path is given, the file is memory-mapped
+        read-only rather than read into memory.
+    """
+    if isinstance(file, str):
+        return np.load(file, mmap_mode="r", allow_pickle=False)
+    return np.load(file, allow_pickle=False)
+
+
+def pcm_to_float(audio_array: np.ndarray, sample_width: int = 2) -> np.ndarray:
+    """Converts integer samples to float32 samples in ``[-1, 1]``.
+
+    This is done in a single pass, without an intermediate copy, so that it
+    is cheap on memory-mapped arrays.
+
+    Args:
+        audio_array: The integer samples.
+        sample_width: The width of each sample, in bytes.
+
+    Returns:
+        The float32 samples.
+    """
+    return np.multiply(audio_array, np.float32(1 / (1 << (sample_width * 8 - 1))), dtype=np.float32)
+
+
+def float_to_pcm(audio_array: np.ndarray) -> np.ndarray:
+    """Converts float samples to integer samples in the stored sample width.
+
+    Args:
+        audio_array: The float samples, in ``[-1, 1]``.
+
+    Returns:
+        The integer samples, clipped to the range of the sample width.
+    """
+    sample_width = settings.file.audio.sample_width
+    scale = 1 << (sample_width * 8 - 1)
+    scaled = np.multiply(audio_array, scale, dtype=np.float32)
+    np.clip(scaled, -scale, scale - 1, out=scaled)
+    return scaled.astype(f"<i{sample_width}")
+
+
+def compute_peaks(audio_array: np.ndarray) -> dict[str, dict[str, list[int]]]:
+    """Computes the waveform peaks of some audio at a few resolutions.
+
+    The audio is split into equal bins, and the minimum and maximum sample in
+    each bin is kept, across all channels, scaled to ``[-127, 127]``. This is
+    enough to draw the waveform without downloading the audio.
+
+    Args:
+        audio_array: The integer samples, in the stored format.
+
+    Returns:
+        The minimum and maximum of each bin, keyed by the number of bins.
+    """
+    if audio_array.ndim > 1:
+        mins, maxs = audio_array.min(axis=1), audio_array.max(axis=1)
+    else:
+        mins = maxs = audio_array
+    sample_width = settings.file.audio.sample_width
+    peaks: dict[str, dict[str, list[int]]] = {}
+    for num_bins in PEAK_RESOLUTIONS:
+        starts = np.linspace(0, len(mins), num_bins, endpoint=False).astype(np.int64)
+        bin_mins = pcm_to_float(np.minimum.reduceat(mins, starts), sample_width)
+        bin_maxs = pcm_to_float(np.maximum.reduceat(maxs, starts), sample_width)
+        peaks[str(num_bins)] = {
+            "min": np.round(bin_mins * 127).astype(np.int8).tolist(),
+            "max": np.round(bin_maxs * 127).astype(np.int8).tolist(),
+        }
+    return peaks
+
+
+def _new_key(user_id: int) -> UUID:
     key_bytes = sha1(uuid.NAMESPACE_OID.bytes + f"user-{user_id}".encode("utf-8") + os.urandom(16))
-    key = UUID(bytes=key_bytes.digest()[:16], version=5)
-    fs_type = get_fs_type()
-    max_bytes = settings.file.audio.max_mb * 1024 * 1024
+    return UUID(bytes=key_bytes.digest()[:16], version=5)
+
+
+async def _store_audio(key: UUID, audio_array: np.ndarray) -> tuple[int, int, float]:
+    # The audio array is expected to already be in the stored format.
+    num_frames = audio_array.shape[0]
+    num_channels = 1 if audio_array.ndim == 1 else audio_array.shape[1]
+    if num_channels != settings.file.audio.num_channels:
+        raise ValueError(f"Expected {settings.file.audio.num_channels} channels, got {num_channels}")
+    duration = num_frames / settings.file.audio.sample_rate
+    _check_duration(duration)
+
+    buffer = await run_in_executor(_encode_audio, audio_array)
+    if buffer.getbuffer().nbytes > settings.file.audio.max_mb * 1024 * 1024:
+        raise ValueError("Audio file is too large")
+
+    storage = get_storage()
+    await storage.put(get_object_name(key), buffer.getvalue())
+    if settings.file.audio.write_sidecar:
+        await storage.put(get_sidecar_name(key), await run_in_executor(_encode_sidecar, audio_array))
+    return num_frames, num_channels, duration
+
 
-    match fs_type:
-        case "file":
-            with tempfile.NamedTemporaryFile(suffix=f".{settings.file.audio.file_ext}", delete=False) as temp_file:
-                audio.export(temp_file.name, format=settings.file.audio.file_ext)
-            if os.path.getsize(temp_file.name) > max_bytes:
-                raise ValueError("Audio file is too large")
-            shutil.move(temp_file.name, _get_file_path(key))
-
-        case "s3":
-            with tempfile.NamedTemporaryFile(suffix=f".{settings.file.audio.file_ext}") as temp_file:
-                audio.export(temp_file.name, format=settings.file.audio.file_ext)
-                if os.path.getsize(temp_file.name) > max_bytes:
-                    raise ValueError("Audio file is too large")
-                s3_bucket = settings.file.s3.bucket
-                session = aioboto3.Session()
-                async with session.resource("s3") as s3:
-                    bucket = await s3.Bucket(s3_bucket)
-                    await bucket.upload_file(temp_file.name, _get_s3_path(key))
-
-        case _:
-            raise ValueError(f"Invalid file system type: {fs_type}")
+async def _save_audio(user_id: int, source: AudioSource, name: str | None, audio_array: np.ndarray) -> Audio:
+    key = _new_key(user_id)
+    num_frames, num_channels, duration = await _store_audio(key, audio_array)
+    peaks = await run_in_executor(compute_peaks, audio_array)
 
     # Creates and returns a new audio entry for the file.
-    return await Audio.create(
-        key=key,
-        name=DEFAULT_NAME if name is None else name,
-        user_id=user_id,
-        source=source,
-        num_frames=audio.frame_count(),
-        num_channels=audio.channels,
-        sample_rate=audio.frame_rate,
-        duration=audio.duration_seconds,
-    )
+    async with in_transaction(DEFAULT_CONNECTION):
+        audio = await Audio.create(
+            key=key,
+            name=DEFAULT_NAME if name is None else name,
+            user_id=user_id,
+            source=source,
+            num_frames=num_frames,
+            num_channels=num_channels,
+            sample_rate=settings.file.audio.sample_rate,
+            duration=duration,
+        )
+        await AudioPeaks.create(audio=audio, peaks=peaks)
+    return audio
 
 
 def get_file_format(content_type: str | None) -> str | None:
@@ -148,6 +262,124 @@ def get_file_format(content_type: str | None) -> str | None:
     return None
 
 
+def _probe_audio(fs_path: str) -> tuple[float, int] | None:
+    """Reads the duration and sample rate of an audio file from its header.
+
+    libsndfile is tried first, since it runs in-process, before falling back
+    to FFprobe for other containers.
+
+    Args:
+        fs_path: The path to the audio file.
+
+    Returns:
+        The duration in seconds and the sample rate, or None if the file
+        couldn't be probed.
+    """
+    try:
+        info = sf.info(fs_path)
+        return info.duration, info.samplerate
+    except RuntimeError:
+        pass
+    try:
+        info = mediainfo(fs_path)
+        return float(info["duration"]), int(info["sample_rate"])
+    except Exception:
+        logger.debug("Failed to probe %s", fs_path)
+        return None
+
+
+def _read_upload(fs_path: str, fmt: str | None) -> tuple[np.ndarray, int]:
+    # Reads the file as float32 samples with shape (T, C), using libsndfile
+    # where possible and FFmpeg for everything else.
+    try:
+        return sf.read(fs_path, dtype="float32", always_2d=True)
+    except RuntimeError:
+        pass
+    audio = AudioSegment.from_file(fs_path, fmt)
+    samples = np.array(audio.get_array_of_samples()).reshape(-1, audio.channels)
+    return pcm_to_float(samples, audio.sample_width), audio.frame_rate
+
+
+def _to_stored_format(samples: np.ndarray, sample_rate: int) -> np.ndarray:
+    """Converts decoded samples to the stored format.
+
+    Channels are mixed down (or duplicated), the audio is resampled, and the
+    samples are quantized, using vectorized operations on the whole array.
+
+    Args:
+        samples: The float32 samples, with shape ``(T, C)``.
+        sample_rate: The sample rate of the samples.
+
+    Returns:
+        The converted samples, with shape ``(T)`` for mono audio or
+        ``(T, C)`` otherwise.
+
+    Raises:
+        ValueError: If the channels can't be converted.
+    """
+    audio_settings = settings.file.audio
+    num_channels = samples.shape[1]
+    if num_channels != audio_settings.num_channels:
+        if audio_settings.num_channels == 1:
+            samples = samples.mean(axis=1, keepdims=True)
+        elif num_channels == 1:
+            samples = np.repeat(samples, audio_settings.num_channels, axis=1)
+        else:
+            raise ValueError(f"Can't convert {num_channels} channels to {audio_settings.num_channels} channels")
+    if audio_settings.num_channels == 1:
+        samples = samples[:, 0]
+    if sample_rate != audio_settings.sample_rate:
+        # resampy caches its pre-computed filters, so they're only loaded once.
+        samples = resampy.resample(
+            samples, sample_rate, audio_settings.sample_rate, filter=audio_settings.res_type, axis=0
+        )
+    return float_to_pcm(samples)
+
+
+def _check_upload(fs_path: str) -> None:
+    # Files which can't be probed are let through, and checked once decoded.
+    if (probed := _probe_audio(fs_path)) is not None:
+        duration, sample_rate = probed
+        _check_sample_rate(sample_rate)
+        _check_duration(duration)
+
+
+def _convert_upload(fs_path: str, fmt: str | None) -> np.ndarray:
+    """Decodes an uploaded file and converts it to the stored format.
+
+    The header is probed first, so that files which are too long or have too
+    low a sample rate are rejected without decoding them. This is blocking,
+    so it should be run in the executor.
+
+    Args:
+        fs_path: The path to the uploaded file.
+        fmt: The format of the uploaded file, if known.
+
+    Returns:
+        The converted audio samples.
+
+    Raises:
+        ValueError: If the sample rate or duration of the file is invalid.
+    """
+    _check_upload(fs_path)
+    samples, sample_rate = _read_upload(fs_path, fmt)
+    _check_sample_rate(sample_rate)
+    return _to_stored_format(samples, sample_rate)
+
+
+async def _write_upload(file: UploadFile, temp_file: IO[bytes]) -> None:
+    # Streams the upload to a temporary file in chunks, rejecting it as soon
+    # as it goes over the size limit.
+    max_bytes = settings.file.audio.max_mb * 1024 * 1024
+    num_bytes = 0
+    while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+        num_bytes += len(chunk)
+        if num_bytes > max_bytes:
+            raise ValueError("Audio file is too large")
+        temp_file.write(chunk)
+    temp_file.flush()
+
+
 async def save_audio_file(
     user_id: int,
     source: AudioSource,
@@ -156,6 +388,9 @@ async def save_audio_file(
 ) -> Audio:
     """Saves the audio file to the file system.
 
+    The upload is streamed to a temporary file in chunks, and rejected as
+    soon as it goes over the size limit.
+
     Args:
         user_id: The ID of the user who uploaded the audio file.
         source: The source of the audio file.
@@ -164,90 +399,209 @@ async def save_audio_file(
 
     Returns:
         The row in audio table.
+
+    Raises:
+        ValueError: If the audio file is invalid.
     """
     fmt = get_file_format(file.content_type)
     with tempfile.NamedTemporaryFile(suffix=f".{'wav' if fmt is None else fmt}") as temp_file:
-        temp_file.write(await file.read())
-        temp_file.flush()
+        await _write_upload(file, temp_file)
         try:
-            audio = AudioSegment.from_file(temp_file.name, fmt)
+            audio_array = await run_in_executor(_convert_upload, temp_file.name, fmt)
         except Exception:
             logger.exception("Error processing %s with format %s (%s)", file.filename, fmt, file.content_type)
             raise
-    return await _save_audio(user_id, source, name, audio)
+    return await _save_audio(user_id, source, name, audio_array)
 
 
-async def get_audio_url(audio_entry: Audio) -> tuple[str, bool]:
-    """Gets the file path or URL for serving the audio file.
+async def save_audio_file_pending(
+    user_id: int,
+    source: AudioSource,
+    file: UploadFile,
+    name: str | None = None,
+) -> Audio:
+    """Stores an uploaded file as-is, to be converted in the background.
+
+    Only the header of the file is checked, so that obviously invalid files
+    are still rejected straight away. The raw upload is stored next to where
+    the converted file will go, and the new row is left pending until
+    :func:`process_pending_audio` has converted it.
 
     Args:
-        audio_entry: The row in audio table.
+        user_id: The ID of the user who uploaded the audio file.
+        source: The source of the audio file.
+        file: The audio file.
+        name: The name of the audio file.
 
     Returns:
-        The file path or URL for serving the audio file, along with a boolean
-        indicating if it is a URL.
+        The pending row in audio table.
+
+    Raises:
+        ValueError: If the audio file is invalid.
     """
-    fs_type = get_fs_type()
+    fmt = get_file_format(file.content_type)
+    with tempfile.NamedTemporaryFile(suffix=f".{'wav' if fmt is None else fmt}") as temp_file:
+        await _write_upload(file, temp_file)
+        await run_in_executor(_check_upload, temp_file.name)
+        temp_file.seek(0)
+        data = temp_file.read()
 
-    try:
-        match fs_type:
-            case "file":
-                fs_path = _get_file_path(audio_entry.key)
-                return fs_path, False
-
-            case "s3":
-                s3_path = _get_s3_path(audio_entry.key)
-                s3_bucket = settings.file.s3.bucket
-                session = aioboto3.Session()
-                async with session.client("s3") as s3:
-                    url = await s3.generate_presigned_url(
-                        ClientMethod="get_object",
-                        Params={"Bucket": s3_bucket, "Key": s3_path},
-                        ExpiresIn=settings.file.s3.url_expiration,
-                    )
-                return url, True
-
-            case _:
-                raise ValueError(f"Invalid file system type: {fs_type}")
+    key = _new_key(user_id)
+    await get_storage().put(get_upload_name(key), data)
 
+    # The format fields are filled in once the file has been converted.
+    return await Audio.create(
+        key=key,
+        name=DEFAULT_NAME if name is None else name,
+        user_id=user_id,
+        source=source,
+        num_frames=0,
+        num_channels=settings.file.audio.num_channels,
+        sample_rate=settings.file.audio.sample_rate,
+        duration=0.0,
+        status=AudioStatus.pending,
+    )
+
+
+def _convert_upload_data(data: bytes) -> np.ndarray:
+    # The format of the raw upload isn't stored, so it is detected from the
+    # contents of the file instead.
+    with tempfile.NamedTemporaryFile() as temp_file:
+        temp_file.write(data)
+        temp_file.flush()
+        return _convert_upload(temp_file.name, None)
+
+
+async def claim_pending_audio(audio_id: int) -> datetime.datetime | None:
+    """Claims a pending upload, so that only one process converts it.
+
+    Claims which are older than ``upload.claim_timeout`` seconds are assumed
+    to belong to a process which stopped before finishing, and can be taken
+    over.
+
+    Args:
+        audio_id: The ID of the pending row.
+
+    Returns:
+        The time of the claim, which identifies it, or None if the row isn't
+        pending or is already claimed.
+    """
+    claimed_at = timezone.now()
+    stale_before = claimed_at - datetime.timedelta(seconds=settings.upload.claim_timeout)
+    num_claimed = (
+        await Audio.filter(id=audio_id, status=AudioStatus.pending)
+        .filter(Q(claimed_at__isnull=True) | Q(claimed_at__lt=stale_before))
+        .update(claimed_at=claimed_at)
+    )
+    return claimed_at if num_claimed else None
+
+
+async def process_pending_audio(audio: Audio) -> None:
+    """Converts a pending upload to the stored format and finalizes its row.
+
+    The row is claimed first, and nothing is done if another process holds
+    the claim. If the conversion fails, the row is marked as failed instead.
+    Either way, the raw upload is deleted afterwards. Rows are only updated,
+    and uploads only deleted, while the claim is still held, so a process
+    whose claim was taken over can't interfere with the process which took
+    it.
+
+    Args:
+        audio: The pending row in audio table.
+    """
+    if (claimed_at := await claim_pending_audio(audio.id)) is None:
+        return
+    claimed = Audio.filter(id=audio.id, status=AudioStatus.pending, claimed_at=claimed_at)
+    storage = get_storage()
+    upload_name = get_upload_name(audio.key)
+    try:
+        audio_array = await run_in_executor(_convert_upload_data, await storage.get(upload_name))
+        num_frames, num_channels, duration = await _store_audio(audio.key, audio_array)
+        peaks = await run_in_executor(compute_peaks, audio_array)
+        async with in_transaction(DEFAULT_CONNECTION):
+            num_updated = await claimed.update(
+                num_frames=num_frames,
+                num_channels=num_channels,
+                sample_rate=settings.file.audio.sample_rate,
+                duration=duration,
+                status=AudioStatus.ready,
+            )
+            if num_updated:
+                await AudioPeaks.create(audio_id=audio.id, peaks=peaks)
     except Exception:
-        logger.exception("Error processing %s", audio_entry.key)
-        raise
+        logger.exception("Error processing pending upload %s", audio.key)
+        num_updated = await claimed.update(status=AudioStatus.failed)
+    if not num_updated:
+        # The claim was taken over, so the upload belongs to another process.
+        return
+    try:
+        await storage.delete(upload_name)
+    except FileNotFoundError:
+        pass
+
+
+def _is_stored_format(audio_file: sf.SoundFile) -> bool:
+    audio_settings = settings.file.audio
+    return (
+        audio_file.format == audio_settings.file_ext.upper()
+        and audio_file.subtype == f"PCM_{audio_settings.sample_width * 8}"
+        and audio_file.samplerate == audio_settings.sample_rate
+        and audio_file.channels == audio_settings.num_channels
+    )
+
+
+def decode_audio(file: str | BinaryIO) -> np.ndarray:
+    """Decodes an audio file into a Numpy array of samples.
+
+    Files in the format that we store audio in are decoded in-process by
+    libsndfile, while anything else falls back to FFmpeg through pydub.
+
+    Args:
+        file: The path to the audio file, or a file-like object.
+
+    Returns:
+        The audio samples as a Numpy array.
+    """
+    try:
+        with sf.SoundFile(file) as audio_file:
+            if _is_stored_format(audio_file):
+                return audio_file.read(dtype="int16")
+    except RuntimeError:
+        logger.debug("Falling back to FFmpeg for decoding %s", file)
+    if not isinstance(file, str):
+        file.seek(0)
+    audio = AudioSegment.from_file(file, settings.file.audio.file_ext)
+    return np.array(audio.get_array_of_samples())
 
 
 async def load_audio_array(audio_uuid: UUID) -> np.ndarray:
     """Loads the audio into a Numpy array.
 
+    The raw sidecar is used if there is one, in which case the array may be
+    a read-only memory map. Otherwise, the stored file is decoded.
+
     Args:
         audio_uuid: The UUID of the audio.
 
     Returns:
         The audio as a Numpy array.
     """
-    fs_type = get_fs_type()
+    storage = get_storage()
+    sidecar_name, name = get_sidecar_name(audio_uuid), get_object_name(audio_uuid)
 
     try:
-        audio: AudioSegment
-
-        match fs_type:
-            case "file":
-                fs_path = _get_file_path(audio_uuid)
-                audio = AudioSegment.from_file(fs_path, settings.file.audio.file_ext)
-
-            case "s3":
-                s3_bucket = settings.file.s3.bucket
-                s3_path = _get_s3_path(audio_uuid)
-                session = aioboto3.Session()
-                async with session.client("s3") as s3:
-                    obj = await s3.get_object(Bucket=s3_bucket, Key=s3_path)
-                    data = await obj["Body"].read()
-                    audio_file_io = BytesIO(data)
-                    audio = AudioSegment.from_file(audio_file_io, settings.file.audio.file_ext)
-
-            case _:
-                raise ValueError(f"Invalid file system type: {fs_type}")
-
-        return np.array(audio.get_array_of_samples())
+        try:
+            if (fs_path := storage.get_path(sidecar_name)) is not None:
+                return load_sidecar(fs_path)
+            return await run_in_executor(load_sidecar, BytesIO(await storage.get(sidecar_name)))
+        except FileNotFoundError:
+            # Audio saved before sidecars were written only has the stored file.
+            pass
+
+        if (fs_path := storage.get_path(name)) is not None:
+            return await run_in_executor(decode_audio, fs_path)
+        data = await storage.get(name)
+        return await run_in_executor(decode_audio, BytesIO(data))
 
     except Exception:
         logger.exception("Error processing %s", audio_uuid)
@@ -271,13 +625,9 @@ async def save_audio_array(
     Returns:
         The row in audio table containing the audio Id.
     """
-    audio = AudioSegment(
-        audio_array.tobytes(),
-        sample_width=settings.file.audio.sample_width,
-        frame_rate=settings.file.audio.sample_rate,
-        channels=settings.file.audio.num_channels,
-    )
-    return await _save_audio(user_id, source, name, audio)
+    if settings.file.audio.num_channels > 1 and audio_array.ndim == 1:
+        audio_array = audio_array.reshape(-1, settings.file.audio.num_channels)
+    return await _save_audio(user_id, source, name, audio_array)
 
 
 async def delete_audio(key: UUID) -> None:
@@ -286,23 +636,10 @@ async def delete_audio(key: UUID) -> None:
     Args:
         key: The UUID of the audio file to delete
     """
-    fs_type = get_fs_type()
-
     try:
-        match fs_type:
-            case "file":
-                fs_path = _get_file_path(key)
-                os.remove(fs_path)
-
-            case "s3":
-                s3_bucket = settings.file.s3.bucket
-                s3_path = _get_s3_path(key)
-                session = aioboto3.Session()
-                async with session.client("s3") as s3:
-                    await s3.delete_object(Bucket=s3_bucket, Key=s3_path)
-
-            case _:
-                raise ValueError(f"Invalid file system type: {fs_type}")
+        # Pending or failed uploads only have the raw upload, so any missing
+        # objects are ignored.
+        await get_storage().delete_many([get_object_name(key), get_sidecar_name(key), get_upload_name(key)])
 
     except Exception:
         logger.exception("Error processing %s", key)
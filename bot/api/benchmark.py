@@ -0,0 +1,319 @@
+"""Benchmarks the hot API routes against a local SQLite database.
+
+The database is seeded with a configurable number of users, audio files,
+generations and collections, most of which belong to a single heavy user.
+The app is then driven in-process by concurrent clients acting as the heavy
+user. For each route, the benchmark reports the latency percentiles and the
+number of database queries that each request issued, so that regressions in
+ORM usage show up as the tables grow.
+
+.. code-block:: bash
+
+    python -m bot.api.benchmark --db-path bench.sqlite --num-audios 1000000 -o results.json
+"""
+
+import argparse
+import asyncio
+import contextvars
+import json
+import logging
+import os
+import random
+import sys
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Iterator, cast
+
+import httpx
+import numpy as np
+from ml.utils.logging import configure_logging
+from tortoise.log import db_client_logger
+from tortoise.transactions import in_transaction
+
+from bot.api.app.users import SessionTokenData
+from bot.api.counters import reconcile
+from bot.api.db import DEFAULT_CONNECTION, close_db, init_db
+from bot.api.model import Audio, AudioSource, Collection, Generation, Token, User
+from bot.api.token import create_refresh_token
+
+logger = logging.getLogger(__name__)
+
+PERCENTILES = (50, 90, 99)
+SEED_BATCH_SIZE = 10_000
+IDS_PER_REQUEST = 100
+COLLECTION_NAME = "benchmark"
+
+_query_count: contextvars.ContextVar[list[int] | None] = contextvars.ContextVar("query_count", default=None)
+
+
+class QueryCountHandler(logging.Handler):
+    """Counts the queries logged by the database client for each request.
+
+    Each request sets its own counter in a context variable, so concurrent
+    requests are counted separately.
+    """
+
+    def emit(self, record: logging.LogRecord) -> None:
+        if (counter := _query_count.get()) is not None:
+            counter[0] += 1
+
+
+@dataclass
+class RouteResults:
+    latencies: list[float] = field(default_factory=list)
+    query_counts: list[int] = field(default_factory=list)
+    num_errors: int = 0
+
+    def summarize(self, elapsed_time: float) -> dict[str, Any]:
+        latencies = np.array(self.latencies) * 1000
+        query_counts = np.array(self.query_counts)
+        summary: dict[str, Any] = {f"p{p}_ms": float(np.percentile(latencies, p)) for p in PERCENTILES}
+        summary.update(
+            {
+                "mean_ms": float(latencies.mean()),
+                "throughput": len(self.latencies) / elapsed_time,
+                "num_errors": self.num_errors,
+                "mean_queries": float(query_counts.mean()),
+                "max_queries": int(query_counts.max()),
+            }
+        )
+        return summary
+
+
+def _batches(total: int) -> Iterator[range]:
+    for start in range(0, total, SEED_BATCH_SIZE):
+        yield range(start, min(start + SEED_BATCH_SIZE, total))
+
+
+async def seed(
+    num_users: int,
+    num_audios: int,
+    num_generations: int,
+    num_collections: int,
+    heavy_user_share: float,
+    public_fraction: float,
+) -> None:
+    """Seeds the database with synthetic rows.
+
+    Args:
+        num_users: The number of users to create.
+        num_audios: The number of audio rows to create.
+        num_generations: The number of generation rows to create.
+        num_collections: The number of collection rows to create.
+        heavy_user_share: The fraction of rows which belong to the first user.
+        public_fraction: The fraction of audio and generation rows which are
+            public.
+    """
+
+    def random_user_id() -> int:
+        return 1 if random.random() < heavy_user_share else random.randint(1, num_users)
+
+    await User.bulk_create([User(email=f"user-{i}@dpsh.dev") for i in range(num_users)], batch_size=SEED_BATCH_SIZE)
+    await Token.bulk_create([Token(user_id=i + 1) for i in range(num_users)], batch_size=SEED_BATCH_SIZE)
+
+    # Keeps track of each user's audio IDs, for creating generations.
+    user_audio_ids: dict[int, list[int]] = {}
+    sources = [AudioSource.uploaded, AudioSource.recorded, AudioSource.generated]
+    for batch in _batches(num_audios):
+        async with in_transaction(DEFAULT_CONNECTION):
+            user_ids = [random_user_id() for _ in batch]
+            await Audio.bulk_create(
+                [
+                    Audio(
+                        key=uuid.uuid4(),
+                        name=f"Audio {i}",
+                        user_id=user_id,
+                        source=random.choice(sources),
+                        num_frames=16000,
+                        num_channels=1,
+                        sample_rate=16000,
+                        duration=1.0,
+                        public=random.random() < public_fraction,
+                    )
+                    for i, user_id in zip(batch, user_ids)
+                ]
+            )
+        for i, user_id in zip(batch, user_ids):
+            user_audio_ids.setdefault(user_id, []).append(i + 1)
+        logger.info("Seeded %d / %d audio rows", batch.stop, num_audios)
+
+    audio_users = list(user_audio_ids.keys())
+    for batch in _batches(num_generations):
+        async with in_transaction(DEFAULT_CONNECTION):
+            generations: list[Generation] = []
+            for _ in batch:
+                user_id = random_user_id()
+                audio_ids = user_audio_ids.get(user_id) or user_audio_ids[random.choice(audio_users)]
+                generations.append(
+                    Generation(
+                        user_id=user_id,
+                        source_id=random.choice(audio_ids),
+                        reference_id=random.choice(audio_ids),
+                        output_id=random.choice(audio_ids),
+                        model="test",
+                        elapsed_time=1.0,
+                        public=random.random() < public_fraction,
+                    )
+                )
+            await Generation.bulk_create(generations)
+        logger.info("Seeded %d / %d generation rows", batch.stop, num_generations)
+
+    heavy_audio_ids = user_audio_ids.get(1, [])
+    if heavy_audio_ids:
+        for batch in _batches(num_collections):
+            await Collection.bulk_create(
+                [Collection(name=COLLECTION_NAME, user_id=1, audio_id=random.choice(heavy_audio_ids)) for _ in batch]
+            )
+
+
+async def get_routes() -> dict[str, Callable[[httpx.AsyncClient], Awaitable[httpx.Response]]]:
+    user = await User.get(id=1)
+    session_headers = {"Authorization": f"Bearer {SessionTokenData(user_id=user.id).encode()}"}
+    refresh_headers = {"Authorization": f"Bearer {await create_refresh_token(user)}"}
+    audio_ids = cast(list[int], await Audio.filter(user_id=user.id).limit(100_000).values_list("id", flat=True))
+    num_audios = len(audio_ids)
+
+    def sample_ids() -> list[int]:
+        return random.sample(audio_ids, min(IDS_PER_REQUEST, num_audios))
+
+    def sample_start() -> int:
+        return random.randrange(0, max(num_audios - IDS_PER_REQUEST, 1))
+
+    return {
+        "/audio/query/me": lambda client: client.get(
+            "/audio/query/me",
+            params={"start": sample_start(), "limit": IDS_PER_REQUEST},
+            headers=session_headers,
+        ),
+        "/audio/query/ids": lambda client: client.post(
+            "/audio/query/ids",
+            json={"ids": sample_ids()},
+            headers=session_headers,
+        ),
+        "/audio/public": lambda client: client.post(
+            "/audio/public",
+            json={"count": IDS_PER_REQUEST},
+        ),
+        "/generation/query/me": lambda client: client.get(
+            "/generation/query/me",
+            params={"start": sample_start(), "limit": IDS_PER_REQUEST},
+            headers=session_headers,
+        ),
+        "/collections/query/ids": lambda client: client.post(
+            "/collections/query/ids",
+            json={"name": COLLECTION_NAME, "audio_ids": sample_ids()},
+            headers=session_headers,
+        ),
+        "/users/refresh": lambda client: client.post(
+            "/users/refresh",
+            headers=refresh_headers,
+        ),
+    }
+
+
+async def run_route(
+    client: httpx.AsyncClient,
+    request_fn: Callable[[httpx.AsyncClient], Awaitable[httpx.Response]],
+    num_requests: int,
+    concurrency: int,
+) -> dict[str, Any]:
+    results = RouteResults()
+    remaining = iter(range(num_requests))
+
+    async def worker() -> None:
+        for _ in remaining:
+            counter = [0]
+            _query_count.set(counter)
+            start_time = time.perf_counter()
+            response = await request_fn(client)
+            results.latencies.append(time.perf_counter() - start_time)
+            results.query_counts.append(counter[0])
+            if response.status_code != 200:
+                logger.error("Request failed with status %d: %s", response.status_code, response.text)
+                results.num_errors += 1
+
+    start_time = time.perf_counter()
+    await asyncio.gather(*(asyncio.create_task(worker()) for _ in range(concurrency)))
+    return results.summarize(time.perf_counter() - start_time)
+
+
+async def run_benchmark(args: argparse.Namespace) -> dict[str, Any]:
+    from bot.api.app.main import app
+
+    await init_db(generate_schemas=True)
+    try:
+        if not await User.exists():
+            logger.info("Seeding database")
+            await seed(
+                num_users=args.num_users,
+                num_audios=args.num_audios,
+                num_generations=args.num_generations,
+                num_collections=args.num_collections,
+                heavy_user_share=args.heavy_user_share,
+                public_fraction=args.public_fraction,
+            )
+            # Bulk inserts skip the counters, so they're rebuilt afterwards.
+            await reconcile(SEED_BATCH_SIZE, dry_run=False)
+
+        routes = await get_routes()
+        if args.routes:
+            routes = {route: routes[route] for route in args.routes}
+
+        # Counts queries through the database client's debug logs.
+        db_client_logger.setLevel(logging.DEBUG)
+        db_client_logger.propagate = False
+        db_client_logger.addHandler(QueryCountHandler())
+
+        results: dict[str, Any] = {}
+        transport = httpx.ASGITransport(app=app)  # type: ignore[arg-type]
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+            for route, request_fn in routes.items():
+                logger.info("Benchmarking %s", route)
+                await run_route(client, request_fn, args.num_warmup_requests, args.concurrency)
+                results[route] = await run_route(client, request_fn, args.num_requests, args.concurrency)
+        return results
+
+    finally:
+        await close_db()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmarks the hot API routes against a local SQLite database.")
+    parser.add_argument("--db-path", type=str, default="benchmark.sqlite", help="The SQLite database to use")
+    parser.add_argument("--num-users", type=int, default=1_000, help="Number of users to seed")
+    parser.add_argument("--num-audios", type=int, default=1_000_000, help="Number of audio rows to seed")
+    parser.add_argument("--num-generations", type=int, default=1_000_000, help="Number of generation rows to seed")
+    parser.add_argument("--num-collections", type=int, default=10_000, help="Number of collection rows to seed")
+    parser.add_argument("--heavy-user-share", type=float, default=0.1, help="Fraction of rows for the heavy user")
+    parser.add_argument("--public-fraction", type=float, default=0.01, help="Fraction of public rows")
+    parser.add_argument("-c", "--concurrency", type=int, default=16, help="Number of concurrent clients")
+    parser.add_argument("-n", "--num-requests", type=int, default=200, help="Timed requests per route")
+    parser.add_argument("-w", "--num-warmup-requests", type=int, default=20, help="Warm-up requests per route")
+    parser.add_argument("-r", "--routes", nargs="*", help="Only benchmark these routes")
+    parser.add_argument("-o", "--output-file", type=str, help="Where to write the JSON results, or stdout")
+    args = parser.parse_args()
+
+    configure_logging()
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    # The settings have to point at the benchmark database before the app is
+    # imported, since the app reads the database configuration on import.
+    os.environ.setdefault("DPSH_ENVIRONMENT", "test")
+    from bot.settings import settings
+
+    settings.database.kind = "sqlite"
+    settings.database.sqlite.host = args.db_path
+
+    results = asyncio.run(run_benchmark(args))
+    report = {"config": vars(args), "results": results}
+    if args.output_file is None:
+        json.dump(report, sys.stdout, indent=2)
+    else:
+        with open(args.output_file, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    # python -m bot.api.benchmark
+    main()
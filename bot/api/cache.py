@@ -0,0 +1,123 @@
+"""Defines a bounded in-process cache with least-recently-used eviction."""
+
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Generic, Hashable, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    expirations: int = 0
+    evictions: int = 0
+
+    def as_dict(self) -> dict[str, float | int]:
+        num_lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "expirations": self.expirations,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / num_lookups if num_lookups else 0.0,
+        }
+
+
+class LRUCache(Generic[K, V]):
+    """A cache which holds at most a fixed number of entries.
+
+    When the cache is full, the least recently used entry is evicted. If a
+    time-to-live is given, entries are also dropped once they are older than
+    that, so that the cache never returns stale values.
+
+    Args:
+        max_size: The maximum total size of the entries to keep.
+        ttl: The number of seconds to keep each entry for, or None to keep
+            entries until they are evicted.
+        size_fn: Gets the size of a value, such as its size in bytes; by
+            default, each entry has a size of one.
+        on_evict: Called with each entry that is evicted or expires, to
+            release any resources it holds.
+    """
+
+    def __init__(
+        self,
+        max_size: int,
+        ttl: float | None = None,
+        size_fn: Callable[[V], int] | None = None,
+        on_evict: Callable[[K, V], None] | None = None,
+    ) -> None:
+        super().__init__()
+
+        self.max_size = max_size
+        self.ttl = ttl
+        self.size_fn = size_fn
+        self.on_evict = on_evict
+        self.stats = CacheStats()
+        self._entries: OrderedDict[K, tuple[V, float, int]] = OrderedDict()
+        self._total_size = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: K) -> bool:
+        return key in self._entries
+
+    def _remove(self, key: K) -> V:
+        value, _, size = self._entries.pop(key)
+        self._total_size -= size
+        return value
+
+    def get(self, key: K) -> V | None:
+        if (entry := self._entries.get(key)) is None:
+            self.stats.misses += 1
+            return None
+        value, expires_at, _ = entry
+        if time.monotonic() >= expires_at:
+            self._remove(key)
+            if self.on_evict is not None:
+                self.on_evict(key, value)
+            self.stats.expirations += 1
+            self.stats.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.stats.hits += 1
+        return value
+
+    def put(self, key: K, value: V) -> None:
+        size = 1 if self.size_fn is None else self.size_fn(value)
+        if size > self.max_size:
+            return
+        if key in self._entries:
+            self._remove(key)
+        expires_at = float("inf") if self.ttl is None else time.monotonic() + self.ttl
+        self._entries[key] = (value, expires_at, size)
+        self._total_size += size
+        while self._total_size > self.max_size:
+            evicted_key = next(iter(self._entries))
+            evicted_value = self._remove(evicted_key)
+            if self.on_evict is not None:
+                self.on_evict(evicted_key, evicted_value)
+            self.stats.evictions += 1
+
+    def keys(self) -> list[K]:
+        return list(self._entries)
+
+    def pop(self, key: K) -> V | None:
+        return self._remove(key) if key in self._entries else None
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._total_size = 0
+
+    def get_stats(self) -> dict[str, float | int]:
+        return {
+            "num_entries": len(self._entries),
+            "size": self._total_size,
+            "max_size": self.max_size,
+            **self.stats.as_dict(),
+        }
@@ -0,0 +1,149 @@
+"""Defines the per-user row counters, and a job which corrects them.
+
+Counting all of a user's audio or generations gets slow for heavy users, so
+the counts are kept in :class:`AudioCounter` and :class:`GenerationCounter`
+rows instead. Model signals update them whenever a row is created or
+deleted on its own, and deleting an audio row or a user also updates the
+generation counters of every other user whose generations it cascades to.
+Bulk queryset operations, like ``bulk_create`` or ``filter(...).delete()``,
+bypass the signals and leave the counters out of date, so code which uses
+them has to update the counters itself.
+
+The reconciliation job recounts the rows for each user in batches, and
+overwrites any counters which don't match. Rows which are written while a
+batch is being recounted can still leave some drift behind, which is fixed
+the next time the job runs.
+
+.. code-block:: bash
+
+    python -m bot.api.counters --dry-run
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import sys
+from dataclasses import asdict, dataclass
+from typing import Any, cast
+
+from ml.utils.logging import configure_logging
+from tortoise.functions import Count
+from tortoise.transactions import in_transaction
+
+from bot.api.db import DEFAULT_CONNECTION, close_db, init_db
+from bot.api.model import Audio, AudioCounter, AudioSource, Generation, GenerationCounter, User
+
+logger = logging.getLogger(__name__)
+
+
+async def get_audio_count(user_id: int, source: AudioSource | None = None) -> int:
+    query = AudioCounter.filter(user_id=user_id)
+    if source is not None:
+        query = query.filter(source=source)
+    return sum(cast(list[int], await query.values_list("count", flat=True)))
+
+
+async def get_generation_count(user_id: int) -> int:
+    count = await GenerationCounter.filter(user_id=user_id).first().values_list("count", flat=True)
+    return 0 if count is None else cast(int, count)
+
+
+@dataclass
+class ReconcileStats:
+    num_users: int = 0
+    num_audio_fixed: int = 0
+    num_generation_fixed: int = 0
+
+
+async def reconcile_users(user_ids: list[int], stats: ReconcileStats, dry_run: bool) -> None:
+    """Recounts the rows for some users, and fixes their counters.
+
+    Args:
+        user_ids: The IDs of the users to recount.
+        stats: The stats to update.
+        dry_run: If set, only count the counters which would be fixed.
+    """
+    async with in_transaction(DEFAULT_CONNECTION):
+        audio_rows: list[dict[str, Any]] = (
+            await Audio.filter(user_id__in=user_ids)
+            .annotate(num=Count("id"))
+            .group_by("user_id", "source")
+            .values("user_id", "source", "num")
+        )
+        audio_counts = {(row["user_id"], AudioSource(row["source"])): row["num"] for row in audio_rows}
+        counter_rows: list[dict[str, Any]] = await AudioCounter.filter(user_id__in=user_ids).values(
+            "user_id", "source", "count"
+        )
+        audio_counters = {(row["user_id"], AudioSource(row["source"])): row["count"] for row in counter_rows}
+        for user_id, source in audio_counts.keys() | audio_counters.keys():
+            count = audio_counts.get((user_id, source), 0)
+            if audio_counters.get((user_id, source)) == count:
+                continue
+            stats.num_audio_fixed += 1
+            if not dry_run:
+                await AudioCounter.update_or_create({"count": count}, user_id=user_id, source=source)
+
+        generation_rows: list[dict[str, Any]] = (
+            await Generation.filter(user_id__in=user_ids)
+            .annotate(num=Count("id"))
+            .group_by("user_id")
+            .values("user_id", "num")
+        )
+        generation_counts = {row["user_id"]: row["num"] for row in generation_rows}
+        generation_counters = dict(
+            cast(
+                list[tuple[int, int]],
+                await GenerationCounter.filter(user_id__in=user_ids).values_list("user_id", "count"),
+            )
+        )
+        for user_id in generation_counts.keys() | generation_counters.keys():
+            count = generation_counts.get(user_id, 0)
+            if generation_counters.get(user_id) == count:
+                continue
+            stats.num_generation_fixed += 1
+            if not dry_run:
+                await GenerationCounter.update_or_create({"count": count}, user_id=user_id)
+
+    stats.num_users += len(user_ids)
+
+
+async def reconcile(batch_size: int, dry_run: bool) -> ReconcileStats:
+    stats = ReconcileStats()
+    last_id = 0
+    while True:
+        user_ids = cast(
+            list[int],
+            await User.filter(id__gt=last_id).order_by("id").limit(batch_size).values_list("id", flat=True),
+        )
+        if not user_ids:
+            break
+        last_id = user_ids[-1]
+        await reconcile_users(user_ids, stats, dry_run)
+        logger.info("Reconciled %d users", stats.num_users)
+    return stats
+
+
+async def run_reconcile(batch_size: int, dry_run: bool) -> ReconcileStats:
+    await init_db()
+    try:
+        return await reconcile(batch_size, dry_run)
+    finally:
+        await close_db()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Corrects the per-user row counters.")
+    parser.add_argument("-b", "--batch-size", type=int, default=1000, help="Number of users to handle at once")
+    parser.add_argument("-n", "--dry-run", action="store_true", help="Only report what would be fixed")
+    args = parser.parse_args()
+
+    configure_logging()
+
+    stats = asyncio.run(run_reconcile(args.batch_size, args.dry_run))
+    json.dump({**asdict(stats), "dry_run": args.dry_run}, sys.stdout, indent=2)
+
+
+if __name__ == "__main__":
+    # python -m bot.api.counters
+    main()
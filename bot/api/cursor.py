@@ -0,0 +1,76 @@
+"""Defines opaque cursors for keyset pagination.
+
+Paging with an offset makes the database scan and throw away every row
+before the page, so deep pages get slower as a user's history grows. Instead,
+listings are ordered by a timestamp and then by ID, and each page returns a
+cursor holding the position of its last row. The next page then starts from
+the rows strictly before that position, which the database can find directly
+from an index on ``(user_id, timestamp, id)``.
+
+The cursor is base64-encoded JSON, so that clients treat it as opaque rather
+than depending on its contents.
+"""
+
+import base64
+import datetime
+import json
+from typing import Any, TypeVar
+
+from tortoise.expressions import Q
+from tortoise.models import Model
+from tortoise.queryset import QuerySet
+
+M = TypeVar("M", bound=Model)
+
+
+def encode_cursor(timestamp: datetime.datetime, row_id: int) -> str:
+    data = json.dumps([timestamp.isoformat(), row_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(data.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> tuple[datetime.datetime, int]:
+    """Decodes a cursor returned by :func:`encode_cursor`.
+
+    Args:
+        cursor: The encoded cursor.
+
+    Returns:
+        The timestamp and ID of the last row on the previous page.
+
+    Raises:
+        ValueError: If the cursor is malformed.
+    """
+    try:
+        timestamp_str, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return datetime.datetime.fromisoformat(timestamp_str), int(row_id)
+    except Exception as e:
+        raise ValueError("Invalid cursor") from e
+
+
+def after_cursor(query: QuerySet[M], field: str, cursor: str) -> QuerySet[M]:
+    """Filters a query to the rows after a cursor, in descending order.
+
+    Args:
+        query: The query to filter.
+        field: The timestamp field that the rows are ordered by.
+        cursor: The cursor for the last row on the previous page.
+
+    Returns:
+        The filtered query.
+
+    Raises:
+        ValueError: If the cursor is malformed.
+    """
+    timestamp, row_id = decode_cursor(cursor)
+    before: dict[str, Any] = {f"{field}__lt": timestamp}
+    tied: dict[str, Any] = {field: timestamp, "id__lt": row_id}
+    return query.filter(Q(**before) | Q(**tied))
+
+
+def next_cursor(rows: list[dict[str, Any]], field: str, limit: int) -> str | None:
+    # Pages fetch one extra row, so that the last page doesn't return a cursor
+    # which would lead to an empty page.
+    if limit <= 0 or len(rows) <= limit:
+        return None
+    last_row = rows[limit - 1]
+    return encode_cursor(last_row[field], last_row["id"])
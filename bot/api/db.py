@@ -1,24 +1,82 @@
 """Defines the utility functions for interacting with the database."""
 
 import asyncio
+import contextvars
 import logging
+from collections import Counter
 from pathlib import Path
 from typing import Any
 
 from ml.utils.logging import configure_logging
-from tortoise import Model, Tortoise
+from tortoise import BaseDBAsyncClient, Model, Tortoise, connections
 
 from bot.settings import settings
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_CONNECTION = "default"
+READ_REPLICA_CONNECTION = "read_replica"
+
+_use_read_replica: contextvars.ContextVar[bool] = contextvars.ContextVar("use_read_replica", default=False)
+_route_counts: Counter[str] = Counter()
+
+
+def has_read_replica() -> bool:
+    return READ_REPLICA_CONNECTION in connections.db_config
+
+
+def get_read_connection_name() -> str:
+    name = READ_REPLICA_CONNECTION if _use_read_replica.get() and has_read_replica() else DEFAULT_CONNECTION
+    _route_counts[name] += 1
+    return name
+
 
 class DatabaseRouter:
-    async def db_for_read(self, model: type["Model"]) -> str:
-        return "default"
+    """Routes queries between the primary database and its read replica.
 
-    async def db_for_write(self, model: type["Model"]) -> str:
-        return "read_replica"
+    Writes always go to the primary. Since the replica can lag behind the
+    primary, reads only go to the replica for requests which have opted in
+    with :func:`use_read_replica`, so that anything which reads its own writes
+    stays on the primary.
+    """
+
+    def db_for_read(self, model: type[Model]) -> str:
+        return get_read_connection_name()
+
+    def db_for_write(self, model: type[Model]) -> str:
+        _route_counts[DEFAULT_CONNECTION] += 1
+        return DEFAULT_CONNECTION
+
+
+async def use_read_replica() -> None:
+    """Sends the reads for the current request to the read replica.
+
+    This is meant to be used as a route dependency for read-only endpoints.
+    """
+    _use_read_replica.set(True)
+
+
+def get_read_connection() -> BaseDBAsyncClient:
+    """Gets the connection to use for raw read-only queries.
+
+    Returns:
+        The connection which the router would use for reads.
+    """
+    return connections.get(get_read_connection_name())
+
+
+def get_route_counts() -> dict[str, int]:
+    """Gets the number of routing decisions made for each connection.
+
+    This counts the queries which went through the router, which shows how
+    reads are split between the primary and the replica. It isn't the total
+    load on each database, since queries inside transactions are sent to
+    the transaction's connection without being routed.
+
+    Returns:
+        The number of routing decisions, keyed by connection name.
+    """
+    return dict(_route_counts)
 
 
 def get_sqlite_config() -> dict:
@@ -49,6 +107,7 @@ def get_sqlite_config() -> dict:
                 "default_connection": "default",
             },
         },
+        "routers": ["bot.api.db.DatabaseRouter"],
     }
 
 
@@ -103,6 +162,7 @@ def get_postgres_config() -> dict:
                 "default_connection": "default",
             },
         },
+        "routers": ["bot.api.db.DatabaseRouter"],
     }
 
 
@@ -119,9 +179,12 @@ def get_config() -> dict:
 
 async def init_db(generate_schemas: bool = False) -> None:
     logger.info("Initializing database")
+    from bot.api.search import init_search
+
     await Tortoise.init(config=get_config())
     if generate_schemas:
         await Tortoise.generate_schemas()
+    await init_search()
 
 
 async def close_db() -> None:
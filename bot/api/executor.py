@@ -0,0 +1,107 @@
+"""Defines a bounded executor for blocking work in async handlers.
+
+Audio decoding, resampling and encoding either hold the CPU or wait on an
+FFmpeg subprocess, so running them directly in a request handler stalls
+every other request on the event loop. Instead, they are run in a thread
+pool with a fixed number of workers, and jobs beyond that wait in the pool's
+queue. The time spent waiting is tracked, so that an undersized pool shows
+up in the admin metrics.
+"""
+
+import asyncio
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, ParamSpec, TypeVar
+
+from bot.settings import settings
+
+P = ParamSpec("P")
+T = TypeVar("T")
+
+
+@dataclass
+class ExecutorStats:
+    num_submitted: int = 0
+    num_waiting: int = 0
+    num_running: int = 0
+    num_completed: int = 0
+    num_failed: int = 0
+    total_wait_time: float = 0.0
+    max_wait_time: float = 0.0
+    total_run_time: float = 0.0
+
+    def as_dict(self) -> dict[str, float | int]:
+        num_started = self.num_submitted - self.num_waiting
+        return {
+            "max_workers": settings.executor.max_workers,
+            "num_submitted": self.num_submitted,
+            "num_waiting": self.num_waiting,
+            "num_running": self.num_running,
+            "num_completed": self.num_completed,
+            "num_failed": self.num_failed,
+            "mean_wait_time": self.total_wait_time / num_started if num_started else 0.0,
+            "max_wait_time": self.max_wait_time,
+            "mean_run_time": self.total_run_time / self.num_completed if self.num_completed else 0.0,
+        }
+
+
+_stats = ExecutorStats()
+_stats_lock = threading.Lock()
+
+
+@functools.lru_cache()
+def get_executor() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(max_workers=settings.executor.max_workers, thread_name_prefix="bot-api")
+
+
+def get_executor_stats() -> dict[str, float | int]:
+    with _stats_lock:
+        return _stats.as_dict()
+
+
+async def run_in_executor(func: Callable[P, T], *args: P.args, **kwargs: P.kwargs) -> T:
+    """Runs a blocking function in the bounded executor.
+
+    Args:
+        func: The function to run.
+        args: The positional arguments to the function.
+        kwargs: The keyword arguments to the function.
+
+    Returns:
+        The return value of the function.
+    """
+    submit_time = time.perf_counter()
+
+    def run() -> T:
+        start_time = time.perf_counter()
+        wait_time = start_time - submit_time
+        with _stats_lock:
+            _stats.num_waiting -= 1
+            _stats.num_running += 1
+            _stats.total_wait_time += wait_time
+            _stats.max_wait_time = max(_stats.max_wait_time, wait_time)
+        try:
+            value = func(*args, **kwargs)
+        except BaseException:
+            with _stats_lock:
+                _stats.num_running -= 1
+                _stats.num_failed += 1
+            raise
+        with _stats_lock:
+            _stats.num_running -= 1
+            _stats.num_completed += 1
+            _stats.total_run_time += time.perf_counter() - start_time
+        return value
+
+    with _stats_lock:
+        _stats.num_submitted += 1
+        _stats.num_waiting += 1
+    return await asyncio.get_running_loop().run_in_executor(get_executor(), run)
+
+
+def shutdown_executor() -> None:
+    get_executor().shutdown(wait=True, cancel_futures=True)
+    get_executor.cache_clear()
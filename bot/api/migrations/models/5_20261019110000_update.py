@@ -0,0 +1,14 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        ALTER TABLE "audio" ADD "status" VARCHAR(7) NOT NULL  DEFAULT 'ready';
+        CREATE INDEX "idx_audio_status_371f20" ON "audio" ("status");
+        COMMENT ON COLUMN "audio"."status" IS 'pending: pending\nready: ready\nfailed: failed';"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        DROP INDEX "idx_audio_status_371f20";
+        ALTER TABLE "audio" DROP COLUMN "status";"""
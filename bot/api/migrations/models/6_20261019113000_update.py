@@ -0,0 +1,15 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        CREATE TABLE IF NOT EXISTS "audiopeaks" (
+    "id" SERIAL NOT NULL PRIMARY KEY,
+    "peaks" JSONB NOT NULL,
+    "audio_id" INT NOT NULL UNIQUE REFERENCES "audio" ("id") ON DELETE CASCADE
+);"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        DROP TABLE IF EXISTS "audiopeaks";"""
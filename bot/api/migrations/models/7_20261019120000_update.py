@@ -0,0 +1,13 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        CREATE INDEX "idx_audio_user_id_ab083f" ON "audio" ("user_id", "created", "id");
+        CREATE INDEX "idx_generation_user_id_200be2" ON "generation" ("user_id", "task_finished", "id");"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        DROP INDEX "idx_generation_user_id_200be2";
+        DROP INDEX "idx_audio_user_id_ab083f";"""
@@ -0,0 +1,24 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    # Existing rows are given their random keys by the column default, which
+    # is evaluated separately for each row, and then the default is dropped
+    # since new rows get their keys from the model.
+    return """
+        ALTER TABLE "audio" ADD "random_key" DOUBLE PRECISION NOT NULL  DEFAULT random();
+        ALTER TABLE "audio" ALTER COLUMN "random_key" DROP DEFAULT;
+        ALTER TABLE "generation" ADD "random_key" DOUBLE PRECISION NOT NULL  DEFAULT random();
+        ALTER TABLE "generation" ALTER COLUMN "random_key" DROP DEFAULT;
+        CREATE INDEX "idx_audio_public_94bb46" ON "audio" ("public", "random_key");
+        CREATE INDEX "idx_audio_public_47af6a" ON "audio" ("public", "source", "random_key");
+        CREATE INDEX "idx_generation_public_c645ff" ON "generation" ("public", "random_key");"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        DROP INDEX "idx_generation_public_c645ff";
+        DROP INDEX "idx_audio_public_47af6a";
+        DROP INDEX "idx_audio_public_94bb46";
+        ALTER TABLE "generation" DROP COLUMN "random_key";
+        ALTER TABLE "audio" DROP COLUMN "random_key";"""
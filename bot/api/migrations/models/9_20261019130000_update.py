@@ -0,0 +1,30 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    # The counters start out from the existing rows.
+    return """
+        CREATE TABLE IF NOT EXISTS "audiocounter" (
+    "id" SERIAL NOT NULL PRIMARY KEY,
+    "source" VARCHAR(9) NOT NULL,
+    "count" INT NOT NULL  DEFAULT 0,
+    "user_id" INT NOT NULL REFERENCES "user" ("id") ON DELETE CASCADE,
+    CONSTRAINT "uid_audiocounte_user_id_bb28e7" UNIQUE ("user_id", "source")
+);
+CREATE INDEX IF NOT EXISTS "idx_audiocounte_user_id_ccb59b" ON "audiocounter" ("user_id");
+COMMENT ON COLUMN "audiocounter"."source" IS 'uploaded: uploaded\nrecorded: recorded\ngenerated: generated';
+        CREATE TABLE IF NOT EXISTS "generationcounter" (
+    "id" SERIAL NOT NULL PRIMARY KEY,
+    "count" INT NOT NULL  DEFAULT 0,
+    "user_id" INT NOT NULL UNIQUE REFERENCES "user" ("id") ON DELETE CASCADE
+);
+        INSERT INTO "audiocounter" ("user_id", "source", "count")
+            SELECT "user_id", "source", COUNT(*) FROM "audio" GROUP BY "user_id", "source";
+        INSERT INTO "generationcounter" ("user_id", "count")
+            SELECT "user_id", COUNT(*) FROM "generation" GROUP BY "user_id";"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        DROP TABLE IF EXISTS "generationcounter";
+        DROP TABLE IF EXISTS "audiocounter";"""
@@ -2,9 +2,15 @@
 """Defines the table models for the API."""
 
 import enum
+import random
+from typing import Any
 
-from tortoise import fields
+from tortoise import BaseDBAsyncClient, fields
+from tortoise.expressions import F, Q
+from tortoise.functions import Count
 from tortoise.models import Model
+from tortoise.queryset import QuerySet
+from tortoise.signals import post_delete, post_save, pre_delete
 
 
 class User(Model):
@@ -45,6 +51,12 @@ def cast_audio_source(s: str) -> AudioSource:
             raise ValueError(f"Invalid audio source {s}")
 
 
+class AudioStatus(enum.Enum):
+    pending = "pending"
+    ready = "ready"
+    failed = "failed"
+
+
 class Audio(Model):
     id = fields.IntField(pk=True)
     key = fields.UUIDField(unique=True, index=True)
@@ -63,6 +75,36 @@ class Audio(Model):
     sample_rate = fields.IntField()
     duration = fields.FloatField()
     public = fields.BooleanField(default=False)
+    # Audio uploaded asynchronously is pending until it has been converted,
+    # at which point the format fields above are filled in.
+    status = fields.CharEnumField(enum_type=AudioStatus, default=AudioStatus.ready, index=True)
+    # Set when a process starts converting a pending upload, so that other
+    # processes leave it alone.
+    claimed_at = fields.DatetimeField(null=True)
+    # Used for sampling random public audio without sorting the whole table.
+    random_key = fields.FloatField(default=random.random)
+
+    class Meta:
+        # Covers paging through a user's audio, newest first, and sampling
+        # public audio, optionally from a single source.
+        indexes = (
+            ("user_id", "created", "id"),
+            ("public", "random_key"),
+            ("public", "source", "random_key"),
+        )
+
+
+class AudioPeaks(Model):
+    id = fields.IntField(pk=True)
+    audio: fields.OneToOneRelation[Audio] = fields.OneToOneField(
+        "models.Audio",
+        related_name="peaks",
+        on_delete=fields.CASCADE,
+        null=False,
+    )
+    # The waveform peaks at a few resolutions, keyed by the number of bins,
+    # so that clients can draw the waveform without fetching the audio.
+    peaks = fields.JSONField()
 
 
 class AudioDeleteTask(Model):
@@ -104,6 +146,16 @@ class Generation(Model):
     elapsed_time = fields.FloatField()
     task_finished = fields.DatetimeField(auto_now_add=True)
     public = fields.BooleanField(default=False)
+    # Used for sampling random public generations without sorting the whole table.
+    random_key = fields.FloatField(default=random.random)
+
+    class Meta:
+        # Covers paging through a user's generations, newest first, and
+        # sampling public generations.
+        indexes = (
+            ("user_id", "task_finished", "id"),
+            ("public", "random_key"),
+        )
 
 
 class Task(Model):
@@ -128,6 +180,9 @@ class Task(Model):
     model = fields.CharField(max_length=255, index=True)
     elapsed_time = fields.FloatField()
     task_finished = fields.DatetimeField(auto_now_add=True)
+    # Breakdown of the elapsed time by model stage, in seconds, along with
+    # the number of diffusion steps, for tracking down slow generations.
+    timings = fields.JSONField(null=True)
 
 
 class Collection(Model):
@@ -147,3 +202,120 @@ class Collection(Model):
         index=True,
         null=False,
     )
+
+
+class AudioCounter(Model):
+    # The number of audio rows each user has from each source, kept up to
+    # date by the signal handlers below, so that listings don't have to count
+    # all of the user's rows. Drift can be fixed with ``bot.api.counters``.
+    id = fields.IntField(pk=True)
+    user: fields.ForeignKeyRelation[User] = fields.ForeignKeyField(
+        "models.User",
+        related_name="audio_counters",
+        on_delete=fields.CASCADE,
+        index=True,
+        null=False,
+    )
+    source = fields.CharEnumField(enum_type=AudioSource)
+    count = fields.IntField(default=0)
+
+    class Meta:
+        unique_together = (("user", "source"),)
+
+
+class GenerationCounter(Model):
+    # The number of generation rows each user has, like the audio counters.
+    id = fields.IntField(pk=True)
+    user: fields.OneToOneRelation[User] = fields.OneToOneField(
+        "models.User",
+        related_name="generation_counter",
+        on_delete=fields.CASCADE,
+        null=False,
+    )
+    count = fields.IntField(default=0)
+
+
+# The counter rows are created with conflicts ignored, since with
+# get_or_create, two concurrent first writes for the same user would hit the
+# unique constraint and abort the caller's transaction.
+
+
+async def add_audio_count(user_id: int, source: AudioSource, delta: int, using_db: BaseDBAsyncClient | None) -> None:
+    counter = AudioCounter(user_id=user_id, source=source)
+    await AudioCounter.bulk_create([counter], ignore_conflicts=True, using_db=using_db)
+    query = AudioCounter.filter(user_id=user_id, source=source)
+    await (query if using_db is None else query.using_db(using_db)).update(count=F("count") + delta)
+
+
+async def add_generation_count(user_id: int, delta: int, using_db: BaseDBAsyncClient | None) -> None:
+    counter = GenerationCounter(user_id=user_id)
+    await GenerationCounter.bulk_create([counter], ignore_conflicts=True, using_db=using_db)
+    query = GenerationCounter.filter(user_id=user_id)
+    await (query if using_db is None else query.using_db(using_db)).update(count=F("count") + delta)
+
+
+# The counters are updated on the same connection as the row, so that they
+# are updated in the same transaction when there is one. Bulk operations skip
+# the signals, so they have to update the counters themselves.
+
+
+@post_save(Audio)
+async def _on_audio_saved(
+    sender: type[Audio],
+    instance: Audio,
+    created: bool,
+    using_db: BaseDBAsyncClient | None,
+    update_fields: list[str],
+) -> None:
+    if created:
+        await add_audio_count(instance.user_id, instance.source, 1, using_db)
+
+
+async def subtract_generation_counts(query: QuerySet[Generation], using_db: BaseDBAsyncClient | None) -> None:
+    """Updates the generation counters for generations which will be deleted.
+
+    Deleting audio cascades in the database to the generations which used
+    it, which can belong to other users, so this should be called first.
+
+    Args:
+        query: The generations which will be deleted.
+        using_db: The connection to read the generations and update the
+            counters on.
+    """
+    query = query if using_db is None else query.using_db(using_db)
+    rows: list[dict[str, Any]] = await query.annotate(num=Count("id")).group_by("user_id").values("user_id", "num")
+    for row in rows:
+        await add_generation_count(row["user_id"], -row["num"], using_db)
+
+
+@pre_delete(Audio)
+async def _on_audio_deleting(sender: type[Audio], instance: Audio, using_db: BaseDBAsyncClient | None) -> None:
+    # Deleting audio cascades to the generations which used it.
+    query = Generation.filter(Q(source_id=instance.id) | Q(reference_id=instance.id) | Q(output_id=instance.id))
+    await subtract_generation_counts(query, using_db)
+
+
+@post_delete(Audio)
+async def _on_audio_deleted(sender: type[Audio], instance: Audio, using_db: BaseDBAsyncClient | None) -> None:
+    await add_audio_count(instance.user_id, instance.source, -1, using_db)
+
+
+@post_save(Generation)
+async def _on_generation_saved(
+    sender: type[Generation],
+    instance: Generation,
+    created: bool,
+    using_db: BaseDBAsyncClient | None,
+    update_fields: list[str],
+) -> None:
+    if created:
+        await add_generation_count(instance.user_id, 1, using_db)
+
+
+@post_delete(Generation)
+async def _on_generation_deleted(
+    sender: type[Generation],
+    instance: Generation,
+    using_db: BaseDBAsyncClient | None,
+) -> None:
+    await add_generation_count(instance.user_id, -1, using_db)
@@ -0,0 +1,123 @@
+"""Defines a background pipeline for converting uploaded audio.
+
+Converting an upload means decoding, resampling and encoding it, and then
+writing it to the storage backend, which can take long enough that clients
+on slow connections time out waiting for it. Instead, uploads can be stored
+as-is with a pending row, and converted here afterwards.
+
+The pipeline is a bounded queue of pending audio IDs, drained by a fixed
+number of worker tasks. The heavy lifting still happens in the shared
+executor, so the workers only bound how many uploads are converted at once.
+When the queue is full, new uploads are refused rather than queued, so that
+the backlog can't grow without bound. Rows which are still pending when the
+app starts, for example because the process was restarted, are queued again.
+Each row is claimed before it is converted, so rows which another process
+is already converting are skipped.
+"""
+
+import asyncio
+import functools
+import logging
+from dataclasses import dataclass
+from typing import cast
+
+from bot.api.audio import process_pending_audio
+from bot.api.model import Audio, AudioStatus
+from bot.settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class PipelineStats:
+    num_queued: int = 0
+    num_processed: int = 0
+
+
+class UploadPipeline:
+    """Converts pending uploads in the background.
+
+    Args:
+        num_workers: The number of uploads to convert at once.
+        max_queue_size: The maximum number of uploads waiting to be converted.
+    """
+
+    def __init__(self, num_workers: int, max_queue_size: int) -> None:
+        super().__init__()
+
+        self.num_workers = num_workers
+        self.queue: asyncio.Queue[int] = asyncio.Queue(max_queue_size)
+        self.stats = PipelineStats()
+        self._tasks: list[asyncio.Task] = []
+
+    def is_full(self) -> bool:
+        return self.queue.full()
+
+    def submit(self, audio_id: int) -> bool:
+        """Queues a pending upload to be converted.
+
+        Args:
+            audio_id: The ID of the pending audio row.
+
+        Returns:
+            True if the upload was queued, or False if the queue is full.
+        """
+        try:
+            self.queue.put_nowait(audio_id)
+        except asyncio.QueueFull:
+            return False
+        self.stats.num_queued += 1
+        return True
+
+    async def _requeue_pending(self) -> None:
+        audio_ids = cast(list[int], await Audio.filter(status=AudioStatus.pending).values_list("id", flat=True))
+        if audio_ids:
+            logger.info("Queueing %d pending uploads", len(audio_ids))
+        for audio_id in audio_ids:
+            await self.queue.put(audio_id)
+            self.stats.num_queued += 1
+
+    async def _worker(self) -> None:
+        while True:
+            audio_id = await self.queue.get()
+            try:
+                if (audio := await Audio.get_or_none(id=audio_id, status=AudioStatus.pending)) is not None:
+                    await process_pending_audio(audio)
+                self.stats.num_processed += 1
+            except Exception:
+                logger.exception("Error processing pending upload %d", audio_id)
+            finally:
+                self.queue.task_done()
+
+    def start(self) -> None:
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.num_workers)]
+        self._tasks.append(asyncio.create_task(self._requeue_pending()))
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def get_stats(self) -> dict[str, int]:
+        return {
+            "num_workers": self.num_workers,
+            "queue_size": self.queue.qsize(),
+            "max_queue_size": self.queue.maxsize,
+            "num_queued": self.stats.num_queued,
+            "num_processed": self.stats.num_processed,
+        }
+
+
+@functools.lru_cache()
+def get_upload_pipeline() -> UploadPipeline:
+    return UploadPipeline(
+        num_workers=settings.upload.num_workers,
+        max_queue_size=settings.upload.max_queue_size,
+    )
+
+
+async def close_upload_pipeline() -> None:
+    if get_upload_pipeline.cache_info().currsize > 0:
+        await get_upload_pipeline().stop()
+        get_upload_pipeline.cache_clear()
@@ -0,0 +1,102 @@
+"""Defines a cache for the users and tokens which requests authenticate as.
+
+Session tokens are self-contained, but checking that their user is still
+allowed to use the API, or that a refresh token hasn't been disabled, needs
+a database lookup. Since the same users make many requests in a row, the
+lookups are cached in bounded in-process caches with a short time-to-live.
+
+Changes made through the API invalidate the cached entries in the process
+which made them. Other processes pick up the change once their entries
+expire, so the time-to-live bounds how long a ban can take to apply.
+"""
+
+import functools
+from dataclasses import dataclass
+
+from bot.api.cache import LRUCache
+from bot.api.model import Token, User
+from bot.settings import settings
+
+
+@dataclass(frozen=True)
+class Principal:
+    user_id: int
+    email: str
+    banned: bool
+    deleted: bool
+
+    @property
+    def is_admin(self) -> bool:
+        return self.email in settings.user.admin_emails
+
+
+@dataclass(frozen=True)
+class TokenInfo:
+    user_id: int
+    disabled: bool
+
+
+@functools.lru_cache()
+def get_user_cache() -> LRUCache[int, Principal]:
+    return LRUCache(settings.user.cache_size, settings.user.cache_ttl)
+
+
+@functools.lru_cache()
+def get_token_cache() -> LRUCache[int, TokenInfo]:
+    return LRUCache(settings.user.cache_size, settings.user.cache_ttl)
+
+
+async def get_principal(user_id: int) -> Principal | None:
+    """Gets the status of a user, from the cache if possible.
+
+    Args:
+        user_id: The ID of the user.
+
+    Returns:
+        The user's status, or None if the user doesn't exist.
+    """
+    cache = get_user_cache()
+    if (principal := cache.get(user_id)) is not None:
+        return principal
+    user_obj = await User.get_or_none(id=user_id)
+    if user_obj is None:
+        return None
+    principal = Principal(user_id=user_obj.id, email=user_obj.email, banned=user_obj.banned, deleted=user_obj.deleted)
+    cache.put(user_id, principal)
+    return principal
+
+
+async def get_token_info(token_id: int) -> TokenInfo | None:
+    """Gets the status of a refresh token, from the cache if possible.
+
+    Args:
+        token_id: The ID of the token.
+
+    Returns:
+        The token's status, or None if the token doesn't exist.
+    """
+    cache = get_token_cache()
+    if (info := cache.get(token_id)) is not None:
+        return info
+    token = await Token.get_or_none(id=token_id)
+    if token is None:
+        return None
+    info = TokenInfo(user_id=token.user_id, disabled=token.disabled)
+    cache.put(token_id, info)
+    return info
+
+
+def invalidate_user(user_id: int) -> None:
+    get_user_cache().pop(user_id)
+
+
+def get_principal_stats() -> dict[str, float | int]:
+    return {
+        **{f"users_{k}": v for k, v in get_user_cache().get_stats().items()},
+        **{f"tokens_{k}": v for k, v in get_token_cache().get_stats().items()},
+    }
+
+
+def clear_principal_cache() -> None:
+    get_user_cache.cache_clear()
+    get_token_cache.cache_clear()
@@ -0,0 +1,39 @@
+"""Defines random sampling of rows which doesn't scan the whole table.
+
+Ordering by ``RANDOM()`` has to generate a value for every matching row and
+sort all of them, so it gets slower as the table grows. Instead, each row is
+given a random key when it is created, which is indexed alongside the
+columns that the rows are filtered on. A sample is then the rows whose keys
+come just after a random point, wrapping around to the start of the key
+space if there aren't enough of them, which only reads the rows it returns.
+"""
+
+import random
+from typing import Any, TypeVar
+
+from tortoise.models import Model
+from tortoise.queryset import QuerySet
+
+M = TypeVar("M", bound=Model)
+
+
+async def sample_values(query: QuerySet[M], count: int, *fields: str) -> list[dict[str, Any]]:
+    """Samples random rows from a query.
+
+    Args:
+        query: The query to sample from; the model must have an indexed
+            ``random_key`` field.
+        count: The maximum number of rows to sample.
+        fields: The fields to return for each row.
+
+    Returns:
+        The sampled rows, in random order.
+    """
+    if count <= 0:
+        return []
+    start = random.random()
+    rows = await query.filter(random_key__gte=start).order_by("random_key").limit(count).values(*fields)
+    if len(rows) < count:
+        rows += await query.filter(random_key__lt=start).order_by("random_key").limit(count - len(rows)).values(*fields)
+    random.shuffle(rows)
+    return rows
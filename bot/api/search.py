@@ -0,0 +1,174 @@
+"""Defines indexed substring search over audio names.
+
+A filter like ``name ILIKE '%q%'`` can't use a b-tree index, so searching a
+user's audio by name has to scan all of their rows. Instead, names are
+indexed by their trigrams, which can find the rows containing a substring
+directly, and rank them by how closely they match:
+
+- On PostgreSQL, the ``pg_trgm`` extension provides a GIN index which serves
+    ``ILIKE`` queries, and results are ranked by ``similarity()``. The index
+    is created by a migration.
+- On SQLite, an external-content FTS5 table with the trigram tokenizer is
+    kept in sync with the audio table by triggers, and results are ranked by
+    BM25. The table and triggers are created by :func:`init_search`, since
+    SQLite databases aren't migrated. The trigram tokenizer can't match
+    queries shorter than three characters, so those fall back to a scan.
+"""
+
+import logging
+from typing import Any, cast
+
+from tortoise import connections
+from tortoise.exceptions import OperationalError
+
+from bot.api.db import get_read_connection
+from bot.api.model import Audio, AudioSource
+from bot.settings import settings
+
+logger = logging.getLogger(__name__)
+
+FTS_TABLE = "audio_name_fts"
+
+# The shortest query which the SQLite trigram tokenizer can match.
+MIN_TRIGRAM_LENGTH = 3
+
+_SQLITE_SETUP_SCRIPT = f"""
+CREATE TRIGGER IF NOT EXISTS "{FTS_TABLE}_insert" AFTER INSERT ON "audio" BEGIN
+    INSERT INTO "{FTS_TABLE}" ("rowid", "name") VALUES (new."id", new."name");
+END;
+CREATE TRIGGER IF NOT EXISTS "{FTS_TABLE}_delete" AFTER DELETE ON "audio" BEGIN
+    INSERT INTO "{FTS_TABLE}" ("{FTS_TABLE}", "rowid", "name") VALUES ('delete', old."id", old."name");
+END;
+CREATE TRIGGER IF NOT EXISTS "{FTS_TABLE}_update" AFTER UPDATE OF "name" ON "audio" BEGIN
+    INSERT INTO "{FTS_TABLE}" ("{FTS_TABLE}", "rowid", "name") VALUES ('delete', old."id", old."name");
+    INSERT INTO "{FTS_TABLE}" ("rowid", "name") VALUES (new."id", new."name");
+END;
+"""
+
+_sqlite_fts_enabled = False
+
+
+async def init_search() -> None:
+    """Creates the SQLite full-text index for audio names, if needed.
+
+    This is safe to call every time the database is initialized. If the
+    index is newly created, it is built from the existing rows. On other
+    databases, this does nothing.
+    """
+    global _sqlite_fts_enabled
+
+    if settings.database.kind != "sqlite":
+        return
+    conn = connections.get("default")
+    rows = await conn.execute_query_dict(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name = ?", [FTS_TABLE]
+    )
+    try:
+        if not rows:
+            await conn.execute_script(
+                f"CREATE VIRTUAL TABLE \"{FTS_TABLE}\" USING fts5(\"name\", content='audio', content_rowid='id', "
+                "tokenize='trigram');"
+            )
+            await conn.execute_script(f'INSERT INTO "{FTS_TABLE}" ("{FTS_TABLE}") VALUES (\'rebuild\');')
+        await conn.execute_script(_SQLITE_SETUP_SCRIPT)
+    except OperationalError:
+        # The trigram tokenizer was added in SQLite 3.34.
+        logger.warning("Failed to create the audio name index; searches will scan the table", exc_info=True)
+        _sqlite_fts_enabled = False
+    else:
+        _sqlite_fts_enabled = True
+
+
+def _escape_like(q: str) -> str:
+    return q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+async def _search_postgres(
+    user_id: int,
+    q: str,
+    source: AudioSource | None,
+    start: int,
+    limit: int,
+) -> tuple[list[int], int]:
+    params: list[Any] = [user_id, f"%{_escape_like(q)}%"]
+    where = '"user_id" = $1 AND "name" ILIKE $2'
+    if source is not None:
+        params.append(source.value)
+        where += f' AND "source" = ${len(params)}'
+    conn = get_read_connection()
+    page_sql = (
+        f'SELECT "id" FROM "audio" WHERE {where} '
+        f'ORDER BY similarity("name", ${len(params) + 1}) DESC, "created" DESC, "id" DESC '
+        f"LIMIT ${len(params) + 2} OFFSET ${len(params) + 3}"
+    )
+    rows = await conn.execute_query_dict(page_sql, [*params, q, limit, start])
+    count_rows = await conn.execute_query_dict(f'SELECT COUNT(*) AS "total" FROM "audio" WHERE {where}', params)
+    return [row["id"] for row in rows], count_rows[0]["total"]
+
+
+async def _search_sqlite(
+    user_id: int,
+    q: str,
+    source: AudioSource | None,
+    start: int,
+    limit: int,
+) -> tuple[list[int], int]:
+    # The query is matched as a single phrase, so that it is treated as a
+    # substring rather than as FTS5 query syntax.
+    params: list[Any] = ['"' + q.replace('"', '""') + '"', user_id]
+    where = f'"{FTS_TABLE}" MATCH ? AND "audio"."user_id" = ?'
+    if source is not None:
+        params.append(source.value)
+        where += ' AND "audio"."source" = ?'
+    join = f'"{FTS_TABLE}" JOIN "audio" ON "audio"."id" = "{FTS_TABLE}"."rowid"'
+    conn = get_read_connection()
+    page_sql = (
+        f'SELECT "audio"."id" FROM {join} WHERE {where} '
+        f'ORDER BY "{FTS_TABLE}"."rank", "audio"."created" DESC, "audio"."id" DESC LIMIT ? OFFSET ?'
+    )
+    rows = await conn.execute_query_dict(page_sql, [*params, limit, start])
+    count_rows = await conn.execute_query_dict(f'SELECT COUNT(*) AS "total" FROM {join} WHERE {where}', params)
+    return [row["id"] for row in rows], count_rows[0]["total"]
+
+
+async def _search_scan(
+    user_id: int,
+    q: str,
+    source: AudioSource | None,
+    start: int,
+    limit: int,
+) -> tuple[list[int], int]:
+    query = Audio.filter(user_id=user_id, name__icontains=q)
+    if source is not None:
+        query = query.filter(source=source)
+    ids = await query.order_by("-created", "-id").offset(start).limit(limit).values_list("id", flat=True)
+    return cast(list[int], ids), await query.count()
+
+
+async def search_audio(
+    user_id: int,
+    q: str,
+    source: AudioSource | None,
+    start: int,
+    limit: int,
+) -> tuple[list[int], int]:
+    """Searches a user's audio for names containing a substring.
+
+    Args:
+        user_id: The ID of the user whose audio to search.
+        q: The substring to search for, ignoring case.
+        source: If set, only search audio from this source.
+        start: The number of results to skip.
+        limit: The maximum number of results to return.
+
+    Returns:
+        The IDs of the matching audio, best matches first, and the total
+        number of matches.
+    """
+    match settings.database.kind:
+        case "postgres":
+            return await _search_postgres(user_id, q, source, start, limit)
+        case "sqlite" if _sqlite_fts_enabled and len(q) >= MIN_TRIGRAM_LENGTH:
+            return await _search_sqlite(user_id, q, source, start, limit)
+        case _:
+            return await _search_scan(user_id, q, source, start, limit)
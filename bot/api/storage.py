@@ -0,0 +1,336 @@
+"""Defines the storage backends for audio files.
+
+The backend is chosen once from the ``file.fs_type`` setting:
+
+- ``file``: Stores objects in a directory on the local file system.
+- ``s3``: Stores objects in an S3 bucket, using a single long-lived client
+    with a connection pool, so that connections are reused across requests.
+- ``memory``: Stores objects in a dictionary, for tests and benchmarks.
+
+Objects are identified by their name, such as ``<key>.flac``; each backend
+decides where the object actually lives.
+"""
+
+import asyncio
+import functools
+import logging
+import os
+import tempfile
+import time
+from abc import ABC, abstractmethod
+from contextlib import AsyncExitStack
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, AsyncIterator, Literal, cast, get_args
+
+import aioboto3
+from aiobotocore.config import AioConfig
+
+from bot.api.cache import LRUCache
+from bot.api.executor import run_in_executor
+from bot.settings import settings
+
+logger = logging.getLogger(__name__)
+
+FSType = Literal["file", "s3", "memory"]
+
+# The maximum number of keys which S3 accepts in one DeleteObjects request.
+S3_MAX_DELETE_KEYS = 1000
+
+
+@functools.lru_cache()
+def get_fs_type() -> FSType:
+    fs_type_str = settings.file.fs_type
+    assert fs_type_str in get_args(FSType), f"Invalid file system type in configuration: {fs_type_str}"
+    return cast(FSType, fs_type_str)
+
+
+@dataclass(frozen=True)
+class ObjectInfo:
+    name: str
+    size: int
+    modified: float
+
+
+class Storage(ABC):
+    @abstractmethod
+    async def put(self, name: str, data: bytes) -> None:
+        """Writes an object, replacing any existing object with the same name.
+
+        Args:
+            name: The name of the object.
+            data: The contents of the object.
+        """
+
+    @abstractmethod
+    async def get(self, name: str) -> bytes:
+        """Reads an object.
+
+        Args:
+            name: The name of the object.
+
+        Returns:
+            The contents of the object.
+
+        Raises:
+            FileNotFoundError: If the object doesn't exist.
+        """
+
+    @abstractmethod
+    async def delete(self, name: str) -> None:
+        """Deletes an object.
+
+        Args:
+            name: The name of the object.
+        """
+
+    async def delete_many(self, names: list[str]) -> None:
+        """Deletes many objects, ignoring any which don't exist.
+
+        Args:
+            names: The names of the objects.
+        """
+        for name in names:
+            try:
+                await self.delete(name)
+            except FileNotFoundError:
+                pass
+
+    @abstractmethod
+    def list_objects(self) -> AsyncIterator[ObjectInfo]:
+        """Lists all of the stored objects.
+
+        Returns:
+            An iterator over the name, size and modification time of each
+            object, in no particular order.
+        """
+
+    def get_path(self, name: str) -> str | None:
+        """Gets the local path of an object, if it is stored on disk.
+
+        Args:
+            name: The name of the object.
+
+        Returns:
+            The path to the object, or None if it isn't stored locally.
+        """
+        return None
+
+    async def get_url(self, name: str) -> str | None:
+        """Gets a URL which clients can fetch an object from directly.
+
+        Args:
+            name: The name of the object.
+
+        Returns:
+            The URL, or None if the object has to be served by the API.
+        """
+        return None
+
+    def get_metrics(self) -> dict[str, float | int]:
+        return {}
+
+    async def close(self) -> None:
+        """Releases any resources held by the backend."""
+
+
+def write_file(fs_path: str, data: bytes) -> None:
+    # Writes to a temporary file in the same directory and renames it, so
+    # that readers never see a partially written file.
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(fs_path), suffix=".tmp", delete=False) as temp_file:
+        temp_file.write(data)
+    os.replace(temp_file.name, fs_path)
+
+
+def _read_file(fs_path: str) -> bytes:
+    with open(fs_path, "rb") as f:
+        return f.read()
+
+
+class FileStorage(Storage):
+    def __init__(self, root_dir: str) -> None:
+        super().__init__()
+
+        (root_path := Path(root_dir).expanduser().resolve()).mkdir(parents=True, exist_ok=True)
+        self.root_path = root_path
+
+    def get_path(self, name: str) -> str:
+        return str(self.root_path / name)
+
+    async def put(self, name: str, data: bytes) -> None:
+        await run_in_executor(write_file, self.get_path(name), data)
+
+    async def get(self, name: str) -> bytes:
+        return await run_in_executor(_read_file, self.get_path(name))
+
+    async def delete(self, name: str) -> None:
+        os.remove(self.get_path(name))
+
+    async def list_objects(self) -> AsyncIterator[ObjectInfo]:
+        entries = await run_in_executor(lambda: list(os.scandir(self.root_path)))
+        for entry in entries:
+            if entry.is_file():
+                stat = entry.stat()
+                yield ObjectInfo(entry.name, stat.st_size, stat.st_mtime)
+
+
+class S3Storage(Storage):
+    def __init__(
+        self,
+        bucket: str,
+        subfolder: str,
+        url_expiration: int,
+        max_pool_connections: int,
+        max_concurrency: int,
+        max_attempts: int,
+        url_cache_size: int,
+        url_cache_margin: int,
+    ) -> None:
+        super().__init__()
+
+        self.bucket = bucket
+        self.subfolder = subfolder
+        self.url_expiration = url_expiration
+        self.url_cache: LRUCache[str, str] = LRUCache(url_cache_size, url_expiration - url_cache_margin)
+
+        self._session = aioboto3.Session()
+        self._config = AioConfig(
+            max_pool_connections=max_pool_connections,
+            retries={"max_attempts": max_attempts, "mode": "adaptive"},
+        )
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._client: Any = None
+        self._client_lock = asyncio.Lock()
+        self._exit_stack = AsyncExitStack()
+
+    def _get_s3_path(self, name: str) -> str:
+        return f"{self.subfolder}/{name}"
+
+    async def _get_client(self) -> Any:  # noqa: ANN401
+        # The client is created lazily, since it has to be created inside the
+        # event loop that it will be used from.
+        if self._client is None:
+            async with self._client_lock:
+                if self._client is None:
+                    client_context = self._session.client("s3", config=self._config)
+                    self._client = await self._exit_stack.enter_async_context(client_context)
+        return self._client
+
+    async def put(self, name: str, data: bytes) -> None:
+        client = await self._get_client()
+        async with self._semaphore:
+            await client.put_object(Bucket=self.bucket, Key=self._get_s3_path(name), Body=data)
+
+    async def get(self, name: str) -> bytes:
+        client = await self._get_client()
+        async with self._semaphore:
+            try:
+                obj = await client.get_object(Bucket=self.bucket, Key=self._get_s3_path(name))
+            except client.exceptions.NoSuchKey:
+                raise FileNotFoundError(name)
+            async with obj["Body"] as stream:
+                return await stream.read()
+
+    async def delete(self, name: str) -> None:
+        client = await self._get_client()
+        async with self._semaphore:
+            await client.delete_object(Bucket=self.bucket, Key=self._get_s3_path(name))
+        self.url_cache.pop(name)
+
+    async def delete_many(self, names: list[str]) -> None:
+        client = await self._get_client()
+        for i in range(0, len(names), S3_MAX_DELETE_KEYS):
+            objects = [{"Key": self._get_s3_path(name)} for name in names[i : i + S3_MAX_DELETE_KEYS]]
+            async with self._semaphore:
+                response = await client.delete_objects(Bucket=self.bucket, Delete={"Objects": objects, "Quiet": True})
+            if errors := response.get("Errors"):
+                raise RuntimeError(f"Failed to delete {len(errors)} objects, including {errors[0]}")
+        for name in names:
+            self.url_cache.pop(name)
+
+    async def list_objects(self) -> AsyncIterator[ObjectInfo]:
+        client = await self._get_client()
+        prefix = self._get_s3_path("")
+        paginator = client.get_paginator("list_objects_v2")
+        async for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            for obj in page.get("Contents", []):
+                yield ObjectInfo(obj["Key"][len(prefix) :], obj["Size"], obj["LastModified"].timestamp())
+
+    async def get_url(self, name: str) -> str:
+        if (url := self.url_cache.get(name)) is not None:
+            return url
+        client = await self._get_client()
+        url = await client.generate_presigned_url(
+            ClientMethod="get_object",
+            Params={"Bucket": self.bucket, "Key": self._get_s3_path(name)},
+            ExpiresIn=self.url_expiration,
+        )
+        self.url_cache.put(name, url)
+        return url
+
+    def get_metrics(self) -> dict[str, float | int]:
+        return {f"url_cache_{k}": v for k, v in self.url_cache.get_stats().items()}
+
+    async def close(self) -> None:
+        await self._exit_stack.aclose()
+        self._client = None
+
+
+class MemoryStorage(Storage):
+    def __init__(self) -> None:
+        super().__init__()
+
+        self.objects: dict[str, bytes] = {}
+        self.modified: dict[str, float] = {}
+
+    async def put(self, name: str, data: bytes) -> None:
+        self.objects[name] = data
+        self.modified[name] = time.time()
+
+    async def get(self, name: str) -> bytes:
+        if name not in self.objects:
+            raise FileNotFoundError(name)
+        return self.objects[name]
+
+    async def delete(self, name: str) -> None:
+        if self.objects.pop(name, None) is None:
+            raise FileNotFoundError(name)
+        self.modified.pop(name, None)
+
+    async def list_objects(self) -> AsyncIterator[ObjectInfo]:
+        for name, data in list(self.objects.items()):
+            yield ObjectInfo(name, len(data), self.modified[name])
+
+
+@functools.lru_cache()
+def get_storage() -> Storage:
+    fs_type = get_fs_type()
+
+    match fs_type:
+        case "file":
+            return FileStorage(settings.file.local.root_dir)
+
+        case "s3":
+            s3_settings = settings.file.s3
+            return S3Storage(
+                bucket=s3_settings.bucket,
+                subfolder=s3_settings.subfolder,
+                url_expiration=s3_settings.url_expiration,
+                max_pool_connections=s3_settings.max_pool_connections,
+                max_concurrency=s3_settings.max_concurrency,
+                max_attempts=s3_settings.max_attempts,
+                url_cache_size=s3_settings.url_cache_size,
+                url_cache_margin=s3_settings.url_cache_margin,
+            )
+
+        case "memory":
+            return MemoryStorage()
+
+        case _:
+            raise ValueError(f"Invalid file system type: {fs_type}")
+
+
+async def close_storage() -> None:
+    if get_storage.cache_info().currsize > 0:
+        await get_storage().close()
+        get_storage.cache_clear()
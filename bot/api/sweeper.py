@@ -0,0 +1,172 @@
+"""Defines a job which removes audio blobs that are no longer needed.
+
+Deleting audio only removes the database row right away, and leaves behind
+an :class:`AudioDeleteTask` for the blob. The blob is normally deleted by a
+background task straight after, but if the process dies first, the task
+is left behind. Blobs can also be orphaned without any task, for example if
+an upload fails between writing the blob and creating the row.
+
+The sweeper does two passes over the storage backend:
+
+1. Drains the pending delete tasks in batches, deleting the blobs (up to
+    1000 per request for S3) and then the tasks.
+2. Finds blobs which don't have a matching audio row, and deletes the ones
+    that are older than a grace period, so that in-flight uploads are left
+    alone.
+
+It reports the number of bytes reclaimed by each pass.
+
+.. code-block:: bash
+
+    python -m bot.api.sweeper --grace-period 3600 --dry-run
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import sys
+import time
+from dataclasses import asdict, dataclass
+from typing import cast
+from uuid import UUID
+
+from ml.utils.logging import configure_logging
+
+from bot.api.audio import get_object_name, get_sidecar_name, get_upload_name
+from bot.api.db import close_db, init_db
+from bot.api.model import Audio, AudioDeleteTask
+from bot.api.storage import ObjectInfo, Storage, close_storage, get_storage
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class SweepStats:
+    num_tasks: int = 0
+    num_task_objects: int = 0
+    task_bytes: int = 0
+    num_orphans: int = 0
+    orphan_bytes: int = 0
+
+    @property
+    def reclaimed_bytes(self) -> int:
+        return self.task_bytes + self.orphan_bytes
+
+
+def _parse_key(name: str) -> UUID | None:
+    try:
+        return UUID(name.split(".", 1)[0])
+    except ValueError:
+        return None
+
+
+async def drain_delete_tasks(
+    storage: Storage,
+    objects: dict[str, ObjectInfo],
+    stats: SweepStats,
+    batch_size: int,
+    dry_run: bool,
+) -> None:
+    """Deletes the blobs for pending delete tasks, then the tasks.
+
+    Args:
+        storage: The storage backend.
+        objects: The stored objects, by name; deleted objects are removed.
+        stats: The stats to update.
+        batch_size: The number of tasks to handle at once.
+        dry_run: If set, only count what would be deleted.
+    """
+    last_id = 0
+    while True:
+        tasks = await AudioDeleteTask.filter(id__gt=last_id).order_by("id").limit(batch_size)
+        if not tasks:
+            break
+        last_id = tasks[-1].id
+        names = [
+            name
+            for task in tasks
+            for name in (get_object_name(task.key), get_sidecar_name(task.key), get_upload_name(task.key))
+        ]
+        names = [name for name in names if name in objects]
+        if not dry_run:
+            await storage.delete_many(names)
+            await AudioDeleteTask.filter(id__in=[task.id for task in tasks]).delete()
+        stats.num_tasks += len(tasks)
+        stats.num_task_objects += len(names)
+        stats.task_bytes += sum(objects.pop(name).size for name in names)
+        logger.info("Handled %d delete tasks (%d objects)", stats.num_tasks, stats.num_task_objects)
+
+
+async def delete_orphans(
+    storage: Storage,
+    objects: dict[str, ObjectInfo],
+    stats: SweepStats,
+    batch_size: int,
+    grace_period: float,
+    dry_run: bool,
+) -> None:
+    """Deletes blobs which don't have a matching audio row.
+
+    Args:
+        storage: The storage backend.
+        objects: The stored objects, by name.
+        stats: The stats to update.
+        batch_size: The number of keys to look up at once.
+        grace_period: Objects modified more recently than this many seconds
+            ago are skipped.
+        dry_run: If set, only count what would be deleted.
+    """
+    cutoff = time.time() - grace_period
+    keys: dict[UUID, list[ObjectInfo]] = {}
+    for info in objects.values():
+        if info.modified < cutoff and (key := _parse_key(info.name)) is not None:
+            keys.setdefault(key, []).append(info)
+
+    key_list = list(keys)
+    for i in range(0, len(key_list), batch_size):
+        batch = key_list[i : i + batch_size]
+        existing = set(cast(list[UUID], await Audio.filter(key__in=batch).values_list("key", flat=True)))
+        orphans = [info for key in batch if key not in existing for info in keys[key]]
+        if not orphans:
+            continue
+        if not dry_run:
+            await storage.delete_many([info.name for info in orphans])
+        stats.num_orphans += len(orphans)
+        stats.orphan_bytes += sum(info.size for info in orphans)
+        logger.info("Found %d orphaned objects", stats.num_orphans)
+
+
+async def sweep(batch_size: int, grace_period: float, dry_run: bool) -> SweepStats:
+    await init_db()
+    storage = get_storage()
+    try:
+        objects = {info.name: info async for info in storage.list_objects()}
+        logger.info("Found %d stored objects", len(objects))
+        stats = SweepStats()
+        await drain_delete_tasks(storage, objects, stats, batch_size, dry_run)
+        await delete_orphans(storage, objects, stats, batch_size, grace_period, dry_run)
+        return stats
+    finally:
+        await close_storage()
+        await close_db()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Removes audio blobs that are no longer needed.")
+    parser.add_argument("-b", "--batch-size", type=int, default=1000, help="Number of rows to handle at once")
+    parser.add_argument("-g", "--grace-period", type=float, default=3600.0, help="Seconds before a blob is orphaned")
+    parser.add_argument("-n", "--dry-run", action="store_true", help="Only report what would be deleted")
+    args = parser.parse_args()
+
+    configure_logging()
+
+    stats = asyncio.run(sweep(args.batch_size, args.grace_period, args.dry_run))
+    json.dump(
+        {**asdict(stats), "reclaimed_bytes": stats.reclaimed_bytes, "dry_run": args.dry_run}, sys.stdout, indent=2
+    )
+
+
+if __name__ == "__main__":
+    # python -m bot.api.sweeper
+    main()
@@ -0,0 +1,278 @@
+"""Run inference on many pairs of audio files.
+
+The pairs can either come from a directory of source files, which are all
+converted using the same reference file, or from a CSV or JSONL manifest
+with ``source``, ``reference`` and (optionally) ``output`` columns. Relative
+paths in a manifest are resolved relative to the manifest itself.
+
+Pairs with the same reference are sorted by length and batched together, to
+minimize padding. Source audio is zero-padded to the longest source in its
+batch, so outputs can differ slightly from converting each pair on its own;
+use a batch size of 1 to match the single-pair CLI exactly. Audio files are
+decoded and resampled in a process pool while the model runs, and outputs
+are written from a thread pool. Outputs which already exist are
+skipped, so an interrupted run can be resumed by running the same command.
+
+.. code-block:: bash
+
+    python -m bot.model.hubert.batch <key> <inputs> -o <output-dir> [-r <reference>]
+"""
+
+import argparse
+import csv
+import json
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterator, get_args
+
+import numpy as np
+import soundfile as sf
+import torch
+import torchaudio
+import torchaudio.functional as A
+from ml.utils.device.auto import detect_device
+from ml.utils.logging import configure_logging
+
+from bot.model.hubert.model import HUBERT_SAMPLE_RATE
+from bot.model.hubert.pretrained import PretrainedHubertModel, pretrained_hubert
+
+logger = logging.getLogger(__name__)
+
+# Formats which soundfile can't decode are loaded with torchaudio instead.
+AUDIO_EXTS = {f".{fmt.lower()}" for fmt in sf.available_formats()} | {".mp3", ".m4a"}
+
+
+@dataclass(frozen=True)
+class Pair:
+    source: Path
+    reference: Path
+    output: Path
+
+
+def _read_manifest(manifest: Path) -> Iterator[dict[str, str]]:
+    with open(manifest, "r", encoding="utf-8", newline="") as f:
+        match manifest.suffix.lower():
+            case ".csv":
+                yield from csv.DictReader(f)
+            case ".jsonl":
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+            case _:
+                raise ValueError(f"Unsupported manifest type: {manifest}")
+
+
+def get_pairs(inputs: Path, reference: Path | None, output_dir: Path, ext: str) -> list[Pair]:
+    """Gets the pairs to convert.
+
+    Args:
+        inputs: A directory of source files, or a CSV or JSONL manifest.
+        reference: The reference file to use for every source file in the
+            directory; required if ``inputs`` is a directory.
+        output_dir: The directory to write outputs to, for pairs which don't
+            specify an output path.
+        ext: The file extension for outputs.
+
+    Returns:
+        The pairs to convert.
+
+    Raises:
+        ValueError: If the inputs are invalid.
+    """
+
+    def default_output(source: Path, reference: Path) -> Path:
+        return output_dir / f"{source.stem}_to_{reference.stem}.{ext}"
+
+    if inputs.is_dir():
+        if reference is None:
+            raise ValueError("A reference file is required when converting a directory")
+        sources = sorted(p for p in inputs.iterdir() if p.suffix.lower() in AUDIO_EXTS)
+        return [Pair(source, reference, default_output(source, reference)) for source in sources]
+
+    pairs: list[Pair] = []
+    for row in _read_manifest(inputs):
+        source = (inputs.parent / row["source"]).resolve()
+        ref = (inputs.parent / row["reference"]).resolve()
+        output = (inputs.parent / row["output"]).resolve() if row.get("output") else default_output(source, ref)
+        pairs.append(Pair(source, ref, output))
+    return pairs
+
+
+def load_audio(path: Path, sample_rate: int) -> np.ndarray:
+    """Loads an audio file as a mono float32 array at the given sample rate.
+
+    This is run in a worker process.
+
+    Args:
+        path: The path to the audio file.
+        sample_rate: The sample rate to resample to.
+
+    Returns:
+        The audio array, with shape ``(T)``.
+    """
+    try:
+        arr, sr = sf.read(path, dtype="float32", always_2d=True)
+        audio = torch.from_numpy(arr.mean(axis=1))
+    except sf.LibsndfileError:
+        audio_tensor, sr = torchaudio.load(path)
+        audio = audio_tensor.float().mean(dim=0)
+    if sr != sample_rate:
+        audio = A.resample(audio, sr, sample_rate)
+    return audio.numpy()
+
+
+def write_audio(path: Path, audio: np.ndarray, sample_rate: int) -> None:
+    # Writes to a temporary file first, so that interrupted writes are not
+    # mistaken for finished outputs when resuming.
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    sf.write(tmp_path, audio, sample_rate, format=path.suffix[1:].upper())
+    os.replace(tmp_path, path)
+
+
+def get_duration(path: Path) -> float:
+    # Reads the duration from the file header, without decoding.
+    try:
+        return sf.info(path).duration
+    except sf.LibsndfileError:
+        info = torchaudio.info(path)
+        return info.num_frames / info.sample_rate
+
+
+def get_batches(pairs: list[Pair], batch_size: int) -> list[list[Pair]]:
+    """Groups pairs into batches of similar lengths.
+
+    Each batch only has pairs with the same reference, so that references
+    never need to be padded or cropped.
+
+    Args:
+        pairs: The pairs to batch.
+        batch_size: The maximum number of pairs per batch.
+
+    Returns:
+        The batches of pairs.
+    """
+    durations = {pair: get_duration(pair.source) for pair in pairs}
+    by_reference: dict[Path, list[Pair]] = {}
+    for pair in pairs:
+        by_reference.setdefault(pair.reference, []).append(pair)
+    batches: list[list[Pair]] = []
+    for ref_pairs in by_reference.values():
+        ref_pairs = sorted(ref_pairs, key=lambda pair: durations[pair])
+        batches.extend(ref_pairs[i : i + batch_size] for i in range(0, len(ref_pairs), batch_size))
+    return batches
+
+
+def load_batch(pool: ProcessPoolExecutor, batch: list[Pair], sample_rate: int) -> dict[Path, "Future[np.ndarray]"]:
+    paths = {p for pair in batch for p in (pair.source, pair.reference)}
+    return {path: pool.submit(load_audio, path, sample_rate) for path in paths}
+
+
+def collate(batch: list[Pair], audios: dict[Path, np.ndarray]) -> tuple[torch.Tensor, torch.Tensor, list[int]]:
+    """Collates a batch of pairs into padded tensors.
+
+    Source audio is zero-padded to the longest source in the batch. Every
+    pair in a batch has the same reference, which is repeated for each pair.
+
+    Args:
+        batch: The pairs in the batch.
+        audios: The loaded audio arrays for each path in the batch.
+
+    Returns:
+        The source and reference tensors, with shapes ``(B, T)`` and
+        ``(B, T_ref)``, and the unpadded source lengths.
+    """
+    lengths = [len(audios[pair.source]) for pair in batch]
+    src = torch.zeros(len(batch), max(lengths))
+    for i, pair in enumerate(batch):
+        src[i, : lengths[i]] = torch.from_numpy(audios[pair.source])
+    ref = torch.from_numpy(audios[batch[0].reference]).unsqueeze(0).repeat(len(batch), 1)
+    return src, ref, lengths
+
+
+def main() -> None:
+    configure_logging()
+
+    parser = argparse.ArgumentParser(description="Run inference on many pairs of audio files.")
+    parser.add_argument("key", choices=get_args(PretrainedHubertModel), help="The pretrained model key")
+    parser.add_argument("inputs", type=str, help="Directory of source files, or a CSV or JSONL manifest")
+    parser.add_argument("-o", "--output-dir", type=str, required=True, help="Directory to write outputs to")
+    parser.add_argument("-r", "--reference", type=str, help="Reference file to use when converting a directory")
+    parser.add_argument(
+        "-b",
+        "--batch-size",
+        type=int,
+        default=8,
+        help="Number of pairs per batch; sources are zero-padded within a batch, so use 1 for exact outputs",
+    )
+    parser.add_argument("-w", "--num-workers", type=int, default=os.cpu_count(), help="Number of decoding processes")
+    parser.add_argument("-t", "--sampling-timesteps", type=int, help="Number of diffusion sampling timesteps")
+    parser.add_argument("-e", "--ext", type=str, default="flac", help="File extension for outputs")
+    args = parser.parse_args()
+
+    output_dir = Path(args.output_dir)
+    reference = None if args.reference is None else Path(args.reference)
+    all_pairs = get_pairs(Path(args.inputs), reference, output_dir, args.ext)
+    pairs = [pair for pair in all_pairs if not pair.output.exists()]
+    if len(pairs) < len(all_pairs):
+        logger.info("Skipping %d of %d pairs which already have outputs", len(all_pairs) - len(pairs), len(all_pairs))
+    if not pairs:
+        return
+    batches = get_batches(pairs, args.batch_size)
+
+    # Worker processes are spawned rather than forked, so that they don't
+    # inherit any accelerator state once the model is loaded.
+    mp_context = multiprocessing.get_context("spawn")
+    with (
+        ProcessPoolExecutor(args.num_workers, mp_context=mp_context) as load_pool,
+        ThreadPoolExecutor(args.num_workers) as write_pool,
+    ):
+        device = detect_device()
+        model = pretrained_hubert(args.key)
+        model.eval()
+        device.module_to(model)
+
+        write_futures: list[Future] = []
+        num_done, audio_secs, start_time = 0, 0.0, time.time()
+        next_batch = load_batch(load_pool, batches[0], HUBERT_SAMPLE_RATE)
+
+        for i, batch in enumerate(batches):
+            audios = {path: future.result() for path, future in next_batch.items()}
+            if i + 1 < len(batches):
+                next_batch = load_batch(load_pool, batches[i + 1], HUBERT_SAMPLE_RATE)
+
+            src, ref, lengths = collate(batch, audios)
+            with device.autocast_context(), torch.inference_mode():
+                output = model.run(device.tensor_to(src), device.tensor_to(ref), args.sampling_timesteps)
+            output_arr = output.float().cpu().numpy()
+
+            for pair, length, output_row in zip(batch, lengths, output_arr):
+                write_futures.append(
+                    write_pool.submit(write_audio, pair.output, output_row[:length], model.sample_rate)
+                )
+
+            num_done += len(batch)
+            audio_secs += sum(lengths) / HUBERT_SAMPLE_RATE
+            elapsed_time = time.time() - start_time
+            logger.info(
+                "Converted %d / %d pairs (%.2f pairs/sec, %.2fx real-time)",
+                num_done,
+                len(pairs),
+                num_done / elapsed_time,
+                audio_secs / elapsed_time,
+            )
+
+        for future in write_futures:
+            future.result()
+
+    logger.info("Done.")
+
+
+if __name__ == "__main__":
+    # python -m bot.model.hubert.batch
+    main()
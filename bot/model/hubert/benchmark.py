@@ -0,0 +1,243 @@
+"""Benchmarks the stages of the HuBERT model on synthetic audio.
+
+Each configuration in the matrix of durations, batch sizes and sampling
+timesteps is run several times, timing each stage of inference separately.
+The stages are the ones which :meth:`HubertModel.run` records, where
+``get_inputs`` covers ``autoencoder_encode`` and ``hubert``, and
+``vocoder_decode`` is :meth:`HubertModel.get_audio`. The results are reported
+as JSON, with latency percentiles in milliseconds, the real-time factor
+(processing time divided by the amount of audio processed, so lower is
+faster) and the peak memory usage. On CPU, the peak memory usage is the peak
+resident set size, which is only reset between configurations on Linux;
+``peak_memory_scope`` says whether it covers the configuration or the whole
+process.
+
+.. code-block:: bash
+
+    python -m bot.model.hubert.benchmark test -d 1 5 10 -b 1 4 -t 5 50
+"""
+
+import argparse
+import json
+import logging
+import os
+import re
+import resource
+import sys
+import time
+from contextlib import contextmanager
+from typing import Any, Iterator, get_args
+
+import numpy as np
+import torch
+from ml.utils.device.auto import detect_device
+from ml.utils.logging import configure_logging
+from torch import Tensor
+
+from bot.model.hubert.model import HubertModel, StageTimer
+from bot.model.hubert.pretrained import PretrainedHubertModel, pretrained_hubert
+
+logger = logging.getLogger(__name__)
+
+STAGES = (
+    "get_inputs",
+    "autoencoder_encode",
+    "hubert",
+    "speaker_encoder",
+    "diffusion_step",
+    "diffusion",
+    "vocoder_decode",
+    "total",
+)
+PERCENTILES = (50, 90, 99)
+
+
+class BenchmarkTimer(StageTimer):
+    """Stage timer which also records how long each diffusion step takes.
+
+    The model counts each diffusion step as it starts, so the device is
+    synchronized there as well, and each step runs from its own start to the
+    start of the next step, or to the end of the diffusion stage.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+
+        self.step_times: list[float] = []
+        self._step_start: float | None = None
+
+    def _end_step(self) -> None:
+        now = time.perf_counter()
+        if self._step_start is not None:
+            self.step_times.append(now - self._step_start)
+        self._step_start = now
+
+    @contextmanager
+    def time(self, stage: str) -> Iterator[None]:
+        with super().time(stage):
+            yield
+        if stage == "diffusion" and self._step_start is not None:
+            self._end_step()
+            self._step_start = None
+
+    def count(self, stage: str) -> None:
+        super().count(stage)
+        if stage == "diffusion_steps":
+            self.synchronize()
+            self._end_step()
+
+
+def run_once(model: HubertModel, audio: Tensor, ref_audio: Tensor, sampling_timesteps: int) -> dict[str, list[float]]:
+    """Runs the model once, timing each stage.
+
+    This goes through :meth:`HubertModel.run`, so it measures the same code
+    as the worker does.
+
+    Args:
+        model: The model to benchmark.
+        audio: The source audio, with shape ``(B, T)``.
+        ref_audio: The reference audio, with shape ``(B, T)``.
+        sampling_timesteps: The number of diffusion sampling timesteps.
+
+    Returns:
+        The elapsed times for each stage, in seconds. Every stage has one
+        entry, except for ``diffusion_step``, which has one per step.
+    """
+    timer = BenchmarkTimer()
+    timer.synchronize()
+    start_time = time.perf_counter()
+    model.run(audio, ref_audio, sampling_timesteps, timer)
+    timer.synchronize()
+    total_time = time.perf_counter() - start_time
+
+    timings: dict[str, list[float]] = {stage: [timer.timings[stage]] for stage in STAGES if stage in timer.timings}
+    timings["diffusion_step"] = timer.step_times
+    timings["total"] = [total_time]
+    return timings
+
+
+def reset_peak_memory(device: torch.device) -> str:
+    """Resets the peak memory usage before running a configuration.
+
+    Args:
+        device: The device the model is running on.
+
+    Returns:
+        What the peak memory usage measured afterwards covers; either
+        ``"config"`` if it only covers the configuration, or ``"process"``
+        if it is the peak of the whole process so far, since the peak
+        resident set size can only be reset on Linux.
+    """
+    if device.type == "cuda":
+        torch.cuda.reset_peak_memory_stats(device)
+        return "config"
+    try:
+        # Writing 5 resets the peak resident set size of the process.
+        with open("/proc/self/clear_refs", "w", encoding="utf-8") as f:
+            f.write("5")
+    except OSError:
+        return "process"
+    return "config"
+
+
+def get_peak_memory_mb(device: torch.device) -> float:
+    if device.type == "cuda":
+        return torch.cuda.max_memory_allocated(device) / 1024**2
+    if os.path.exists("/proc/self/status"):
+        with open("/proc/self/status", encoding="utf-8") as f:
+            if (match := re.search(r"^VmHWM:\s+(\d+) kB", f.read(), re.MULTILINE)) is not None:
+                return int(match.group(1)) / 1024
+    # Falls back to the peak resident set size of the whole process, which
+    # is reported in kilobytes on Linux and bytes on macOS.
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss / 1024**2 if sys.platform == "darwin" else max_rss / 1024
+
+
+def summarize(values: list[float]) -> dict[str, float]:
+    arr = np.array(values) * 1000
+    summary = {f"p{p}_ms": float(np.percentile(arr, p)) for p in PERCENTILES}
+    summary["mean_ms"] = float(arr.mean())
+    return summary
+
+
+def benchmark(
+    model: HubertModel,
+    device: torch.device,
+    duration: float,
+    batch_size: int,
+    sampling_timesteps: int,
+    num_iters: int,
+    num_warmup_iters: int,
+) -> dict[str, Any]:
+    audio = torch.randn(batch_size, round(duration * model.sample_rate), device=device) * 0.1
+    ref_audio = torch.randn(batch_size, round(duration * model.sample_rate), device=device) * 0.1
+
+    peak_memory_scope = reset_peak_memory(device)
+
+    all_timings: dict[str, list[float]] = {stage: [] for stage in STAGES}
+    for i in range(num_warmup_iters + num_iters):
+        timings = run_once(model, audio, ref_audio, sampling_timesteps)
+        if i >= num_warmup_iters:
+            for stage, values in timings.items():
+                all_timings[stage].extend(values)
+
+    audio_secs = duration * batch_size
+    return {
+        "duration": duration,
+        "batch_size": batch_size,
+        "sampling_timesteps": sampling_timesteps,
+        "num_iters": num_iters,
+        "stages": {stage: summarize(values) for stage, values in all_timings.items()},
+        "real_time_factor": float(np.mean(all_timings["total"]) / audio_secs),
+        "peak_memory_mb": get_peak_memory_mb(device),
+        "peak_memory_scope": peak_memory_scope,
+    }
+
+
+def main() -> None:
+    configure_logging()
+
+    parser = argparse.ArgumentParser(description="Benchmarks the stages of the HuBERT model.")
+    parser.add_argument("key", choices=get_args(PretrainedHubertModel), help="The pretrained model key")
+    parser.add_argument("-d", "--durations", type=float, nargs="+", default=[1.0, 5.0, 10.0], help="Durations")
+    parser.add_argument("-b", "--batch-sizes", type=int, nargs="+", default=[1], help="Batch sizes")
+    parser.add_argument("-t", "--sampling-timesteps", type=int, nargs="+", default=[10], help="Sampling timesteps")
+    parser.add_argument("-n", "--num-iters", type=int, default=5, help="Number of timed iterations")
+    parser.add_argument("-w", "--num-warmup-iters", type=int, default=1, help="Number of warmup iterations")
+    parser.add_argument("-o", "--output-file", type=str, help="Where to write the JSON results, or stdout")
+    args = parser.parse_args()
+
+    device = detect_device()
+    model = pretrained_hubert(args.key)
+    model.eval()
+    device.module_to(model)
+    torch_device = next(model.parameters()).device
+
+    results: list[dict[str, Any]] = []
+    for duration in args.durations:
+        for batch_size in args.batch_sizes:
+            for sampling_timesteps in args.sampling_timesteps:
+                logger.info("Benchmarking %.1fs x %d with %d timesteps", duration, batch_size, sampling_timesteps)
+                with device.autocast_context(), torch.inference_mode():
+                    result = benchmark(
+                        model=model,
+                        device=torch_device,
+                        duration=duration,
+                        batch_size=batch_size,
+                        sampling_timesteps=sampling_timesteps,
+                        num_iters=args.num_iters,
+                        num_warmup_iters=args.num_warmup_iters,
+                    )
+                results.append(result)
+
+    report = {"model": args.key, "device": str(torch_device), "results": results}
+    if args.output_file is None:
+        json.dump(report, sys.stdout, indent=2)
+    else:
+        with open(args.output_file, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    # python -m bot.model.hubert.benchmark
+    main()
@@ -1,6 +1,9 @@
 """Script for extracting the model weights from a trained checkpoint."""
 
 import logging
+import time
+from contextlib import contextmanager, nullcontext
+from typing import ContextManager, Iterator
 
 import torch
 import torch.nn.functional as F
@@ -18,6 +21,47 @@ logger = logging.getLogger(__name__)
 HUBERT_SAMPLE_RATE = 16000
 
 
+class StageTimer:
+    """Accumulates the elapsed time of each stage of inference.
+
+    The device is synchronized at the start and end of each stage, so that
+    asynchronous kernels are attributed to the right stage. Stages should be
+    coarse, to keep the cost of synchronization low.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+
+        self.timings: dict[str, float] = {}
+        self.counts: dict[str, int] = {}
+
+    def synchronize(self) -> None:
+        if torch.cuda.is_available() and torch.cuda.is_initialized():
+            torch.cuda.synchronize()
+        elif torch.backends.mps.is_available():
+            torch.mps.synchronize()
+
+    @contextmanager
+    def time(self, stage: str) -> Iterator[None]:
+        self.synchronize()
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.synchronize()
+            self.timings[stage] = self.timings.get(stage, 0.0) + time.perf_counter() - start_time
+
+    def count(self, stage: str) -> None:
+        self.counts[stage] = self.counts.get(stage, 0) + 1
+
+    def as_dict(self) -> dict[str, float | int]:
+        return {**self.timings, **self.counts}
+
+
+def timed(timer: StageTimer | None, stage: str) -> ContextManager[None]:
+    return nullcontext() if timer is None else timer.time(stage)
+
+
 class SpeakerEncoderModel(nn.Module):
     def __init__(
         self,
@@ -194,13 +238,14 @@ class HubertModel(nn.Module):
         )
 
     @torch.no_grad()
-    def get_audio_latents(self, audio: Tensor) -> tuple[Tensor, Tensor]:
+    def get_audio_latents(self, audio: Tensor, timer: StageTimer | None = None) -> tuple[Tensor, Tensor]:
         if audio.dim() == 3:
             audio = audio.squeeze(1)
         audio = audio.squeeze(1)
 
         # Latent space of the autoencoder, cropped by the contraction factor.
-        latents = self.autoencoder.encode(audio)
+        with timed(timer, "autoencoder_encode"):
+            latents = self.autoencoder.encode(audio)
         cf = self.contraction_factor
         l_tsz = latents.shape[1]
         diff = l_tsz % cf
@@ -210,12 +255,18 @@ class HubertModel(nn.Module):
 
         return audio, latents
 
-    def get_inputs(self, audio: Tensor, ref_audio: Tensor) -> tuple[Tensor, Tensor, Tensor]:
+    def get_inputs(
+        self,
+        audio: Tensor,
+        ref_audio: Tensor,
+        timer: StageTimer | None = None,
+    ) -> tuple[Tensor, Tensor, Tensor]:
         """Gets the latent vectors and HuBERT embeddings for the given audio.
 
         Args:
             audio: The input audio, with shape ``(B, T)``
             ref_audio: The reference audio, with shape ``(B, T)``
+            timer: If provided, records the time spent in each stage
 
         Returns:
             The latent vector and HuBERT embeddings, with shapes ``(B, T', Dl)``
@@ -223,12 +274,13 @@ class HubertModel(nn.Module):
             timesteps, ``Dl`` is the number of autoencoder dimensions, and
             ``Dh`` is the number of HuBERT dimensions.
         """
-        audio, latents = self.get_audio_latents(audio)
-        ref_audio, ref_latents = self.get_audio_latents(ref_audio)
+        audio, latents = self.get_audio_latents(audio, timer)
+        ref_audio, ref_latents = self.get_audio_latents(ref_audio, timer)
         l_tsz = latents.shape[1]
 
         # Gets the HuBERT embeddings, cropped to match the latent space.
-        hubert_embeddings = self.hubert(audio, sample_rate=HUBERT_SAMPLE_RATE)
+        with timed(timer, "hubert"):
+            hubert_embeddings = self.hubert(audio, sample_rate=HUBERT_SAMPLE_RATE)
         h_tsz = hubert_embeddings.shape[1]
 
         # Stretches the HuBERT embeddings to match the latent space stride.
@@ -264,22 +316,50 @@ class HubertModel(nn.Module):
         loss = self.diff.loss(lambda x, times: self.model(x, hubert_embeddings, times, cond_emb), latents)
         return loss
 
-    def infer(self, audio: Tensor, ref_audio: Tensor, sampling_timesteps: int | None = None) -> tuple[Tensor, Tensor]:
-        latents, ref_latents, hubert_embeddings = self.get_inputs(audio, ref_audio)
-        cond_emb = self.speaker_emb(ref_latents)
+    def infer(
+        self,
+        audio: Tensor,
+        ref_audio: Tensor,
+        sampling_timesteps: int | None = None,
+        timer: StageTimer | None = None,
+    ) -> tuple[Tensor, Tensor]:
+        with timed(timer, "get_inputs"):
+            latents, ref_latents, hubert_embeddings = self.get_inputs(audio, ref_audio, timer)
+        with timed(timer, "speaker_encoder"):
+            cond_emb = self.speaker_emb(ref_latents)
         shape, device = latents.shape, latents.device
-        sample = self.diff.sample(
-            lambda x, times: self.model(x, hubert_embeddings, times, cond_emb),
-            shape,
-            device,
-            sampling_timesteps,
-        )
+
+        def model_fn(x: Tensor, times: Tensor) -> Tensor:
+            if timer is not None:
+                timer.count("diffusion_steps")
+            return self.model(x, hubert_embeddings, times, cond_emb)
+
+        with timed(timer, "diffusion"):
+            sample = self.diff.sample(model_fn, shape, device, sampling_timesteps)
         return sample, latents
 
     @torch.no_grad()
-    def run(self, audio: Tensor, ref_audio: Tensor, sampling_timesteps: int | None = None) -> Tensor:
+    def run(
+        self,
+        audio: Tensor,
+        ref_audio: Tensor,
+        sampling_timesteps: int | None = None,
+        timer: StageTimer | None = None,
+    ) -> Tensor:
+        """Runs the model on the given audio.
+
+        Args:
+            audio: The source audio, with shape ``(B, T)``
+            ref_audio: The reference audio, with shape ``(B, T)``
+            sampling_timesteps: The number of diffusion sampling timesteps
+            timer: If provided, records the time spent in each stage
+
+        Returns:
+            The converted audio, with shape ``(B, T)``
+        """
         assert audio.dim() == 2, f"Expected 2D audio, got {audio.shape}"
         assert ref_audio.dim() == 2, f"Expected 2D reference audio, got {ref_audio.shape}"
         assert audio.shape[0] == ref_audio.shape[0], f"Batch size mismatch for {audio.shape=} != {ref_audio.shape=}"
-        sample, _ = self.infer(audio, ref_audio, sampling_timesteps)
-        return self.get_audio(sample[1]).squeeze(1)
+        sample, _ = self.infer(audio, ref_audio, sampling_timesteps, timer)
+        with timed(timer, "vocoder_decode"):
+            return self.get_audio(sample[1]).squeeze(1)
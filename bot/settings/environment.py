@@ -11,6 +11,10 @@ class UserSettings:
     # The field below is used to restrict the development server to only
     # authorized users, to prevent random people from creating accounts.
     authorized_users: list[str] | None = field(default=None)
+    # Each process caches the status of the users and refresh tokens which
+    # requests authenticate as, for this many seconds.
+    cache_size: int = field(default=10000)
+    cache_ttl: float = field(default=30.0)
 
 
 @dataclass
@@ -49,6 +53,13 @@ class WorkerSettings:
     sampling_timesteps: int | None = field(default=None)
     soft_time_limit: int = field(default=30)
     max_retries: int = field(default=3)
+    # Decoded audio is cached in memory, and raw audio files are cached on
+    # disk if a cache directory is set.
+    cache_memory_mb: int = field(default=1024)
+    cache_disk_mb: int = field(default=10240)
+    cache_dir: str | None = field(default=None)
+    # How often to purge deleted audio from the cache, in seconds.
+    cache_purge_interval: float = field(default=600.0)
 
 
 @dataclass
@@ -62,6 +73,9 @@ class AudioFileSettings:
     max_mb: int = field(default=10)
     min_duration: float = field(default=5.0)
     max_duration: float = field(default=30.0)
+    # Writes the raw samples next to each stored file, so that workers can
+    # memory-map them instead of decoding the stored file.
+    write_sidecar: bool = field(default=True)
 
 
 @dataclass
@@ -74,6 +88,13 @@ class S3FileSettings:
     bucket: str = field(default=MISSING)
     subfolder: str = field(default=MISSING)
     url_expiration: int = field(default=3600)
+    max_pool_connections: int = field(default=32)
+    max_concurrency: int = field(default=32)
+    max_attempts: int = field(default=5)
+    # Presigned URLs are cached until this many seconds before they expire,
+    # so that clients always have some time left to fetch the file.
+    url_cache_size: int = field(default=10000)
+    url_cache_margin: int = field(default=300)
 
 
 @dataclass
@@ -84,6 +105,24 @@ class FileSettings:
     s3: S3FileSettings = field(default_factory=S3FileSettings)
 
 
+@dataclass
+class ExecutorSettings:
+    # The maximum number of blocking audio jobs (decoding, resampling and
+    # encoding) which can run at once; further jobs wait in a queue.
+    max_workers: int = field(default=4)
+
+
+@dataclass
+class UploadSettings:
+    # Uploads which are processed in the background are converted by this
+    # many workers at once; once the queue is full, new uploads are refused.
+    num_workers: int = field(default=2)
+    max_queue_size: int = field(default=100)
+    # A process which claims a pending upload has this many seconds to
+    # convert it before other processes can take it over.
+    claim_timeout: float = field(default=600.0)
+
+
 @dataclass
 class EmailSettings:
     host: str = field(default=MISSING)
@@ -118,6 +157,8 @@ class EnvironmentSettings:
     database: DatabaseSettings = field(default_factory=DatabaseSettings)
     worker: WorkerSettings = field(default_factory=WorkerSettings)
     file: FileSettings = field(default_factory=FileSettings)
+    executor: ExecutorSettings = field(default_factory=ExecutorSettings)
+    upload: UploadSettings = field(default_factory=UploadSettings)
     email: EmailSettings = field(default_factory=EmailSettings)
     crypto: CryptoSettings = field(default_factory=CryptoSettings)
     model: ModelSettings = field(default_factory=ModelSettings)
@@ -0,0 +1,168 @@
+"""Defines a worker-local cache for the audio which the model runs on.
+
+The same reference clips tend to be used for many requests, so rather than
+fetching and decoding them every time, the worker keeps two tiers of cache:
+
+- An in-memory LRU cache of decoded float32 arrays, bounded by size.
+- An on-disk LRU cache of the sidecar or stored files, bounded by size.
+    This tier is only used when the storage backend doesn't keep files on
+    local disk already, since otherwise it would just be a copy.
+
+Audio rows are never modified after they are created, so entries are keyed
+on :attr:`Audio.key` and only need to be invalidated when the audio is
+deleted. Audio can be deleted through any API process, so rather than being
+notified, the worker periodically checks the cached keys against the audio
+table and purges the ones which no longer have a row, so that deleted audio
+doesn't stay on the worker's disk.
+"""
+
+import logging
+from io import BytesIO
+from pathlib import Path
+from typing import BinaryIO, Callable
+from uuid import UUID
+
+import numpy as np
+
+from bot.api.audio import decode_audio, get_object_name, get_sidecar_name, load_sidecar, pcm_to_float
+from bot.api.cache import LRUCache
+from bot.api.executor import run_in_executor
+from bot.api.model import Audio
+from bot.api.storage import get_storage, write_file
+from bot.settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+def _load_array(load_fn: Callable[[str | BinaryIO], np.ndarray], file: str | BinaryIO) -> np.ndarray:
+    return pcm_to_float(load_fn(file))
+
+
+class AudioCache:
+    """Caches decoded audio in memory, and raw audio files on disk.
+
+    Args:
+        memory_mb: The maximum size of the in-memory cache, in megabytes.
+        disk_mb: The maximum size of the on-disk cache, in megabytes.
+        disk_dir: The directory for the on-disk cache, or None to disable
+            the on-disk cache.
+    """
+
+    def __init__(self, memory_mb: int, disk_mb: int, disk_dir: str | None) -> None:
+        super().__init__()
+
+        self.memory: LRUCache[UUID, np.ndarray] = LRUCache(memory_mb * 1024 * 1024, size_fn=lambda arr: arr.nbytes)
+        self.disk: LRUCache[str, int] = LRUCache(disk_mb * 1024 * 1024, size_fn=lambda size: size, on_evict=self._evict)
+        self.disk_path = None if disk_dir is None else Path(disk_dir).expanduser().resolve()
+        if self.disk_path is not None:
+            self.disk_path.mkdir(parents=True, exist_ok=True)
+            self._index_disk()
+
+    @classmethod
+    def from_settings(cls) -> "AudioCache":
+        return cls(
+            memory_mb=settings.worker.cache_memory_mb,
+            disk_mb=settings.worker.cache_disk_mb,
+            disk_dir=settings.worker.cache_dir,
+        )
+
+    def _index_disk(self) -> None:
+        # Picks up the files left by a previous run, oldest first, so that the
+        # least recently used files are evicted first.
+        assert self.disk_path is not None
+        paths = sorted((p for p in self.disk_path.iterdir() if p.is_file()), key=lambda p: p.stat().st_mtime)
+        for path in paths:
+            if path.suffix == ".tmp":
+                path.unlink()
+            else:
+                self.disk.put(path.name, path.stat().st_size)
+
+    def _evict(self, name: str, size: int) -> None:
+        assert self.disk_path is not None
+        (self.disk_path / name).unlink(missing_ok=True)
+
+    async def _get_file(self, name: str) -> str | bytes:
+        # Returns the path to a local copy of the file if there is one, and
+        # otherwise the raw file contents.
+        storage = get_storage()
+        if (fs_path := storage.get_path(name)) is not None:
+            return fs_path
+        if self.disk_path is None:
+            return await storage.get(name)
+        fs_path = str(self.disk_path / name)
+        if self.disk.get(name) is not None:
+            return fs_path
+        data = await storage.get(name)
+        await run_in_executor(write_file, fs_path, data)
+        self.disk.put(name, len(data))
+        return data
+
+    async def _load(self, name: str, load_fn: Callable[[str | BinaryIO], np.ndarray]) -> np.ndarray:
+        file = await self._get_file(name)
+        return await run_in_executor(_load_array, load_fn, file if isinstance(file, str) else BytesIO(file))
+
+    async def load(self, key: UUID) -> np.ndarray:
+        """Loads the audio for the given key, as a float32 array.
+
+        The raw sidecar is preferred, since it can be memory-mapped instead
+        of decoded, falling back to the stored file for older audio.
+
+        Args:
+            key: The key of the audio.
+
+        Returns:
+            The audio samples, scaled to the range ``[-1, 1]``. The array is
+            shared with other requests, so it shouldn't be modified in-place.
+        """
+        if (arr := self.memory.get(key)) is not None:
+            return arr
+        try:
+            arr = await self._load(get_sidecar_name(key), load_sidecar)
+        except FileNotFoundError:
+            arr = await self._load(get_object_name(key), decode_audio)
+        self.memory.put(key, arr)
+        return arr
+
+    def invalidate(self, key: UUID) -> None:
+        """Drops any cached copies of the audio for the given key.
+
+        Args:
+            key: The key of the audio.
+        """
+        self.memory.pop(key)
+        if self.disk_path is not None:
+            for name in (get_sidecar_name(key), get_object_name(key)):
+                if self.disk.pop(name) is not None:
+                    self._evict(name, 0)
+
+    def _cached_keys(self) -> set[UUID]:
+        keys = set(self.memory.keys())
+        for name in self.disk.keys():
+            try:
+                keys.add(UUID(name.split(".", 1)[0]))
+            except ValueError:
+                logger.warning("Unexpected file in the audio cache: %s", name)
+        return keys
+
+    async def purge_deleted(self, batch_size: int = 500) -> int:
+        """Drops the cached copies of any audio which has been deleted.
+
+        Args:
+            batch_size: The number of keys to look up at once.
+
+        Returns:
+            The number of keys which were purged.
+        """
+        keys = list(self._cached_keys())
+        num_purged = 0
+        for i in range(0, len(keys), batch_size):
+            batch = keys[i : i + batch_size]
+            live_keys = set(await Audio.filter(key__in=batch).values_list("key", flat=True))
+            for key in batch:
+                if key not in live_keys:
+                    self.invalidate(key)
+                    num_purged += 1
+        return num_purged
+
+    def get_stats(self) -> dict[str, dict[str, float | int]]:
+        return {"memory": self.memory.get_stats(), "disk": self.disk.get_stats()}
@@ -1,51 +1,180 @@
-"""Defines a CLI for calling the model runner."""
+"""Defines a load-testing CLI for the model runner.
+
+There are two load modes:
+
+- ``closed``: A fixed number of clients each send a request, wait for the
+    response, and immediately send another one.
+- ``open``: Requests arrive as a Poisson process at a target rate,
+    regardless of how fast the server responds.
+
+Each request picks a random source and reference ID from the configured
+pools. Requests which start during the warm-up period are excluded from the
+results. The queue size is sampled throughout the run, and the results are
+written to a JSON file so that runs can be compared across configurations.
+
+.. code-block:: bash
+
+    python -m bot.worker.cli -S 1 2 3 -R 4 5 -m closed -c 4 -d 60 -w 10 -o results.json
+"""
 
 import argparse
 import asyncio
+import json
 import logging
+import random
+import time
+from dataclasses import asdict, dataclass
+from typing import Any
 
-from aiohttp.client import ClientSession
+import numpy as np
+from aiohttp import ClientSession, ClientTimeout, TCPConnector
 from ml.utils.logging import configure_logging
 from yarl import URL
 
 logger = logging.getLogger(__name__)
 
+PERCENTILES = (50, 90, 99)
+
+
+@dataclass(frozen=True)
+class RequestResult:
+    start_time: float
+    latency: float
+    status: int | None
+
+
+@dataclass(frozen=True)
+class QueueSample:
+    time: float
+    size: int
+
+
+class LoadTester:
+    def __init__(
+        self,
+        endpoint: URL,
+        source_ids: list[int],
+        reference_ids: list[int],
+        duration: float,
+        timeout: float,
+    ) -> None:
+        super().__init__()
+
+        self.endpoint = endpoint
+        self.source_ids = source_ids
+        self.reference_ids = reference_ids
+        self.duration = duration
+        self.timeout = timeout
 
-async def call_server_once(endpoint: URL) -> None:
-    add_endpoint = endpoint.with_path("/")
-    async with ClientSession() as session:
-        async with session.get(add_endpoint) as response:
-            if response.status != 200:
-                logger.error("Request failed with status %s", response.status)
-                return
-            text = await response.text()
-            logger.info("Response: %s", text)
+        self.results: list[RequestResult] = []
+        self.queue_samples: list[QueueSample] = []
+        self._start_time = 0.0
 
+    def elapsed(self) -> float:
+        return time.monotonic() - self._start_time
 
-async def log_queue_size(endpoint: URL) -> None:
-    queue_size_endpoint = endpoint.with_path("/queue")
-    async with ClientSession() as session:
+    async def call_server_once(self, session: ClientSession) -> None:
+        query = {"source_id": random.choice(self.source_ids), "reference_id": random.choice(self.reference_ids)}
+        start_time = self.elapsed()
+        status: int | None = None
+        try:
+            async with session.get(self.endpoint.with_path("/").with_query(query)) as response:
+                await response.read()
+                status = response.status
+                if status != 200:
+                    logger.error("Request failed with status %s", status)
+        except Exception:
+            logger.exception("Request failed")
+        self.results.append(RequestResult(start_time, self.elapsed() - start_time, status))
+
+    async def log_queue_size(self, session: ClientSession, interval: float) -> None:
+        queue_size_endpoint = self.endpoint.with_path("/queue")
         while True:
             try:
                 async with session.get(queue_size_endpoint) as response:
-                    if response.status != 200:
-                        logger.error("Request failed with status %s", response.status)
-                        return
-                    text = await response.text()
-                    logger.info("Response: %s", text)
+                    if response.status == 200:
+                        size = int(await response.text())
+                        self.queue_samples.append(QueueSample(self.elapsed(), size))
+                        logger.info("Queue size: %d", size)
+                    else:
+                        logger.error("Queue request failed with status %s", response.status)
+            except Exception:
+                logger.exception("Queue request failed")
+            await asyncio.sleep(interval)
+
+    async def run_closed_loop(self, session: ClientSession, concurrency: int) -> None:
+        async def client() -> None:
+            while self.elapsed() < self.duration:
+                await self.call_server_once(session)
+
+        await asyncio.gather(*(client() for _ in range(concurrency)))
+
+    async def run_open_loop(self, session: ClientSession, rate: float) -> None:
+        tasks: list[asyncio.Task] = []
+        next_time = random.expovariate(rate)
+        while next_time < self.duration:
+            await asyncio.sleep(max(next_time - self.elapsed(), 0.0))
+            tasks.append(asyncio.create_task(self.call_server_once(session)))
+            next_time += random.expovariate(rate)
+        await asyncio.gather(*tasks)
+
+    async def run(self, mode: str, concurrency: int, rate: float, queue_interval: float) -> None:
+        connector = TCPConnector(limit=0)
+        async with ClientSession(connector=connector, timeout=ClientTimeout(total=self.timeout)) as session:
+            self._start_time = time.monotonic()
+            queue_task = asyncio.create_task(self.log_queue_size(session, queue_interval))
+            try:
+                match mode:
+                    case "closed":
+                        await self.run_closed_loop(session, concurrency)
+                    case "open":
+                        await self.run_open_loop(session, rate)
+                    case _:
+                        raise ValueError(f"Invalid mode: {mode}")
             finally:
-                await asyncio.sleep(1)
+                queue_task.cancel()
 
+    def summarize(self, warmup: float) -> dict[str, Any]:
+        """Summarizes the results, excluding requests started during warm-up.
 
-async def call_server(num_times: int, endpoint: URL) -> None:
-    task = asyncio.create_task(log_queue_size(endpoint))
-    await asyncio.gather(*(call_server_once(endpoint) for _ in range(num_times)))
-    task.cancel()
+        Args:
+            warmup: The warm-up period, in seconds.
+
+        Returns:
+            The summary statistics for the run.
+        """
+        results = [r for r in self.results if r.start_time >= warmup]
+        ok = [r for r in results if r.status == 200]
+        window = max(max((r.start_time + r.latency for r in results), default=warmup) - warmup, 1e-9)
+        summary: dict[str, Any] = {
+            "num_requests": len(results),
+            "num_errors": len(results) - len(ok),
+            "error_rate": (len(results) - len(ok)) / len(results) if results else 0.0,
+            "throughput": len(ok) / window,
+        }
+        if ok:
+            latencies = np.array([r.latency for r in ok])
+            summary.update({f"p{p}_latency": float(np.percentile(latencies, p)) for p in PERCENTILES})
+            summary["mean_latency"] = float(latencies.mean())
+        return summary
+
+
+def parse_ids(ids: list[str]) -> list[int]:
+    return [int(i) for s in ids for i in s.split(",") if i]
 
 
 def main() -> None:
-    parser = argparse.ArgumentParser(description="Run the HTTP server.")
-    parser.add_argument("num_times", type=int, help="Number of times to call the server")
+    parser = argparse.ArgumentParser(description="Load test the model runner.")
+    parser.add_argument("-S", "--source-ids", nargs="+", required=True, help="Pool of source audio IDs")
+    parser.add_argument("-R", "--reference-ids", nargs="+", required=True, help="Pool of reference audio IDs")
+    parser.add_argument("-m", "--mode", choices=["closed", "open"], default="closed", help="The load mode")
+    parser.add_argument("-c", "--concurrency", type=int, default=1, help="Number of clients, in closed mode")
+    parser.add_argument("-r", "--rate", type=float, default=1.0, help="Requests per second, in open mode")
+    parser.add_argument("-d", "--duration", type=float, default=60.0, help="Seconds to send requests for")
+    parser.add_argument("-w", "--warmup", type=float, default=0.0, help="Seconds to exclude from the results")
+    parser.add_argument("-q", "--queue-interval", type=float, default=1.0, help="Seconds between queue samples")
+    parser.add_argument("--timeout", type=float, default=300.0, help="Request timeout, in seconds")
+    parser.add_argument("-o", "--output-file", type=str, help="Where to write the JSON results")
     parser.add_argument("-t", "--host", type=str, default="localhost", help="The host to run the server on")
     parser.add_argument("-p", "--port", type=int, default=8080, help="The port to run the server on")
     parser.add_argument("-s", "--scheme", type=str, default="http", help="The scheme to use")
@@ -54,8 +183,27 @@ def main() -> None:
     configure_logging()
 
     endpoint = URL.build(scheme=args.scheme, host=args.host, port=args.port)
-    num_times = args.num_times
-    asyncio.run(call_server(num_times, endpoint))
+    tester = LoadTester(
+        endpoint=endpoint,
+        source_ids=parse_ids(args.source_ids),
+        reference_ids=parse_ids(args.reference_ids),
+        duration=args.duration,
+        timeout=args.timeout,
+    )
+    asyncio.run(tester.run(args.mode, args.concurrency, args.rate, args.queue_interval))
+
+    summary = tester.summarize(args.warmup)
+    logger.info("Summary: %s", json.dumps(summary))
+
+    if args.output_file is not None:
+        report = {
+            "config": vars(args),
+            "summary": summary,
+            "queue": [asdict(s) for s in tester.queue_samples],
+            "requests": [asdict(r) for r in tester.results],
+        }
+        with open(args.output_file, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
 
 
 if __name__ == "__main__":
@@ -3,26 +3,31 @@
 import asyncio
 import logging
 import time
+from contextlib import contextmanager
+from typing import Iterator
 
 import torch
 from ml.utils.device.auto import detect_device
 from torch import Tensor
 from tortoise.transactions import in_transaction
 
-from bot.api.audio import load_audio_array, save_audio_array
+from bot.api.audio import float_to_pcm, load_audio_array, pcm_to_float, save_audio_array
+from bot.api.db import DEFAULT_CONNECTION
 from bot.api.model import Audio, AudioSource, Generation, Task
-from bot.model.hubert.pretrained import cast_pretrained_model, pretrained_hubert
+from bot.model.hubert.model import StageTimer
+from bot.model.hubert.pretrained import PretrainedHubertModel, cast_pretrained_model, pretrained_hubert
 from bot.settings import settings
+from bot.worker.cache import AudioCache
 
 logger = logging.getLogger(__name__)
 
 
 class ModelRunner:
-    def __init__(self, num_timesteps: int | None = None) -> None:
+    def __init__(self, model_key: PretrainedHubertModel | None = None, num_timesteps: int | None = None) -> None:
         super().__init__()
 
         self.num_timesteps = settings.worker.sampling_timesteps if num_timesteps is None else num_timesteps
-        self.model_key = cast_pretrained_model(settings.model.key)
+        self.model_key = cast_pretrained_model(settings.model.key) if model_key is None else model_key
 
         device = detect_device()
         model = pretrained_hubert(self.model_key)
@@ -32,23 +37,75 @@ class ModelRunner:
         self.device = device
         self.model = model
 
-    async def load_samples(self, src: Audio, ref: Audio) -> tuple[Tensor, Tensor]:
+        # Tracks the number of batches currently running through the model,
+        # so that the model can be freed once it is swapped out.
+        self._num_in_flight = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    @contextmanager
+    def in_flight(self) -> Iterator[None]:
+        """Marks a batch as running through this model.
+
+        Yields:
+            Nothing; the batch is considered finished when the context exits.
+        """
+        self._num_in_flight += 1
+        self._idle.clear()
+        try:
+            yield
+        finally:
+            self._num_in_flight -= 1
+            if self._num_in_flight == 0:
+                self._idle.set()
+
+    async def wait_until_idle(self) -> None:
+        await self._idle.wait()
+
+    def warm_up(self, duration: float = 1.0) -> None:
+        """Runs a dummy sample through the model.
+
+        This is blocking, so it should be called from a background thread if
+        the event loop is running.
+
+        Args:
+            duration: The duration of the dummy sample, in seconds.
+        """
+        audio = torch.zeros(1, round(self.model.sample_rate * duration))
+        audio = self.device.tensor_to(audio)
+        with self.device.autocast_context(), torch.inference_mode():
+            self.model.run(audio, audio, self.num_timesteps)
+
+    def free(self) -> None:
+        """Releases the model weights, after the runner has been swapped out."""
+        del self.model
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    async def load_samples(self, src: Audio, ref: Audio, cache: AudioCache | None = None) -> tuple[Tensor, Tensor]:
+        if cache is not None:
+            src_audio_arr, ref_audio_arr = await asyncio.gather(cache.load(src.key), cache.load(ref.key))
+            return torch.from_numpy(src_audio_arr), torch.from_numpy(ref_audio_arr)
         src_audio_arr, ref_audio_arr = await asyncio.gather(
             load_audio_array(src.key),
             load_audio_array(ref.key),
         )
-        src_audio_arr = src_audio_arr.astype("float32") / 32768
-        ref_audio_arr = ref_audio_arr.astype("float32") / 32768
-        return torch.from_numpy(src_audio_arr), torch.from_numpy(ref_audio_arr)
+        return torch.from_numpy(pcm_to_float(src_audio_arr)), torch.from_numpy(pcm_to_float(ref_audio_arr))
 
-    async def run_model(self, src_audio: Tensor, ref_audio: Tensor) -> tuple[Tensor, float]:
+    def _run_model(self, src_audio: Tensor, ref_audio: Tensor) -> tuple[Tensor, float, dict[str, float | int]]:
         start_time = time.time()
+        timer = StageTimer()
         src_audio = self.device.tensor_to(src_audio).unsqueeze(0)
         ref_audio = self.device.tensor_to(ref_audio).unsqueeze(0)
         with self.device.autocast_context(), torch.inference_mode():
-            output_audio = self.model.run(src_audio, ref_audio, self.num_timesteps)
+            output_audio = self.model.run(src_audio, ref_audio, self.num_timesteps, timer)
         output_audio.squeeze(0).float().cpu()
-        return output_audio, time.time() - start_time
+        return output_audio, time.time() - start_time, timer.as_dict()
+
+    async def run_model(self, src_audio: Tensor, ref_audio: Tensor) -> tuple[Tensor, float, dict[str, float | int]]:
+        # Runs the model in a separate thread, so that the event loop can keep
+        # accepting requests and loading samples for the next batch.
+        return await asyncio.to_thread(self._run_model, src_audio, ref_audio)
 
     async def process_output(
         self,
@@ -56,10 +113,11 @@ class ModelRunner:
         ref: Audio,
         output_audio: Tensor,
         elapsed_time: float,
+        timings: dict[str, float | int] | None = None,
     ) -> tuple[Audio, Generation]:
         output_audio_arr = output_audio.squeeze(0).float().cpu().numpy()
-        output_audio_arr = (output_audio_arr * 32768).clip(-32768, 32767).astype("int16")
-        async with in_transaction():
+        output_audio_arr = float_to_pcm(output_audio_arr)
+        async with in_transaction(DEFAULT_CONNECTION):
             output = await save_audio_array(
                 user_id=src.user_id,
                 source=AudioSource.generated,
@@ -76,10 +134,9 @@ class ModelRunner:
             )
             await Task.create(
                 user_id=output.user_id,
-                source=src,
-                reference=ref,
-                output=output,
+                generation=generation,
                 model=self.model_key,
                 elapsed_time=elapsed_time,
+                timings=timings,
             )
         return output, generation
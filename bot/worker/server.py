@@ -12,8 +12,10 @@ from ml.utils.logging import configure_logging
 from torch import Tensor
 
 from bot.api.db import close_db, init_db
-from bot.api.model import Audio
+from bot.api.model import Audio, AudioStatus
+from bot.model.hubert.pretrained import PretrainedHubertModel, cast_pretrained_model
 from bot.settings import settings
+from bot.worker.cache import AudioCache
 from bot.worker.model import ModelRunner
 
 logger = logging.getLogger(__name__)
@@ -22,6 +24,7 @@ SOURCE_ID_KEY = "source_id"
 REFERENCE_ID_KEY = "reference_id"
 OUTPUT_ID_KEY = "output_id"
 GENERATION_ID_KEY = "generation_id"
+MODEL_KEY_KEY = "key"
 
 
 @dataclass(frozen=True)
@@ -49,6 +52,8 @@ class ProcessedRequestData:
     ref: Audio
     output_array: Tensor
     elapsed_time: float
+    timings: dict[str, float | int]
+    model_runner: ModelRunner
 
 
 class Server:
@@ -62,7 +67,10 @@ class Server:
         self.processed_request_queue: "asyncio.Queue[ProcessedRequestData]" = asyncio.Queue()
 
         self.model_runner = ModelRunner()
+        self.audio_cache = AudioCache.from_settings()
 
+        self._pending_model_key: PretrainedHubertModel | None = None
+        self._swap_task: asyncio.Task | None = None
         self._tasks: list[asyncio.Task] = []
         self._app: web.Application | None = None
 
@@ -74,11 +82,67 @@ class Server:
     async def get_queue_size(self, request: Request) -> Response:
         return web.Response(text=str(self.request_queue.qsize()))
 
+    async def get_model(self, request: Request) -> Response:
+        return json_response({MODEL_KEY_KEY: self.model_runner.model_key, "pending": self._pending_model_key})
+
+    async def swap_model(self, key: PretrainedHubertModel) -> None:
+        """Swaps the model used for new batches, without dropping requests.
+
+        The new model is loaded and warmed up in a background thread while the
+        current model keeps serving batches. Once it is ready, new batches are
+        sent to the new model, and the old model is freed after its in-flight
+        batches finish.
+
+        Args:
+            key: The pretrained model key to swap to.
+        """
+        logger.info("Loading model %s", key)
+        self._pending_model_key = key
+        try:
+            new_runner = await asyncio.to_thread(ModelRunner, model_key=key)
+            await asyncio.to_thread(new_runner.warm_up)
+            old_runner, self.model_runner = self.model_runner, new_runner
+        except Exception:
+            logger.exception("Error loading model %s", key)
+            return
+        finally:
+            self._pending_model_key = None
+        logger.info("Swapped model %s to %s; draining old model", old_runner.model_key, key)
+        await old_runner.wait_until_idle()
+        old_runner.free()
+        logger.info("Freed model %s", old_runner.model_key)
+
+    async def handle_swap_model(self, request: Request) -> Response:
+        if self._swap_task is not None and not self._swap_task.done():
+            return web.Response(text=f"Already swapping to {self._pending_model_key}", status=409)
+        try:
+            key = cast_pretrained_model(request.query.get(MODEL_KEY_KEY, ""))
+        except AssertionError:
+            return web.Response(text=f"Malformed {MODEL_KEY_KEY}", status=400)
+        self._swap_task = asyncio.create_task(self.swap_model(key))
+        return json_response({MODEL_KEY_KEY: key}, status=202)
+
+    async def get_cache_stats(self, request: Request) -> Response:
+        return json_response(self.audio_cache.get_stats())
+
     async def handle_request(self, request: Request) -> Response:
         data = RequestData(request, asyncio.Future())
         await self.request_queue.put(data)
         return await data.wait()
 
+    async def cache_purger(self) -> None:
+        logger.info("Starting cache purger...")
+
+        while True:
+            try:
+                await asyncio.sleep(settings.worker.cache_purge_interval)
+                if (num_purged := await self.audio_cache.purge_deleted()) > 0:
+                    logger.info("Purged %d deleted audio clips from the cache", num_purged)
+            except asyncio.CancelledError:
+                break
+            except Exception:
+                logger.exception("Error purging the audio cache")
+
     async def request_loader(self) -> None:
         logger.info("Starting request loader...")
 
@@ -108,9 +172,12 @@ class Server:
                 audios: list[Audio] = await Audio.filter(id__in=[src_id, ref_id]).all()
                 assert len(audios) == 2
                 src, ref = (audios[0], audios[1]) if audios[0].id == src_id else (audios[1], audios[0])
+                if src.status != AudioStatus.ready or ref.status != AudioStatus.ready:
+                    data.response_future.set_result(web.Response(text="Audio is not ready", status=400))
+                    continue
 
                 # Loads the audio samples into memory.
-                src_array, ref_array = await self.model_runner.load_samples(src=src, ref=ref)
+                src_array, ref_array = await self.model_runner.load_samples(src=src, ref=ref, cache=self.audio_cache)
                 output_data = LoadedRequestData(
                     data=data,
                     src=src,
@@ -137,16 +204,22 @@ class Server:
                 break
 
             try:
-                output_array, elapsed_time = await self.model_runner.run_model(
-                    src_audio=data.src_array,
-                    ref_audio=data.ref_array,
-                )
+                # Grabs the runner once per batch, so that a model swap only
+                # affects batches which start after the swap.
+                model_runner = self.model_runner
+                with model_runner.in_flight():
+                    output_array, elapsed_time, timings = await model_runner.run_model(
+                        src_audio=data.src_array,
+                        ref_audio=data.ref_array,
+                    )
                 output_data = ProcessedRequestData(
                     data=data.data,
                     src=data.src,
                     ref=data.ref,
                     output_array=output_array,
                     elapsed_time=elapsed_time,
+                    timings=timings,
+                    model_runner=model_runner,
                 )
                 await self.processed_request_queue.put(output_data)
 
@@ -167,11 +240,12 @@ class Server:
                 break
 
             try:
-                output, generation = await self.model_runner.process_output(
+                output, generation = await data.model_runner.process_output(
                     src=data.src,
                     ref=data.ref,
                     output_audio=data.output_array,
                     elapsed_time=data.elapsed_time,
+                    timings=data.timings,
                 )
                 response = json_response({OUTPUT_ID_KEY: output.id, GENERATION_ID_KEY: generation.id})
                 data.data.response_future.set_result(response)
@@ -186,12 +260,19 @@ class Server:
     async def __aenter__(self) -> "Server":
         """Starts the server.
 
-        The server will run until the process is killed. It has two endpoints:
+        The server will run until the process is killed. It has the following endpoints:
 
         - ``GET /``: Takes a source ID and a reference ID and processes them.
             It returns a 200 response with the output audio ID.
         - ``GET /queue``: Returns the number of requests currently in the queue,
             which can be used for load balancing.
+        - ``GET /model``: Returns the current model key, and the key of the
+            model being loaded, if any.
+        - ``POST /model``: Takes a model key and swaps to that model in the
+            background. It returns a 202 response immediately.
+        - ``GET /cache``: Returns the audio cache statistics.
+
+        Cached audio is periodically purged once it has been deleted.
         """
 
         async def start_web_server() -> None:
@@ -199,12 +280,16 @@ class Server:
             self._app = web.Application()
             self._app.router.add_get("/", self.handle_request)
             self._app.router.add_get("/queue", self.get_queue_size)
+            self._app.router.add_get("/model", self.get_model)
+            self._app.router.add_post("/model", self.handle_swap_model)
+            self._app.router.add_get("/cache", self.get_cache_stats)
 
         async def start_tasks() -> None:
             assert len(self._tasks) == 0, "Tasks already started"
             self._tasks.append(asyncio.create_task(self.request_loader()))
             self._tasks.append(asyncio.create_task(self.request_processor()))
             self._tasks.append(asyncio.create_task(self.request_saver()))
+            self._tasks.append(asyncio.create_task(self.cache_purger()))
 
         async def start_db() -> None:
             await init_db(generate_schemas=settings.database.generate_schemas)
@@ -229,6 +314,9 @@ class Server:
             for task in self._tasks:
                 task.cancel()
             await asyncio.gather(*self._tasks)
+            if self._swap_task is not None:
+                self._swap_task.cancel()
+                await asyncio.gather(self._swap_task, return_exceptions=True)
 
         await asyncio.gather(stop_web_server(), stop_tasks(), close_db())
 
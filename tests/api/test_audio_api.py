@@ -1,16 +1,21 @@
 """Tests the audio API functions."""
 
+import datetime
+import io
 import os
+import time
 
 import numpy as np
 import soundfile as sf
 from _pytest.legacypath import TempdirFactory
 from fastapi.testclient import TestClient
+from pytest_mock.plugin import MockerFixture
 
 
 async def test_audio_functions(
     authenticated_user: tuple[TestClient, str, str],
     tmpdir_factory: TempdirFactory,
+    mocker: MockerFixture,
 ) -> None:
     app_client, _, token = authenticated_user
 
@@ -38,6 +43,21 @@ async def test_audio_functions(
             data = response.json()
             id_list.append(data["id"])
 
+    # Tests that uploads which are too long are rejected.
+    long_audio_file_path = os.path.join(file_root_dir, "long.wav")
+    sf.write(long_audio_file_path, np.zeros(24000 * 60), 24000)
+    with open(long_audio_file_path, "rb") as f:
+        response = app_client.post("/audio/upload", files={"file": ("long.wav", f.read())}, data={"source": "uploaded"})
+    assert response.status_code == 400, response.json()
+
+    # Checks that the uploads were decoded and encoded in the executor.
+    response = app_client.get("/admin/metrics")
+    assert response.status_code == 200, response.json()
+    data = response.json()
+    assert data["executor"]["num_completed"] >= 20
+    assert data["executor"]["num_waiting"] == 0
+    assert "storage" in data
+
     # Tests querying the audio files for the user.
     for source, id_list in (("uploaded", upload_ids), ("recorded", record_ids)):
         response = app_client.get("/audio/query/me", params={"start": 0, "limit": 5, "source": source})
@@ -45,9 +65,68 @@ async def test_audio_functions(
         data = response.json()
         assert data["ids"] == id_list[::-1]
 
+    # Tests paging through the audio files with a cursor.
+    response = app_client.get("/audio/query/me", params={"limit": 3, "source": "uploaded"})
+    assert response.status_code == 200, response.json()
+    data = response.json()
+    assert data["ids"] == upload_ids[:1:-1]
+    assert data["total"] == 5
+    response = app_client.get(
+        "/audio/query/me", params={"limit": 3, "source": "uploaded", "cursor": data["next_cursor"]}
+    )
+    assert response.status_code == 200, response.json()
+    data = response.json()
+    assert data["ids"] == upload_ids[1::-1]
+    assert data["next_cursor"] is None
+
     # Gets the URL for a sample.
     response = app_client.get(f"/audio/media/{id_list[0]}.flac", params={"access_token": token})
     assert response.status_code == 200, response.json()
+    etag, content = response.headers["ETag"], response.content
+
+    # Tests conditional and range requests for the sample.
+    media_url = f"/audio/media/{id_list[0]}.flac"
+    response = app_client.get(media_url, params={"access_token": token}, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    response = app_client.get(media_url, params={"access_token": token}, headers={"Range": "bytes=10-19"})
+    assert response.status_code == 206
+    assert response.content == content[10:20]
+    assert response.headers["Content-Range"] == f"bytes 10-19/{len(content)}"
+    response = app_client.get(media_url, params={"access_token": token}, headers={"Range": f"bytes={len(content)}-"})
+    assert response.status_code == 416
+
+    # Tests uploading a file to be converted in the background.
+    response = app_client.post(
+        "/audio/upload/async", files={"file": ("test.wav", audio_file_raw)}, data={"source": "uploaded"}
+    )
+    assert response.status_code == 200, response.json()
+    async_id = response.json()["id"]
+    for _ in range(100):
+        response = app_client.get(f"/audio/status/{async_id}")
+        assert response.status_code == 200, response.json()
+        if response.json()["status"] != "pending":
+            break
+        time.sleep(0.05)
+    assert response.json()["status"] == "ready"
+    response = app_client.post("/audio/query/ids", json={"ids": [async_id]})
+    assert response.status_code == 200, response.json()
+    assert response.json()["infos"][0]["duration"] > 0
+    response = app_client.get("/admin/metrics")
+    assert response.status_code == 200, response.json()
+    assert response.json()["uploads"]["num_processed"] == 1
+
+    # Tests that uploads are rejected if the queue fills up while storing them.
+    response = app_client.get("/audio/query/me", params={"limit": 0, "source": "uploaded"})
+    assert response.status_code == 200, response.json()
+    num_uploaded = response.json()["total"]
+    mocker.patch("bot.api.pipeline.UploadPipeline.submit", return_value=False)
+    response = app_client.post(
+        "/audio/upload/async", files={"file": ("test.wav", audio_file_raw)}, data={"source": "uploaded"}
+    )
+    assert response.status_code == 503, response.json()
+    response = app_client.get("/audio/query/me", params={"limit": 0, "source": "uploaded"})
+    assert response.status_code == 200, response.json()
+    assert response.json()["total"] == num_uploaded
 
     # Gets information about the uploaded audio samples.
     response = app_client.post("/audio/query/ids", json={"ids": upload_ids})
@@ -55,10 +134,30 @@ async def test_audio_functions(
     data = response.json()
     assert len(data["infos"]) == 5
 
+    # Gets the waveform peaks for the uploaded audio samples.
+    response = app_client.post("/audio/query/peaks", json={"ids": upload_ids, "num_bins": 256})
+    assert response.status_code == 200, response.json()
+    data = response.json()
+    assert {d["id"] for d in data["infos"]} == set(upload_ids)
+    assert all(len(d["min"]) == len(d["max"]) == 256 for d in data["infos"])
+    assert all(min(d["min"]) < 0 < max(d["max"]) for d in data["infos"])
+
     # Updates the name for a sample.
     response = app_client.post("/audio/update", json={"id": upload_ids[0], "name": "test"})
     assert response.status_code == 200, response.json()
 
+    # Tests searching the audio files by name.
+    response = app_client.post("/audio/update", json={"id": upload_ids[1], "name": "Favourite clip"})
+    assert response.status_code == 200, response.json()
+    response = app_client.get("/audio/query/me", params={"limit": 5, "q": "FAVOURITE"})
+    assert response.status_code == 200, response.json()
+    data = response.json()
+    assert data["ids"] == [upload_ids[1]]
+    assert data["total"] == 1
+    response = app_client.get("/audio/query/me", params={"limit": 5, "q": "test", "source": "recorded"})
+    assert response.status_code == 200, response.json()
+    assert response.json()["total"] == len(record_ids)
+
     # Makes some samples public.
     for i in range(2):
         response = app_client.post("/admin/act/content", json={"id": upload_ids[i], "public": True})
@@ -75,8 +174,50 @@ async def test_audio_functions(
     response = app_client.delete("/audio/delete", params={"id": upload_ids[0]})
     assert response.status_code == 200, response.json()
 
+    # Checks that the counts were updated, including the background upload.
+    response = app_client.get("/audio/query/me", params={"limit": 1, "source": "uploaded"})
+    assert response.status_code == 200, response.json()
+    assert response.json()["total"] == 5
+
     # Gets information about the uploaded audio samples.
     response = app_client.post("/audio/query/ids", json={"ids": upload_ids})
     assert response.status_code == 200, response.json()
     data = response.json()
     assert len(data["infos"]) == 4
+
+
+async def claim_and_process(audio_id: int, claimed_age: float) -> None:
+    from tortoise import timezone
+
+    from bot.api.audio import process_pending_audio
+    from bot.api.model import Audio
+
+    claimed_at = timezone.now() - datetime.timedelta(seconds=claimed_age)
+    await Audio.filter(id=audio_id).update(claimed_at=claimed_at)
+    await process_pending_audio(await Audio.get(id=audio_id))
+
+
+def test_pending_audio_claims(authenticated_user: tuple[TestClient, str, str], mocker: MockerFixture) -> None:
+    from bot.settings import settings
+
+    app_client, _, _ = authenticated_user
+
+    audio_file = io.BytesIO()
+    sf.write(audio_file, np.random.uniform(size=(8000,)) * 2 - 1, 24000, format="WAV")
+
+    # Leaves the upload pending, as if the process had been restarted.
+    mocker.patch("bot.api.pipeline.UploadPipeline.submit", return_value=True)
+    response = app_client.post(
+        "/audio/upload/async", files={"file": ("test.wav", audio_file.getvalue())}, data={"source": "uploaded"}
+    )
+    assert response.status_code == 200, response.json()
+    audio_id = response.json()["id"]
+    assert app_client.portal is not None
+
+    # Uploads which another process is converting are left alone.
+    app_client.portal.call(claim_and_process, audio_id, 0.0)
+    assert app_client.get(f"/audio/status/{audio_id}").json()["status"] == "pending"
+
+    # Uploads whose claim has gone stale are taken over.
+    app_client.portal.call(claim_and_process, audio_id, settings.upload.claim_timeout + 1)
+    assert app_client.get(f"/audio/status/{audio_id}").json()["status"] == "ready"
@@ -0,0 +1,101 @@
+"""Tests routing queries between the primary database and a read replica."""
+
+import asyncio
+import os
+import sqlite3
+from typing import Any
+
+import numpy as np
+import soundfile as sf
+from _pytest.legacypath import TempdirFactory
+from fastapi.testclient import TestClient
+from pytest_mock.plugin import MockerFixture
+from tortoise import Tortoise
+
+
+def get_replica_config(primary_path: str, replica_path: str) -> dict[str, Any]:
+    from bot.api.db import get_sqlite_config
+
+    config = get_sqlite_config()
+    config["connections"] = {
+        "default": {"engine": "tortoise.backends.sqlite", "credentials": {"file_path": primary_path}},
+        "read_replica": {"engine": "tortoise.backends.sqlite", "credentials": {"file_path": replica_path}},
+    }
+    return config
+
+
+async def create_schema(path: str) -> None:
+    from bot.api.db import get_sqlite_config
+
+    config = get_sqlite_config()
+    config["connections"]["default"]["credentials"] = {"file_path": path}
+    await Tortoise.init(config=config)
+    await Tortoise.generate_schemas()
+    await Tortoise.close_connections()
+
+
+def count_rows(path: str, table: str) -> int:
+    with sqlite3.connect(path) as conn:
+        return conn.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0]
+
+
+def test_read_replica_routing(mocker: MockerFixture, tmpdir_factory: TempdirFactory) -> None:
+    from bot.api.app.main import app
+    from bot.api.db import get_route_counts
+    from bot.api.email import OneTimePassPayload
+    from bot.settings import settings
+
+    # The two databases aren't replicated, so any row which is read from the
+    # replica must have been written there directly.
+    db_root_dir = tmpdir_factory.mktemp("db")
+    primary_path, replica_path = str(db_root_dir / "primary.db"), str(db_root_dir / "replica.db")
+    asyncio.run(create_schema(replica_path))
+    mocker.patch("bot.api.app.main.get_config", return_value=get_replica_config(primary_path, replica_path))
+
+    file_root_dir = tmpdir_factory.mktemp("files")
+    audio_file_path = os.path.join(file_root_dir, "test.wav")
+    sf.write(audio_file_path, np.random.uniform(size=(8000,)) * 2 - 1, 24000)
+    with open(audio_file_path, "rb") as f:
+        audio_file_raw = f.read()
+
+    with TestClient(app) as app_client:
+        counts = get_route_counts()
+
+        # Writes, including the ones made in transactions, go to the primary.
+        otp = OneTimePassPayload(email="ben@dpsh.dev")
+        response = app_client.post("/users/otp", json={"payload": otp.encode()})
+        assert response.status_code == 200, response.json()
+        response = app_client.post("/users/refresh")
+        assert response.status_code == 200, response.json()
+        response = app_client.post(
+            "/audio/upload", files={"file": ("test.wav", audio_file_raw)}, data={"source": "uploaded"}
+        )
+        assert response.status_code == 200, response.json()
+        audio_id = response.json()["id"]
+        assert count_rows(primary_path, "audio") == 1
+        assert count_rows(replica_path, "audio") == 0
+        assert count_rows(replica_path, "user") == 0
+        assert get_route_counts().get("read_replica", 0) == counts.get("read_replica", 0)
+
+        # Reads from routes which don't opt in stay on the primary.
+        response = app_client.get(f"/audio/status/{audio_id}")
+        assert response.status_code == 200, response.json()
+        assert response.json()["status"] == "ready"
+        assert get_route_counts().get("read_replica", 0) == counts.get("read_replica", 0)
+
+        # Reads from read-only routes go to the replica, which doesn't have
+        # the public audio.
+        with sqlite3.connect(primary_path) as conn:
+            conn.execute('UPDATE "audio" SET "public" = 1 WHERE "id" = ?', (audio_id,))
+        response = app_client.post("/audio/public", json={"count": 10})
+        assert response.status_code == 200, response.json()
+        assert response.json()["infos"] == []
+        assert get_route_counts()["read_replica"] > counts.get("read_replica", 0)
+
+        # Lookups of IDs which were just returned by a write stay on the
+        # primary, so that they don't miss because of replication lag.
+        response = app_client.get(f"/audio/media/{audio_id}.{settings.file.audio.file_ext}")
+        assert response.status_code == 200
+        response = app_client.post("/audio/query/ids", json={"ids": [audio_id]})
+        assert response.status_code == 200, response.json()
+        assert [info["id"] for info in response.json()["infos"]] == [audio_id]
@@ -1,6 +1,7 @@
 """Tests the generation API functions."""
 
 import os
+import time
 
 import numpy as np
 import soundfile as sf
@@ -48,6 +49,21 @@ async def test_generation_functions(
         data = response.json()
         ids.append(data["id"])
 
+    # Tests that audio which failed to convert is rejected.
+    response = app_client.post(
+        "/audio/upload/async", files={"file": ("test.wav", b"invalid")}, data={"source": "uploaded"}
+    )
+    assert response.status_code == 200, response.json()
+    failed_id = response.json()["id"]
+    for _ in range(100):
+        if app_client.get(f"/audio/status/{failed_id}").json()["status"] != "pending":
+            break
+        time.sleep(0.05)
+    response = app_client.get(f"/audio/status/{failed_id}")
+    assert response.json()["status"] == "failed"
+    response = app_client.post("/infer/run", json={"source_id": failed_id, "reference_id": ids[1]})
+    assert response.status_code == 400, response.json()
+
     # Tests running the model on the two uploaded files.
     gen_ids: list[str] = []
     for _ in range(3):
@@ -77,3 +93,10 @@ async def test_generation_functions(
     response = app_client.get("/generation/query/me", params={"start": 0, "limit": 5})
     assert response.status_code == 200, response.json()
     assert len(response.json()["generations"]) == 3
+    response = app_client.get("/generation/query/me", params={"limit": 2})
+    assert response.status_code == 200, response.json()
+    data = response.json()
+    assert [g["id"] for g in data["generations"]] == gen_ids[:0:-1]
+    response = app_client.get("/generation/query/me", params={"limit": 2, "cursor": data["next_cursor"]})
+    assert response.status_code == 200, response.json()
+    assert [g["id"] for g in response.json()["generations"]] == gen_ids[:1]
@@ -0,0 +1,141 @@
+"""Tests the job which removes audio blobs that are no longer needed."""
+
+import json
+import os
+import sys
+import time
+import uuid
+from uuid import UUID
+
+import pytest
+from _pytest.capture import CaptureFixture
+from _pytest.legacypath import TempdirFactory
+from fastapi.testclient import TestClient
+from pytest_mock.plugin import MockerFixture
+
+from bot.api.audio import get_object_name, get_sidecar_name, get_upload_name
+from bot.api.model import Audio, AudioDeleteTask, AudioSource, AudioStatus, User
+from bot.api.storage import FileStorage, MemoryStorage, Storage
+from bot.api.sweeper import SweepStats, delete_orphans, drain_delete_tasks, main
+
+
+async def create_audio(email: str, status: str) -> UUID:
+    user = await User.get(email=email)
+    audio = await Audio.create(
+        key=uuid.uuid4(),
+        name="test",
+        user=user,
+        source=AudioSource.uploaded,
+        num_frames=100,
+        num_channels=1,
+        sample_rate=16000,
+        duration=1.0,
+        status=AudioStatus(status),
+    )
+    return audio.key
+
+
+async def create_delete_task(key: UUID) -> None:
+    await AudioDeleteTask.create(key=key)
+
+
+async def count_delete_tasks() -> int:
+    return await AudioDeleteTask.all().count()
+
+
+async def run_sweep(storage: Storage, grace_period: float, dry_run: bool) -> SweepStats:
+    objects = {info.name: info async for info in storage.list_objects()}
+    stats = SweepStats()
+    await drain_delete_tasks(storage, objects, stats, 2, dry_run)
+    await delete_orphans(storage, objects, stats, 2, grace_period, dry_run)
+    return stats
+
+
+async def list_names(storage: Storage) -> set[str]:
+    return {info.name async for info in storage.list_objects()}
+
+
+@pytest.mark.parametrize("storage_type", ["memory", "file"])
+def test_sweeper(
+    storage_type: str,
+    authenticated_user: tuple[TestClient, str, str],
+    tmpdir_factory: TempdirFactory,
+) -> None:
+    app_client, test_email, _ = authenticated_user
+    assert app_client.portal is not None
+
+    storage: Storage
+    match storage_type:
+        case "memory":
+            storage = MemoryStorage()
+        case "file":
+            storage = FileStorage(str(tmpdir_factory.mktemp("storage")))
+        case _:
+            raise ValueError(storage_type)
+
+    live_key = app_client.portal.call(create_audio, test_email, "ready")
+    pending_key = app_client.portal.call(create_audio, test_email, "pending")
+    deleted_key, old_orphan_key, new_orphan_key = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+    app_client.portal.call(create_delete_task, deleted_key)
+
+    old_names = [
+        get_object_name(live_key),
+        get_sidecar_name(live_key),
+        get_upload_name(pending_key),
+        get_object_name(deleted_key),
+        get_sidecar_name(deleted_key),
+        get_object_name(old_orphan_key),
+        get_sidecar_name(old_orphan_key),
+    ]
+    new_names = [get_object_name(new_orphan_key), get_upload_name(new_orphan_key)]
+    for name in old_names + new_names:
+        app_client.portal.call(storage.put, name, b"data")
+
+    # Backdates the objects which should be past the grace period.
+    old_time = time.time() - 7200
+    for name in old_names:
+        if isinstance(storage, MemoryStorage):
+            storage.modified[name] = old_time
+        else:
+            os.utime(storage.get_path(name), (old_time, old_time))
+    all_names = set(old_names + new_names)
+
+    # Dry runs only report what would be deleted.
+    stats = app_client.portal.call(run_sweep, storage, 3600.0, True)
+    assert (stats.num_tasks, stats.num_task_objects, stats.num_orphans) == (1, 2, 2)
+    assert stats.reclaimed_bytes == 16
+    assert app_client.portal.call(list_names, storage) == all_names
+    assert app_client.portal.call(count_delete_tasks) == 1
+
+    stats = app_client.portal.call(run_sweep, storage, 3600.0, False)
+    assert (stats.num_tasks, stats.num_task_objects, stats.num_orphans) == (1, 2, 2)
+    assert app_client.portal.call(list_names, storage) == {
+        get_object_name(live_key),
+        get_sidecar_name(live_key),
+        get_upload_name(pending_key),
+        *new_names,
+    }
+    assert app_client.portal.call(count_delete_tasks) == 0
+
+    # Nothing is left to sweep on a second pass.
+    stats = app_client.portal.call(run_sweep, storage, 3600.0, False)
+    assert stats.reclaimed_bytes == 0
+
+
+def test_sweeper_cli_dry_run(mocker: MockerFixture, capsys: CaptureFixture) -> None:
+    mocker.patch("bot.api.sweeper.configure_logging")
+    mock_sweep = mocker.patch("bot.api.sweeper.sweep", return_value=SweepStats(num_orphans=1, orphan_bytes=4))
+    mocker.patch.object(sys, "argv", ["sweeper", "--grace-period", "60", "--dry-run"])
+
+    main()
+
+    mock_sweep.assert_called_once_with(1000, 60.0, True)
+    assert json.loads(capsys.readouterr().out) == {
+        "num_tasks": 0,
+        "num_task_objects": 0,
+        "task_bytes": 0,
+        "num_orphans": 1,
+        "orphan_bytes": 4,
+        "reclaimed_bytes": 4,
+        "dry_run": True,
+    }
@@ -1,5 +1,9 @@
 """Runs tests on the user APIs."""
 
+import io
+
+import numpy as np
+import soundfile as sf
 from fastapi.testclient import TestClient
 from pytest_mock.plugin import MockType
 
@@ -18,6 +22,12 @@ def test_user_auth_functions(app_client: TestClient, mock_send_email: MockType)
     otp = OneTimePassPayload(email=bad_actor_email)
     response = app_client.post("/users/otp", json={"payload": otp.encode()})
     assert response.status_code == 200, response.json()
+    bad_actor_refresh_headers = {"Authorization": f"Bearer {response.json()['token']}"}
+    response = app_client.post("/users/refresh", headers=bad_actor_refresh_headers)
+    assert response.status_code == 200, response.json()
+    bad_actor_session_headers = {"Authorization": f"Bearer {response.json()['token']}"}
+    response = app_client.delete("/users/logout")
+    assert response.status_code == 200, response.json()
 
     # Sends an email to the user with their one-time pass.
     response = app_client.post(
@@ -77,12 +87,27 @@ def test_user_auth_functions(app_client: TestClient, mock_send_email: MockType)
     response = app_client.post("/admin/act/user", json={"email": bad_actor_email, "banned": True})
     assert response.status_code == 200, response.json()
 
+    # Tests that the bad actor's existing tokens stop working.
+    response = app_client.get("/users/me", headers=bad_actor_session_headers)
+    assert response.status_code == 401, response.json()
+    assert response.json()["detail"] == "User is not allowed to log in"
+    response = app_client.post("/users/refresh", headers=bad_actor_refresh_headers)
+    assert response.status_code == 401, response.json()
+
     # Tests logging in the bad actor user again, to make sure it's banned.
     otp = OneTimePassPayload(email=bad_actor_email)
     response = app_client.post("/users/otp", json={"payload": otp.encode()})
     assert response.status_code == 401, response.json()
     assert response.json()["detail"] == "User is not allowed to log in"
 
+    # Tests that the bad actor can still delete their account.
+    response = app_client.delete("/users/me", headers=bad_actor_session_headers)
+    assert response.status_code == 200, response.json()
+    assert response.json() is True
+    response = app_client.delete("/users/me", headers=bad_actor_session_headers)
+    assert response.status_code == 400, response.json()
+    assert response.json()["detail"] == "User not found"
+
     # Delete the user.
     response = app_client.delete("/users/me")
     assert response.status_code == 200, response.json()
@@ -92,3 +117,42 @@ def test_user_auth_functions(app_client: TestClient, mock_send_email: MockType)
     response = app_client.get("/users/me")
     assert response.status_code == 400, response.json()
     assert response.json()["detail"] == "User not found"
+
+
+def test_delete_user_updates_counters(app_client: TestClient) -> None:
+    audio_file = io.BytesIO()
+    sf.write(audio_file, np.random.uniform(size=(8000,)) * 2 - 1, 24000, format="WAV")
+
+    def log_in(email: str) -> dict[str, str]:
+        otp = OneTimePassPayload(email=email)
+        response = app_client.post("/users/otp", json={"payload": otp.encode()})
+        assert response.status_code == 200, response.json()
+        response = app_client.post("/users/refresh", headers={"Authorization": f"Bearer {response.json()['token']}"})
+        assert response.status_code == 200, response.json()
+        app_client.cookies.clear()
+        return {"Authorization": f"Bearer {response.json()['token']}"}
+
+    def upload(headers: dict[str, str]) -> int:
+        files = {"file": ("test.wav", audio_file.getvalue())}
+        response = app_client.post("/audio/upload", files=files, data={"source": "uploaded"}, headers=headers)
+        assert response.status_code == 200, response.json()
+        return response.json()["id"]
+
+    owner_headers, other_headers = log_in("owner@dpsh.dev"), log_in("other@dpsh.dev")
+
+    # The other user converts their audio using the owner's audio.
+    owner_id, other_id = upload(owner_headers), upload(other_headers)
+    response = app_client.post(
+        "/infer/run", json={"source_id": other_id, "reference_id": owner_id}, headers=other_headers
+    )
+    assert response.status_code == 200, response.json()
+    response = app_client.get("/generation/info/me", headers=other_headers)
+    assert response.status_code == 200, response.json()
+    assert response.json()["count"] == 1
+
+    # Deleting the owner cascades to the other user's generation.
+    response = app_client.delete("/users/me", headers=owner_headers)
+    assert response.status_code == 200, response.json()
+    response = app_client.get("/generation/info/me", headers=other_headers)
+    assert response.status_code == 200, response.json()
+    assert response.json()["count"] == 0
@@ -1,5 +1,6 @@
 """Tests the worker endpoint."""
 
+import asyncio
 import os
 
 import numpy as np
@@ -9,6 +10,7 @@ from aiohttp.test_utils import TestClient as AsyncTestClient
 from fastapi.testclient import TestClient
 
 from bot.api.email import OneTimePassPayload
+from bot.api.model import Task
 
 
 async def test_worker_endpoint(
@@ -55,3 +57,32 @@ async def test_worker_endpoint(
     data = await response.json()
     assert isinstance(data["output_id"], int)
     assert isinstance(data["generation_id"], int)
+
+    # Checks that the per-stage timings were recorded for the task.
+    task = await Task.get(generation_id=data["generation_id"])
+    assert isinstance(task.timings, dict)
+    assert task.timings["diffusion_steps"] > 0
+    assert {"hubert", "autoencoder_encode", "speaker_encoder", "diffusion", "vocoder_decode"} <= task.timings.keys()
+
+
+async def test_worker_swap_model(infer_client: AsyncTestClient) -> None:
+    response = await infer_client.get("/model")
+    assert response.status == 200
+    assert (await response.json())["key"] == "test"
+
+    # Swaps to the same model key, which should load a fresh copy.
+    response = await infer_client.post("/model", params={"key": "test"})
+    assert response.status == 202
+
+    # Waits for the swap to finish.
+    for _ in range(100):
+        response = await infer_client.get("/model")
+        data = await response.json()
+        if data["pending"] is None:
+            break
+        await asyncio.sleep(0.1)
+    assert data == {"key": "test", "pending": None}
+
+    # Checks that malformed keys are rejected.
+    response = await infer_client.post("/model", params={"key": "invalid"})
+    assert response.status == 400
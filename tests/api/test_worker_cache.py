@@ -0,0 +1,56 @@
+"""Tests the worker's audio cache."""
+
+import os
+from uuid import UUID
+
+import numpy as np
+import soundfile as sf
+from _pytest.legacypath import TempdirFactory
+from fastapi.testclient import TestClient
+
+
+async def get_keys(ids: list[int]) -> list[UUID]:
+    from bot.api.model import Audio
+
+    return [(await Audio.get(id=audio_id)).key for audio_id in ids]
+
+
+def test_audio_cache_purges_deleted(
+    authenticated_user: tuple[TestClient, str, str],
+    tmpdir_factory: TempdirFactory,
+) -> None:
+    from bot.worker.cache import AudioCache
+
+    app_client, _, _ = authenticated_user
+
+    file_root_dir = tmpdir_factory.mktemp("files")
+    audio_file_path = os.path.join(file_root_dir, "test.wav")
+    sf.write(audio_file_path, np.random.uniform(size=(8000,)) * 2 - 1, 24000)
+    with open(audio_file_path, "rb") as f:
+        audio_file_raw = f.read()
+
+    ids: list[int] = []
+    for _ in range(2):
+        files = {"file": ("test.wav", audio_file_raw)}
+        response = app_client.post("/audio/upload", files=files, data={"source": "uploaded"})
+        assert response.status_code == 200, response.json()
+        ids.append(response.json()["id"])
+    assert app_client.portal is not None
+    kept_key, deleted_key = app_client.portal.call(get_keys, ids)
+
+    # Files left on disk by a previous run are picked up by the disk tier.
+    cache_dir = tmpdir_factory.mktemp("cache")
+    for key in (kept_key, deleted_key):
+        np.save(os.path.join(cache_dir, f"{key}.npy"), np.zeros(10, dtype=np.int16))
+    cache = AudioCache(memory_mb=16, disk_mb=16, disk_dir=str(cache_dir))
+    for key in (kept_key, deleted_key):
+        app_client.portal.call(cache.load, key)
+
+    response = app_client.delete("/audio/delete", params={"id": ids[1]})
+    assert response.status_code == 200, response.json()
+
+    assert app_client.portal.call(cache.purge_deleted) == 1
+    assert os.path.exists(os.path.join(cache_dir, f"{kept_key}.npy"))
+    assert not os.path.exists(os.path.join(cache_dir, f"{deleted_key}.npy"))
+    assert cache.memory.keys() == [kept_key]
+    assert app_client.portal.call(cache.purge_deleted) == 0